@@ -0,0 +1,629 @@
+#!/usr/bin/env python3
+from dotenv import load_dotenv
+
+load_dotenv()
+import os
+import argparse
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict
+
+import numpy as np
+
+from giga.utils.logging import LOGGER
+from giga.schemas.school import GigaSchoolTable
+from giga.schemas.cellular import CellTowerTable
+from giga.schemas.geo import UniqueCoordinateTable, CoordinateArray, PairwiseDistance
+from giga.models.nodes.graph.vectorized_distance_model import VectorizedDistanceModel
+from giga.schemas.distance_cache import (
+    SingleLookupDistanceCache,
+    MultiLookupDistanceCache,
+    store_cache,
+    reuse_cache,
+    CACHE_OUTPUT_FORMATS,
+)
+from giga.data.store.compression import COMPRESSIONS
+from giga.schemas.cache_manifest import CacheManifest
+from giga.schemas.profile_store import PROFILE_DTYPES, DEFAULT_PROFILE_DTYPE
+from giga.app.create_p2p_distance_cache import (
+    P2PCacheCreator,
+    P2PCacheCreatorArgs,
+    DEFAULT_ELEVATION_WORKERS,
+    DEFAULT_LOS_WORKERS,
+)
+from giga.app.create_school_visibility_cache import (
+    VisibilityCacheCreator,
+    VisibilityCacheCreatorArgs,
+)
+from giga.schemas.link_checkpoint import LinkCheckpoint
+from giga.data.store.stores import COUNTRY_DATA_STORE as data_store
+
+
+CACHE_NAMES = ["fiber", "cellular", "school", "p2p", "school_visibility"]
+
+
+class CacheBuildArgs:
+    workspace_directory: str = None
+    caches: List[str] = CACHE_NAMES
+    n_nearest_neighbors: int = 20
+    maximum_distance_meters: float = math.inf
+    visibility_n_nearest_neighbors: int = 5
+    visibility_maximum_distance_meters: float = 65000
+    n_elevation_profile_samples: int = 4
+    los_buffer_meters: float = 5
+    receiver_height_meters: float = 5
+    include_connected: bool = False
+    n_workers: int = len(CACHE_NAMES)
+    file_suffix: str = "_cache"
+    output_format: str = "both"
+    compression: str = None
+    replace: bool = False
+    dem_directory: str = None
+    earth_curvature: bool = False
+    fresnel_frequency_ghz: float = None
+    store_profiles: bool = True
+    profile_dtype: str = DEFAULT_PROFILE_DTYPE
+    n_elevation_workers: int = DEFAULT_ELEVATION_WORKERS
+    n_los_workers: int = DEFAULT_LOS_WORKERS
+    resume: bool = True
+    progress_bar: bool = False
+
+
+def to_pairs(
+    set1: CoordinateArray,
+    set2: CoordinateArray,
+    idxs: List[np.ndarray],
+    distances: List[np.ndarray],
+    rows=None,
+    n_neighbors: float = math.inf,
+    maximum_distance: float = math.inf,
+) -> List[PairwiseDistance]:
+    """
+    Materializes shared neighbors into pairs (coordinate, neighbor), as the distance
+    model would return them for a query of the n nearest neighbors within the maximum
+    distance
+    :param idxs, distances, the sorted neighbors of the rows of the first set in the
+      second set
+    :param rows, the rows of the first set to materialize, all rows by default
+    """
+    rows = range(len(set1)) if rows is None else rows
+    pairs = []
+    for i in rows:
+        c1 = set1.coordinate(i)
+        n = len(idxs[i]) if n_neighbors == math.inf else int(n_neighbors)
+        for j, d in zip(idxs[i][:n].tolist(), distances[i][:n].tolist()):
+            if d > maximum_distance:
+                break
+            c2 = set2.coordinate(j)
+            pairs.append(
+                PairwiseDistance(
+                    pair_ids=(c1.coordinate_id, c2.coordinate_id),
+                    coordinate1=c1,
+                    coordinate2=c2,
+                    distance=d,
+                )
+            )
+    return pairs
+
+
+class CacheBuildPipeline:
+    """
+    Builds the distance caches of a workspace in a single pass. Input files are read
+    once, the school to school and school to tower neighbors are computed once and
+    shared by the caches that need them, the caches are then built concurrently and each
+    one is written to the cache store as soon as it completes. Caches whose inputs and
+    parameters match a stored cache are reused instead of built. The line of sight of
+    the P2P and school visibility links is evaluated with the worker pools of the link
+    builders and checkpointed, an interrupted build resumes from it. The caches are the
+    same as the ones of the individual cache builders with the same parameters.
+    """
+
+    args: CacheBuildArgs = None
+
+    def __init__(self, args: CacheBuildArgs):
+        self.args = args
+        self._manifests: Dict[str, CacheManifest] = None
+        # checkpoints of the caches being built, cleared once the cache is stored
+        self._checkpoints: Dict[str, LinkCheckpoint] = {}
+
+    def _path(self, file):
+        return os.path.join(self.args.workspace_directory, file)
+
+    def _file(self, name):
+        return f"{name}{self.args.file_suffix}.json"
+
+    def _p2p_creator(self, **kwargs) -> P2PCacheCreator:
+        args = P2PCacheCreatorArgs()
+        args.workspace_directory = self.args.workspace_directory
+        args.n_nearest_neighbors = self.args.n_nearest_neighbors
+        args.maximum_distance_meters = self.args.maximum_distance_meters
+        args.n_elevation_profile_samples = self.args.n_elevation_profile_samples
+        args.los_buffer_meters = self.args.los_buffer_meters
+        args.receiver_height_meters = self.args.receiver_height_meters
+        args.progress_bar = self.args.progress_bar
+        args.file_suffix = self.args.file_suffix
+        args.dem_directory = self.args.dem_directory
+        args.earth_curvature = self.args.earth_curvature
+        args.fresnel_frequency_ghz = self.args.fresnel_frequency_ghz
+        args.profile_dtype = self.args.profile_dtype
+        args.n_elevation_workers = self.args.n_elevation_workers
+        args.n_los_workers = self.args.n_los_workers
+        args.resume = self.args.resume
+        args.export_to_file = False
+        return P2PCacheCreator(args, **kwargs)
+
+    def _visibility_creator(self, **kwargs) -> VisibilityCacheCreator:
+        args = VisibilityCacheCreatorArgs()
+        args.workspace_directory = self.args.workspace_directory
+        args.n_nearest_neighbors = self.args.visibility_n_nearest_neighbors
+        args.maximum_distance_meters = self.args.visibility_maximum_distance_meters
+        args.n_elevation_profile_samples = self.args.n_elevation_profile_samples
+        args.los_buffer_meters = self.args.los_buffer_meters
+        args.receiver_height_meters = self.args.receiver_height_meters
+        args.include_connected = self.args.include_connected
+        args.progress_bar = self.args.progress_bar
+        args.file_suffix = self.args.file_suffix
+        args.dem_directory = self.args.dem_directory
+        args.earth_curvature = self.args.earth_curvature
+        args.fresnel_frequency_ghz = self.args.fresnel_frequency_ghz
+        args.profile_dtype = self.args.profile_dtype
+        args.n_elevation_workers = self.args.n_elevation_workers
+        args.n_los_workers = self.args.n_los_workers
+        args.resume = self.args.resume
+        args.export_to_file = False
+        return VisibilityCacheCreator(args, **kwargs)
+
+    @property
+    def manifests(self) -> Dict[str, CacheManifest]:
+        """
+        Manifests of the caches, identical to the ones of the individual cache builders
+        """
+        if self._manifests is None:
+            parameters = dict(
+                n_nearest_neighbors=self.args.n_nearest_neighbors,
+                maximum_distance_meters=self.args.maximum_distance_meters,
+                include_connected=self.args.include_connected,
+            )
+            workspace = self.args.workspace_directory
+            suffix = self.args.file_suffix
+            self._manifests = {
+                "fiber": CacheManifest.from_workspace(
+                    workspace,
+                    f"fiber{suffix}",
+                    ["schools.csv", "fiber.csv"],
+                    **parameters,
+                ),
+                "cellular": CacheManifest.from_workspace(
+                    workspace,
+                    f"cellular{suffix}",
+                    ["schools.csv", "cellular.csv"],
+                    **parameters,
+                ),
+                "school": CacheManifest.from_workspace(
+                    workspace, f"school{suffix}", ["schools.csv"], **parameters
+                ),
+                "p2p": self._p2p_creator().manifest(),
+                "school_visibility": self._visibility_creator().manifest(),
+            }
+        return self._manifests
+
+    def load_inputs(self):
+        """Reads the school, fiber and cell tower files of the workspace once"""
+        self.schools = GigaSchoolTable.from_csv(self._path("schools.csv"))
+        self.all_schools = self.schools.to_coordinate_array()
+        if self.args.include_connected:
+            self.unconnected_rows = np.arange(len(self.schools.schools))
+        else:
+            LOGGER.info("Removing schools that are already connected from school set")
+            self.unconnected_rows = np.array(
+                [i for i, s in enumerate(self.schools.schools) if not s.connected],
+                dtype=np.intp,
+            )
+        self.unconnected_schools = self.all_schools.take(self.unconnected_rows)
+        if data_store.is_file(self._path("fiber.csv")):
+            self.fiber = UniqueCoordinateTable.array_from_csv(self._path("fiber.csv"))
+        else:
+            self.fiber = CoordinateArray([], np.empty((0, 2)))
+        if data_store.is_file(self._path("cellular.csv")):
+            self.towers = CellTowerTable.from_csv(self._path("cellular.csv"))
+        else:
+            self.towers = CellTowerTable(towers=[])
+        self.tower_coordinates = self.towers.to_coordinate_array()
+
+    def compute_neighbors(self, pending: List[str]):
+        """
+        Computes the neighbor sets shared by the caches once, with the largest number of
+        neighbors and maximum distance of the caches that use them, each cache then
+        takes its own nearest neighbors
+        """
+        if "school" in pending or "school_visibility" in pending:
+            n = [self.args.n_nearest_neighbors] if "school" in pending else []
+            d = [self.args.maximum_distance_meters] if "school" in pending else []
+            if "school_visibility" in pending:
+                n.append(self.args.visibility_n_nearest_neighbors)
+                d.append(self.args.visibility_maximum_distance_meters)
+            LOGGER.info("Computing school neighbors")
+            model = VectorizedDistanceModel(
+                n_nearest_neighbors=max(n), maximum_distance=max(d)
+            )
+            self.school_neighbors = model.neighbors(
+                (self.unconnected_schools, self.unconnected_schools)
+            )
+        if "cellular" in pending or "p2p" in pending:
+            LOGGER.info("Computing cell tower neighbors")
+            model = VectorizedDistanceModel(
+                n_nearest_neighbors=self.args.n_nearest_neighbors,
+                maximum_distance=self.args.maximum_distance_meters,
+            )
+            self.tower_neighbors = model.neighbors(
+                (self.all_schools, self.tower_coordinates)
+            )
+
+    def build_fiber(self) -> SingleLookupDistanceCache:
+        if len(self.fiber) == 0:
+            LOGGER.warning(
+                f"No fiber nodes in {self.args.workspace_directory}, "
+                "skipping the fiber cache"
+            )
+            return None
+        model = VectorizedDistanceModel(
+            n_nearest_neighbors=self.args.n_nearest_neighbors,
+            maximum_distance=self.args.maximum_distance_meters,
+        )
+        idxs, distances = model.neighbors((self.unconnected_schools, self.fiber))
+        pairs = to_pairs(
+            self.unconnected_schools, self.fiber, idxs, distances, n_neighbors=1
+        )
+        return SingleLookupDistanceCache.from_distances(pairs)
+
+    def build_cellular(self) -> SingleLookupDistanceCache:
+        if len(self.tower_coordinates) == 0:
+            LOGGER.warning(
+                f"No cell towers in {self.args.workspace_directory}, "
+                "skipping the cellular cache"
+            )
+            return None
+        pairs = to_pairs(
+            self.all_schools,
+            self.tower_coordinates,
+            *self.tower_neighbors,
+            rows=self.unconnected_rows.tolist(),
+            n_neighbors=1,
+        )
+        return SingleLookupDistanceCache.from_distances(pairs)
+
+    def build_school(self) -> MultiLookupDistanceCache:
+        pairs = to_pairs(
+            self.unconnected_schools,
+            self.unconnected_schools,
+            *self.school_neighbors,
+            n_neighbors=self.args.n_nearest_neighbors,
+            maximum_distance=self.args.maximum_distance_meters,
+        )
+        return MultiLookupDistanceCache.from_distances(
+            pairs, n_neighbors=self.args.n_nearest_neighbors
+        )
+
+    def build_p2p(self) -> SingleLookupDistanceCache:
+        if len(self.tower_coordinates) == 0:
+            LOGGER.warning(
+                f"No cell towers in {self.args.workspace_directory}, "
+                "skipping the P2P cache"
+            )
+            return None
+        creator = self._p2p_creator(
+            towers={t.to_coordinates().coordinate_id: t for t in self.towers.towers},
+            school_coords=self.all_schools.to_coordinates(),
+            collect_profiles=self.args.store_profiles,
+        )
+        pairs = to_pairs(
+            self.all_schools, self.tower_coordinates, *self.tower_neighbors
+        )
+        dists_towers = MultiLookupDistanceCache.from_distances(pairs)
+        checkpoint = creator.open_checkpoint(self.manifests["p2p"])
+        self._checkpoints["p2p"] = checkpoint
+        closest_visible_towers = creator.visible_links(
+            creator.school_coords, dists_towers.lookup, checkpoint
+        )
+        if self.args.store_profiles:
+            creator.save_profiles(self.manifests["p2p"])
+        return SingleLookupDistanceCache.from_distances(
+            [p.reversed() for p in closest_visible_towers]
+        )
+
+    def build_school_visibility(self) -> MultiLookupDistanceCache:
+        school_coords = self.unconnected_schools.to_coordinates()
+        creator = self._visibility_creator(
+            school_coords=school_coords, collect_profiles=self.args.store_profiles
+        )
+        n_neighbors = self.args.visibility_n_nearest_neighbors
+        pairs = to_pairs(
+            self.unconnected_schools,
+            self.unconnected_schools,
+            *self.school_neighbors,
+            n_neighbors=n_neighbors,
+            maximum_distance=self.args.visibility_maximum_distance_meters,
+        )
+        school_cache = MultiLookupDistanceCache.from_distances(
+            pairs, n_neighbors=n_neighbors
+        )
+        checkpoint = creator.open_checkpoint(self.manifests["school_visibility"])
+        self._checkpoints["school_visibility"] = checkpoint
+        closest_visible_schools = creator.visible_links(
+            school_coords, school_cache.lookup, checkpoint
+        )
+        if self.args.store_profiles:
+            creator.save_profiles(self.manifests["school_visibility"])
+        return MultiLookupDistanceCache.from_distances(
+            closest_visible_schools, n_neighbors=n_neighbors
+        )
+
+    def run(self) -> List[str]:
+        """
+        Builds the configured caches that are not up to date
+        :return the names of the caches that were built
+        """
+        for name in self.args.caches:
+            assert name in CACHE_NAMES, f"Unsupported cache {name}"
+        pending = [
+            name
+            for name in self.args.caches
+            if self.args.replace
+            or not reuse_cache(
+                self.args.workspace_directory,
+                self._file(name),
+                self.manifests[name],
+                compression=self.args.compression,
+            )
+        ]
+        if len(pending) == 0:
+            return []
+        self.load_inputs()
+        self.compute_neighbors(pending)
+        builders = {
+            "fiber": self.build_fiber,
+            "cellular": self.build_cellular,
+            "school": self.build_school,
+            "p2p": self.build_p2p,
+            "school_visibility": self.build_school_visibility,
+        }
+        built, failed = [], []
+        with ThreadPoolExecutor(max_workers=max(1, self.args.n_workers)) as pool:
+            futures = {pool.submit(builders[name]): name for name in pending}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    cache = future.result()
+                except Exception as e:
+                    LOGGER.error(f"Failed to build the {name} cache: {e}")
+                    failed.append(name)
+                    continue
+                if cache is None:
+                    continue
+                store_cache(
+                    cache,
+                    self.args.workspace_directory,
+                    self._file(name),
+                    self.manifests[name],
+                    self.args.output_format,
+                    compression=self.args.compression,
+                )
+                LOGGER.info(
+                    f"Stored {self._file(name)} in {self.args.workspace_directory}"
+                )
+                if name in self._checkpoints:
+                    self._checkpoints.pop(name).clear()
+                built.append(name)
+        if len(failed) > 0:
+            raise RuntimeError(f"Failed to build caches: {', '.join(failed)}")
+        return built
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    required = parser.add_argument_group("required arguments")
+    required.add_argument("--workspace-directory", "-w", required=True)
+    optional = parser.add_argument_group("optional arguments")
+    optional.add_argument(
+        "--caches",
+        "-c",
+        nargs="+",
+        choices=CACHE_NAMES,
+        default=CACHE_NAMES,
+        help="Specifies the caches to build",
+    )
+    optional.add_argument(
+        "--n-nearest-neighbors",
+        "-nn",
+        type=int,
+        default=20,
+        help=(
+            "Specifies the number of nearest neighbors to use for the fiber, cellular,"
+            " school and P2P caches"
+        ),
+    )
+    optional.add_argument(
+        "--maximum-distance-meters",
+        "-md",
+        type=float,
+        default=math.inf,
+        help=(
+            "Specifies the maximum distance to consider for the fiber, cellular, "
+            "school and P2P caches"
+        ),
+    )
+    optional.add_argument(
+        "--visibility-n-nearest-neighbors",
+        "-vnn",
+        type=int,
+        default=5,
+        help=(
+            "Specifies the number of nearest neighbors to use for the school "
+            "visibility cache"
+        ),
+    )
+    optional.add_argument(
+        "--visibility-maximum-distance-meters",
+        "-vmd",
+        type=float,
+        default=65000,
+        help=(
+            "Specifies the maximum distance to consider for the school visibility "
+            "cache"
+        ),
+    )
+    optional.add_argument(
+        "--n-elevation-profile-samples",
+        "-es",
+        type=int,
+        default=4,
+        help="Specifies the number of samples to use for the elevation profile",
+    )
+    optional.add_argument(
+        "--los-buffer-meters",
+        "-lb",
+        type=float,
+        default=5,
+        help="Specifies the buffer to use for the line-of-sight model",
+    )
+    optional.add_argument(
+        "--receiver-height-meters",
+        "-rh",
+        type=float,
+        default=5,
+        help="Specifies the height of the school-side receiver in meters",
+    )
+    optional.add_argument(
+        "--include-connected",
+        "-ic",
+        action="store_true",
+        help="Specifies whether to include already connected schools in the caches",
+        default=False,
+    )
+    optional.add_argument(
+        "--n-workers",
+        "-nw",
+        type=int,
+        default=len(CACHE_NAMES),
+        help="Specifies the number of caches built concurrently",
+    )
+    optional.add_argument(
+        "--file-suffix",
+        "-fs",
+        type=str,
+        default="_cache",
+        help="Specifies the suffix to use for the cache files",
+    )
+    optional.add_argument(
+        "--output-format",
+        "-of",
+        type=str,
+        choices=CACHE_OUTPUT_FORMATS,
+        default="both",
+        help=(
+            "Specifies whether to write the caches as json, in the binary memory-"
+            "mapped format or both"
+        ),
+    )
+    optional.add_argument(
+        "--dem-directory",
+        "-dem",
+        type=str,
+        default=None,
+        help=(
+            "Specifies a directory of SRTM/ASTER elevation tiles to sample the "
+            "elevation profiles from instead of the elevation API"
+        ),
+    )
+    optional.add_argument(
+        "--earth-curvature",
+        "-ec",
+        action="store_true",
+        help=(
+            "Specifies whether the line-of-sight model accounts for the curvature of "
+            "the earth"
+        ),
+        default=False,
+    )
+    optional.add_argument(
+        "--fresnel-frequency-ghz",
+        "-ff",
+        type=float,
+        default=None,
+        help=(
+            "Specifies the link frequency in GHz, the line-of-sight model then "
+            "requires clearance of the first Fresnel zone"
+        ),
+    )
+    optional.add_argument(
+        "--n-elevation-workers",
+        "-new",
+        type=int,
+        default=DEFAULT_ELEVATION_WORKERS,
+        help="Specifies the number of workers sampling elevation profiles concurrently",
+    )
+    optional.add_argument(
+        "--n-los-workers",
+        "-nlw",
+        type=int,
+        default=DEFAULT_LOS_WORKERS,
+        help=(
+            "Specifies the number of workers evaluating the line of sight of sampled "
+            "profiles concurrently"
+        ),
+    )
+    optional.add_argument(
+        "--no-resume",
+        "-nr",
+        dest="resume",
+        action="store_false",
+        help=(
+            "Specifies not to resume from the checkpoints of an interrupted build, "
+            "they are discarded"
+        ),
+        default=True,
+    )
+    optional.add_argument(
+        "--no-store-profiles",
+        "-nsp",
+        dest="store_profiles",
+        action="store_false",
+        help=(
+            "Specifies not to store the elevation profiles of the candidate pairs, "
+            "which recompute-los needs"
+        ),
+        default=True,
+    )
+    optional.add_argument(
+        "--profile-dtype",
+        "-pd",
+        type=str,
+        choices=PROFILE_DTYPES,
+        default=DEFAULT_PROFILE_DTYPE,
+        help="Specifies the type the stored elevation profiles are written as",
+    )
+    optional.add_argument(
+        "--compression",
+        "-z",
+        type=str,
+        choices=COMPRESSIONS,
+        default=None,
+        help=(
+            "Specifies the compression of the json caches, they are decompressed "
+            "transparently when loaded"
+        ),
+    )
+    optional.add_argument(
+        "--replace",
+        "-r",
+        action="store_true",
+        help="Specifies whether to rebuild caches that are up to date",
+        default=False,
+    )
+    args: CacheBuildArgs = parser.parse_args()
+    args.progress_bar = True
+    CacheBuildPipeline(args).run()
+
+
+if __name__ == "__main__":
+    main()
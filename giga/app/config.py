@@ -9,6 +9,10 @@ import math
 from giga.utils.globals import *
 from giga.data.store.stores import COUNTRY_DATA_STORE as data_store
 from giga.data.store.stores import SCHOOLS_DATA_STORE as schools_data_store
+from giga.app.update_caches import IncrementalCacheUpdater, IncrementalCacheUpdaterArgs, CACHE_UPDATE_ERRORS
+from giga.schemas.cache_manifest import clear_published_manifest
+from giga.schemas.distance_cache import binary_cache_path, copy_file, is_empty_cache, BINARY_CACHE_MANIFEST
+from giga.utils.logging import LOGGER
 
 import country_converter as coco
 from datetime import datetime
@@ -17,6 +21,9 @@ from datetime import datetime
 skip_in_deployment_str = os.getenv("SKIP_COUNTRIES_IN_DEPLOYMENT", "sample")
 # Parse the string into a list
 SKIP_IN_DEPLOYMENT = skip_in_deployment_str.split(",") if skip_in_deployment_str else []
+# Patching the P2P and school visibility caches queries elevations and line of sight synchronously,
+# it is opt-in and otherwise these caches are cleared when the schools change
+UPDATE_LINE_OF_SIGHT_CACHES = os.getenv("UPDATE_LINE_OF_SIGHT_CACHES", "false").lower() in ("1", "true", "yes")
 
 #maybe move to a different file?
 empty_single_cache = {"lookup": {}, "cache_type": "one-to-one"}
@@ -162,9 +169,7 @@ def check_avail_techs(country_dir, df_schools):
         f = data_store.read_file(os.path.join(country_dir,FIBER_FILE))
         
         if len(f) > 0:
-            with data_store.open(os.path.join(country_dir,FIBER_CACHE_FILE)) as f:
-                jsf = json.load(f)
-            if len(jsf["lookup"])>0:
+            if not is_empty_cache(os.path.join(country_dir,FIBER_CACHE_FILE)):
                 fiber = True
         else:
             fiber = (df_schools["fiber_node_distance"]!=math.inf).any() if 'fiber_node_distance' in df_schools else False
@@ -176,14 +181,10 @@ def check_avail_techs(country_dir, df_schools):
     f_cell = data_store.read_file(os.path.join(country_dir,CELL_FILE))
 
     if len(f_cell)>0:
-        with data_store.open(os.path.join(country_dir,CELL_CACHE_FILE)) as f:
-            jsc = json.load(f)
-        if len(jsc["lookup"])>0:
+        if not is_empty_cache(os.path.join(country_dir,CELL_CACHE_FILE)):
             cell = True
         
-        with data_store.open(os.path.join(country_dir,P2P_CACHE_FILE)) as f:
-            jsp = json.load(f)
-        if len(jsp["lookup"])>0:
+        if not is_empty_cache(os.path.join(country_dir,P2P_CACHE_FILE)):
             if data_store.file_size(os.path.join(country_dir,SCHOOLS_VISIBILITY_CACHE_FILE)) >= 3:
                 p2p = True
     else:
@@ -218,42 +219,36 @@ def create_empty_caches(country_dir):
     with data_store.open(os.path.join(country_dir,SCHOOLS_VISIBILITY_CACHE_FILE), 'w') as f:
         json.dump(empty_multiple_cache, f)
 
+    # the empty caches replace any binary copy and no longer match the manifests of the caches they replace
+    for cache_file in [SCHOOLS_CACHE_FILE, FIBER_CACHE_FILE, CELL_CACHE_FILE, P2P_CACHE_FILE, SCHOOLS_VISIBILITY_CACHE_FILE]:
+        binary_manifest = os.path.join(binary_cache_path(os.path.join(country_dir,cache_file)), BINARY_CACHE_MANIFEST)
+        if data_store.file_exists(binary_manifest):
+            data_store.remove(binary_manifest)
+        clear_published_manifest(country_dir, cache_file)
+
 
 def copy_caches_to_backup(country_dir):
     time_stamp = datetime.now().strftime("%Y_%m_%d")
-    #schools cache
-    with data_store.open(os.path.join(country_dir,SCHOOLS_CACHE_FILE)) as f:
-        js = json.load(f)
-
-    with data_store.open(os.path.join(country_dir,BACKUP_DIR,SCHOOLS_CACHE_FILE[:-5]+"_"+time_stamp+".json"), "w") as f:
-        json.dump(js, f)
-
-    #fiber cache
-    with data_store.open(os.path.join(country_dir,FIBER_CACHE_FILE)) as f:
-        js = json.load(f)
-
-    with data_store.open(os.path.join(country_dir,BACKUP_DIR,FIBER_CACHE_FILE[:-5]+"_"+time_stamp+".json"), "w") as f:
-        json.dump(js, f)
-
-    #cell cache
-    with data_store.open(os.path.join(country_dir,CELL_CACHE_FILE)) as f:
-        js = json.load(f)
-
-    with data_store.open(os.path.join(country_dir,BACKUP_DIR,CELL_CACHE_FILE[:-5]+"_"+time_stamp+".json"), "w") as f:
-        json.dump(js, f)
-
-    #p2p cache
-    with data_store.open(os.path.join(country_dir,P2P_CACHE_FILE)) as f:
-        js = json.load(f)
-
-    with data_store.open(os.path.join(country_dir,BACKUP_DIR,P2P_CACHE_FILE[:-5]+"_"+time_stamp+".json"), "w") as f:
-        json.dump(js, f)
-    
-    with data_store.open(os.path.join(country_dir,SCHOOLS_VISIBILITY_CACHE_FILE)) as f:
-        json.load(f)
-    
-    with data_store.open(os.path.join(country_dir,BACKUP_DIR,SCHOOLS_VISIBILITY_CACHE_FILE[:-5]+"_"+time_stamp+".json"), "w") as f:
-        json.dump(js, f)
+    # the caches are copied in chunks instead of being decoded
+    for cache_file in [SCHOOLS_CACHE_FILE, FIBER_CACHE_FILE, CELL_CACHE_FILE, P2P_CACHE_FILE, SCHOOLS_VISIBILITY_CACHE_FILE]:
+        copy_file(os.path.join(country_dir,cache_file), os.path.join(country_dir,BACKUP_DIR,cache_file[:-5]+"_"+time_stamp+".json"))
+
+def update_caches(country_dir, previous_schools_file, schools_file, line_of_sight=UPDATE_LINE_OF_SIGHT_CACHES):
+    """
+    Patches the caches of a country for the schools that were added, removed or moved.
+    The fiber, cellular and school caches are patched in memory, the P2P and school visibility caches
+    need synchronous elevation and line of sight queries, they are only patched if line_of_sight is set
+    (UPDATE_LINE_OF_SIGHT_CACHES) and are cleared otherwise.
+    If an update fails because of a missing file or the elevation service, the caches are left as they are
+    and are refused on load until they are rebuilt, the previous ones are in the backup directory.
+    """
+    args = IncrementalCacheUpdaterArgs()
+    args.workspace_directory = country_dir
+    args.update_line_of_sight = line_of_sight
+    try:
+        IncrementalCacheUpdater(args).run(previous_schools_file, schools_file)
+    except CACHE_UPDATE_ERRORS:
+        LOGGER.warning(f"Could not update the caches in {country_dir}, leaving them as they are", exc_info=True)
 
 # This could be a call to GigaSchoolTable at some point...    
 def fix_schools(df):
@@ -344,6 +339,7 @@ def get_country_default(country, workspace = 'workspace', schools_dir = SCHOOLS_
         with data_store.open(os.path.join(country_dir,SCHOOLS_FILE)) as f:
             df2 = pd.read_csv(f, dtype={"lat": "float32", "lon": "float32"})
         if not df_fixed.equals(df2):
+            backup_schools_file = None
             #if the schools are the same then the caches are ok otherwise ko
             if not df_fixed[['giga_id_school','lat','lon']].equals(df2[['giga_id_school','lat','lon']]):
                 # we save the old schools file in backup, might be useful to recalculate caches
@@ -351,11 +347,14 @@ def get_country_default(country, workspace = 'workspace', schools_dir = SCHOOLS_
                 backup_schools_file = SCHOOLS_FILE[:-3]+"_"+time_stamp+".csv"
                 data_store.write_file(os.path.join(country_dir,BACKUP_DIR,backup_schools_file),df2.to_csv(index=False))
                 copy_caches_to_backup(country_dir)
-                create_empty_caches(country_dir)
             
             #in any case we save the new schools file
             data_store.write_file(os.path.join(country_dir,SCHOOLS_FILE),df_fixed.to_csv(index=False))
 
+            if backup_schools_file is not None:
+                # patch the caches for the added, removed and moved schools instead of clearing them
+                update_caches(country_dir, os.path.join(country_dir,BACKUP_DIR,backup_schools_file), os.path.join(country_dir,SCHOOLS_FILE))
+
         #check tech availability
         fiber,cell,p2p,san = check_avail_techs(country_dir,df_fixed)
         default["model_defaults"]["available_tech"]["fiber"] = fiber
@@ -4,9 +4,12 @@ load_dotenv()
 import os
 import argparse
 import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
 from giga.utils.logging import LOGGER
-from typing import List, Dict
+from typing import List, Dict, Tuple, Iterable, Iterator
 
 from giga.models.nodes.elevation.elevation_profile_generator import (
     ElevationProfileGenerator,
@@ -16,8 +19,6 @@ from giga.schemas.school import GigaSchoolTable
 from giga.schemas.cellular import CellTowerTable, CellularTower
 from giga.schemas.geo import (
     UniqueCoordinate,
-    ElevationProfile,
-    LatLonPoint,
     PairwiseDistance,
 )
 from giga.models.nodes.elevation.line_of_sight_model import LineofSightModel
@@ -25,10 +26,71 @@ from giga.models.nodes.graph.vectorized_distance_model import VectorizedDistance
 from giga.schemas.distance_cache import (
     SingleLookupDistanceCache,
     MultiLookupDistanceCache,
+    store_cache,
+    reuse_cache,
+    CACHE_OUTPUT_FORMATS,
 )
+from giga.schemas.cache_manifest import CacheManifest
+from giga.schemas.profile_store import (
+    save_profile_store,
+    profile_options,
+    PROFILE_DTYPES,
+    DEFAULT_PROFILE_DTYPE,
+)
+from giga.schemas.link_checkpoint import LinkCheckpoint, LinkSegment, checkpoint_path
 from giga.utils.progress_bar import progress_bar as pb
-import json
-import pickle
+
+# number of school/tower links whose line of sight is evaluated together
+LOS_BATCH_LINKS = 10000
+# elevation workers wait on the elevation API or on tile reads,
+# line of sight workers on numpy
+DEFAULT_ELEVATION_WORKERS = 4
+DEFAULT_LOS_WORKERS = 2
+# batches in flight per worker, bounds the memory of the profiles waiting to be
+# evaluated or checkpointed
+BATCHES_PER_WORKER = 2
+
+
+def link_batches(
+    school_coords: Iterable[UniqueCoordinate],
+    lookup: Dict[str, List[PairwiseDistance]],
+    batch_links: int = LOS_BATCH_LINKS,
+) -> Iterator[Tuple[int, List[Tuple[UniqueCoordinate, List[PairwiseDistance]]]]]:
+    """
+    Groups the candidate pairs of consecutive schools into batches of about
+    batch_links pairs
+    :param school_coords, the schools in order, schools without candidates are skipped
+    :param lookup, the candidate pairs of each school by school id
+    :return batches of (school, pairs), with the index of the last school of each batch
+      in school_coords
+    """
+    batch, n_links = [], 0
+    i = -1
+    for i, school_coord in enumerate(school_coords):
+        pairs = lookup.get(school_coord.coordinate_id)
+        if not pairs:
+            continue
+        batch.append((school_coord, pairs))
+        n_links += len(pairs)
+        if n_links >= batch_links:
+            yield i, batch
+            batch, n_links = [], 0
+    if len(batch) > 0:
+        yield i, batch
+
+
+def line_of_sight_options(args) -> Dict:
+    """
+    The earth curvature and Fresnel zone options of the line of sight model that are
+    enabled in args
+    """
+    options = {}
+    if getattr(args, "earth_curvature", False):
+        options["earth_curvature"] = True
+    if getattr(args, "fresnel_frequency_ghz", None):
+        options["fresnel_frequency_ghz"] = args.fresnel_frequency_ghz
+    return options
+
 
 class P2PCacheCreatorArgs:
     workspace_directory: str = None
@@ -41,17 +103,241 @@ class P2PCacheCreatorArgs:
     progress_bar: bool = True
     file_suffix: str = "_cache"
     export_to_file: bool = True
+    output_format: str = "both"
+    replace: bool = False
+    dem_directory: str = None
+    earth_curvature: bool = False
+    fresnel_frequency_ghz: float = None
+    store_profiles: bool = True
+    profile_dtype: str = DEFAULT_PROFILE_DTYPE
+    n_elevation_workers: int = DEFAULT_ELEVATION_WORKERS
+    n_los_workers: int = DEFAULT_LOS_WORKERS
+    resume: bool = True
 
 
-class P2PCacheCreator:
-    args: P2PCacheCreatorArgs = None
+class LinkCacheCreator:
+    """
+    Evaluates the line of sight of the candidate links of schools, for the P2P and the
+    school visibility caches. Subclasses sample the elevation profiles of the links,
+    the profiles are evaluated with pools of elevation and line of sight workers and
+    the results are checkpointed, so that an interrupted build resumes.
+    """
+
+    args = None
 
-    def __init__(self, args: P2PCacheCreatorArgs):
+    def __init__(self, args, collect_profiles: bool = False):
+        """
+        :param collect_profiles, collect the raw profiles of the evaluated links for
+          save_profiles
+        """
         self.args = args
-        self._towers: Dict[UniqueCoordinate, CellularTower] = None
-        self._school_coords: List[UniqueCoordinate] = None
-        self._egp: ElevationProfileGenerator = ElevationProfileGenerator()
+        self._egp: ElevationProfileGenerator = ElevationProfileGenerator(
+            dem_directory=getattr(args, "dem_directory", None)
+        )
         self._los: LineofSightModel = LineofSightModel()
+        # raw profiles of the evaluated pairs, collected when not None
+        self._profiles: List = [] if collect_profiles else None
+
+    def sample_links(
+        self, batch: List[Tuple[UniqueCoordinate, List[PairwiseDistance]]]
+    ) -> Tuple[List[PairwiseDistance], np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Samples the elevation profiles of the candidate links of many schools at once
+        :param batch, the candidate pairs of each school
+        :return the pairs, the heights of their far ends and (n, samples) arrays of the
+          lat, lon and elevation of their profiles
+        """
+        raise NotImplementedError
+
+    def evaluate_links(self, pairs, heights, lats, lons, elevations) -> np.ndarray:
+        """
+        Runs sampled profiles through the batch line of sight model
+        :return an array of booleans, True for the pairs that are kept in the cache
+        """
+        # Account for height buffer, school receiver height, and the height of the far
+        # end.
+        return self._los.obstructions(
+            lats,
+            lons,
+            elevations,
+            start_heights=self.args.receiver_height_meters,
+            end_heights=heights,
+            elevation_buffer_meters=self.args.los_buffer_meters,
+            **line_of_sight_options(self.args),
+        )
+
+    def prune_obstructed_links(
+        self, batch: List[Tuple[UniqueCoordinate, List[PairwiseDistance]]]
+    ) -> List[PairwiseDistance]:
+        """
+        Evaluates the line of sight of the candidate pairs of many schools at once,
+        the profiles of all the pairs are sampled together and run through the batch
+        line of sight model
+        :param batch, the candidate pairs of each school
+        """
+        if sum(len(school_pairs) for _, school_pairs in batch) == 0:
+            return []
+        sampled = self.sample_links(batch)
+        pairs, elevations = sampled[0], sampled[4]
+        if self._profiles is not None:
+            self._profiles.append((pairs, elevations))
+        los_results = self.evaluate_links(*sampled)
+        return [p for p, has_los in zip(pairs, los_results) if has_los]
+
+    def evaluated_batches(
+        self, batches: Iterable[List[Tuple[UniqueCoordinate, List[PairwiseDistance]]]]
+    ) -> Iterator[Tuple[List, List[PairwiseDistance], np.ndarray, np.ndarray]]:
+        """
+        Samples and evaluates batches of links with a pool of elevation workers feeding
+        a pool of line of sight workers. Results are returned in the order of the
+        batches, while the next batches are sampled and evaluated.
+        :param batches, batches of the candidate pairs of each school
+        :return for each batch, the batch, its pairs, the elevations of their profiles
+          and the line of sight results
+        """
+        n_elevation_workers = max(
+            1, getattr(self.args, "n_elevation_workers", DEFAULT_ELEVATION_WORKERS)
+        )
+        n_los_workers = max(1, getattr(self.args, "n_los_workers", DEFAULT_LOS_WORKERS))
+        max_pending = BATCHES_PER_WORKER * (n_elevation_workers + n_los_workers)
+        los_pool = ThreadPoolExecutor(max_workers=n_los_workers)
+        elevation_pool = ThreadPoolExecutor(max_workers=n_elevation_workers)
+        with los_pool, elevation_pool:
+
+            def sample(batch):
+                sampled = self.sample_links(batch)
+                return sampled, los_pool.submit(self.evaluate_links, *sampled)
+
+            def collect(batch, future):
+                sampled, evaluated = future.result()
+                return batch, sampled[0], sampled[4], evaluated.result()
+
+            pending = deque()
+            for batch in batches:
+                pending.append((batch, elevation_pool.submit(sample, batch)))
+                if len(pending) >= max_pending:
+                    yield collect(*pending.popleft())
+            while len(pending) > 0:
+                yield collect(*pending.popleft())
+
+    def _resume(
+        self, checkpoint: LinkCheckpoint, lookup: Dict[str, List[PairwiseDistance]]
+    ) -> Tuple[List[PairwiseDistance], set]:
+        """
+        Results of the schools in the segments of a checkpoint, schools whose candidates
+        changed are left out
+        :return the kept pairs and the ids of the resumed schools
+        """
+        visible, done = [], set()
+        for segment in checkpoint.segments():
+            offsets = segment.offsets
+            rows, resumed = [], []
+            for i, school in enumerate(segment.schools):
+                pairs = lookup.get(school, [])
+                start, end = offsets[i], offsets[i + 1]
+                targets = [p.coordinate1.coordinate_id for p in pairs]
+                if targets != segment.targets[start:end]:
+                    continue
+                rows.append(np.arange(start, end))
+                resumed += pairs
+                done.add(school)
+            rows = (
+                np.concatenate(rows) if len(rows) > 0 else np.empty(0, dtype=np.int64)
+            )
+            visible += [p for p, has_los in zip(resumed, segment.kept[rows]) if has_los]
+            if self._profiles is not None and len(resumed) > 0:
+                self._profiles.append((resumed, segment.elevations[rows]))
+        return visible, done
+
+    def visible_links(
+        self,
+        school_coords: List[UniqueCoordinate],
+        lookup: Dict[str, List[PairwiseDistance]],
+        checkpoint: LinkCheckpoint = None,
+    ) -> List[PairwiseDistance]:
+        """
+        Evaluates the line of sight of the candidate pairs of schools with the worker
+        pools
+        :param school_coords, the schools in order
+        :param lookup, the candidate pairs of each school by school id
+        :param checkpoint, an opened checkpoint: schools it holds are resumed, the
+          results of the others are appended to it
+        :return the pairs kept in the cache
+        """
+        visible, done = [], set()
+        if checkpoint is not None:
+            visible, done = self._resume(checkpoint, lookup)
+            if len(done) > 0:
+                LOGGER.info(
+                    f"Resumed the line of sight results of {len(done)} schools "
+                    f"from {checkpoint.directory}"
+                )
+        remaining = [s for s in school_coords if s.coordinate_id not in done]
+        iterable = pb(remaining) if self.args.progress_bar else remaining
+        batches = (batch for _, batch in link_batches(iterable, lookup))
+        for batch, pairs, elevations, los_results in self.evaluated_batches(batches):
+            if checkpoint is not None:
+                checkpoint.append(
+                    LinkSegment(
+                        [school_coord.coordinate_id for school_coord, _ in batch],
+                        [len(school_pairs) for _, school_pairs in batch],
+                        [p.coordinate1.coordinate_id for p in pairs],
+                        los_results,
+                        elevations if checkpoint.store_profiles else None,
+                    )
+                )
+            if self._profiles is not None:
+                self._profiles.append((pairs, elevations))
+            visible += [p for p, has_los in zip(pairs, los_results) if has_los]
+        return visible
+
+    def save_profiles(self, manifest: CacheManifest):
+        """
+        Writes the profiles collected while pruning to the profile store of the cache
+        """
+        directory = save_profile_store(
+            self._profiles,
+            self.args.workspace_directory,
+            manifest,
+            getattr(self.args, "profile_dtype", DEFAULT_PROFILE_DTYPE),
+        )
+        LOGGER.info(f"Stored the elevation profiles of {manifest.cache} in {directory}")
+
+    def open_checkpoint(self, manifest: CacheManifest) -> LinkCheckpoint:
+        """
+        Opens the checkpoint of a cache in the workspace, an interrupted run resumes
+        from the schools it evaluated unless the resume arg is disabled
+        """
+        checkpoint = LinkCheckpoint(
+            checkpoint_path(self.args.workspace_directory, manifest.cache),
+            manifest.fingerprint,
+            self._profiles is not None,
+        )
+        checkpoint.open(resume=getattr(self.args, "resume", True))
+        return checkpoint
+
+
+class P2PCacheCreator(LinkCacheCreator):
+    args: P2PCacheCreatorArgs = None
+
+    def __init__(
+        self,
+        args: P2PCacheCreatorArgs,
+        towers: Dict[str, CellularTower] = None,
+        school_coords: List[UniqueCoordinate] = None,
+        collect_profiles: bool = False,
+    ):
+        """
+        :param towers, the cell towers by coordinate ID, read from the workspace when
+          not given
+        :param school_coords, the schools to build links for, read from the workspace
+          when not given
+        :param collect_profiles, collect the raw profiles of the evaluated links for
+          save_profiles
+        """
+        super().__init__(args, collect_profiles)
+        self._towers: Dict[UniqueCoordinate, CellularTower] = towers
+        self._school_coords: List[UniqueCoordinate] = school_coords
 
     # Mapping from coordinate ID (== tower ID) to tower.
     @property
@@ -92,78 +378,96 @@ class P2PCacheCreator:
     def prune_obstructed_towers(
         self, school_coord: UniqueCoordinate, pairs: List[PairwiseDistance]
     ) -> List[PairwiseDistance]:
+        return self.prune_obstructed_links([(school_coord, pairs)])
+
+    def sample_links(
+        self, batch: List[Tuple[UniqueCoordinate, List[PairwiseDistance]]]
+    ) -> Tuple[List[PairwiseDistance], np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Samples the elevation profiles of the school/tower pairs of many schools at once
+        :param batch, the candidate tower pairs of each school
+        :return the pairs, the heights of their towers and (n, samples) arrays of the
+          lat, lon and elevation of their profiles
+        """
+        pairs = [p for _, school_pairs in batch for p in school_pairs]
         towers: List[CellularTower] = [
             self.towers[d.coordinate1.coordinate_id] for d in pairs
         ]
-        coords = [
-            [school_coord.coordinate, t.to_coordinates().coordinate] for t in towers
-        ]
-        profiles: List[ElevationProfile] = self._egp.run(
-            coords, samples=self.args.n_elevation_profile_samples
+        starts = np.array(
+            [
+                school_coord.coordinate
+                for school_coord, school_pairs in batch
+                for _ in school_pairs
+            ],
+            dtype=np.float64,
+        ).reshape(-1, 2)
+        ends = np.array(
+            [t.to_coordinates().coordinate for t in towers], dtype=np.float64
+        ).reshape(-1, 2)
+        lats, lons, elevations = self._egp.profiles(
+            starts, ends, self.args.n_elevation_profile_samples
         )
+        # the line of sight is evaluated on the profiles as stored, so that
+        # recompute-los reproduces it
+        elevations = elevations.astype(
+            getattr(self.args, "profile_dtype", DEFAULT_PROFILE_DTYPE)
+        )
+        heights = np.array([t.height for t in towers], dtype=np.float64)
+        return pairs, heights, lats, lons, elevations
 
-        # Account for height buffer, school receiver height, and cell tower height.
-        for ep, tower in zip(profiles, towers):
-            ep.points[0].elevation += self.args.receiver_height_meters
-            ep.points[-1].elevation += tower.height
-            for pt in ep.points[1:-1]:
-                pt.elevation += self.args.los_buffer_meters
-
-        los_results: List[bool] = self._los.run(profiles)
-        return [p for p, has_los in zip(pairs, los_results) if has_los]
+    def manifest(self) -> CacheManifest:
+        """Manifest of the inputs and the parameters of the P2P cache"""
+        return CacheManifest.from_workspace(
+            self.args.workspace_directory,
+            f"p2p{self.args.file_suffix}",
+            ["schools.csv", "cellular.csv"],
+            n_nearest_neighbors=self.args.n_nearest_neighbors,
+            maximum_distance_meters=self.args.maximum_distance_meters,
+            n_elevation_profile_samples=self.args.n_elevation_profile_samples,
+            los_buffer_meters=self.args.los_buffer_meters,
+            receiver_height_meters=self.args.receiver_height_meters,
+            **line_of_sight_options(self.args),
+            **profile_options(self.args),
+            # profiles sampled from local tiles differ from those of the elevation API
+            **(
+                {"dem_directory": self._egp.dem.directory}
+                if self._egp.dem is not None
+                else {}
+            ),
+        )
 
     def run(self) -> SingleLookupDistanceCache:
-        # Temporary distance cache used to as input for LOS calculation.
-        if self.args.file_closest_towers == "":
-            dists_towers: MultiLookupDistanceCache = (
-                MultiLookupDistanceCache.from_distances(self.closest_towers())
-            )
-            with open("aux_dists_towers.json", "w") as f:
-                json.dump(dists_towers.dict(), f)
-        else:
-            with open(self.args.file_closest_towers, "r") as f:
-                d = json.load(f)
-            dists_towers = MultiLookupDistanceCache(**d)
-
-        # Accumulate list of closest visible towers for each school.
-        if self.args.file_visible_towers == "":
-            closest_visible_towers: List[PairwiseDistance] = []
-            j = -1
-        else:
-            with open(self.args.file_visible_towers, "rb") as f:
-                state = pickle.load(f)
-            j = state["index"]
-            closest_visible_towers = state["closest_visible_towers"]
-        iterable = (
-            pb(self.school_coords) if self.args.progress_bar else self.school_coords
+        file = f"p2p{self.args.file_suffix}.json"
+        manifest = self.manifest()
+        if (
+            self.args.export_to_file
+            and not getattr(self.args, "replace", False)
+            and reuse_cache(self.args.workspace_directory, file, manifest)
+        ):
+            return
+        dists_towers = MultiLookupDistanceCache.from_distances(self.closest_towers())
+        if getattr(self.args, "store_profiles", True):
+            self._profiles = []
+        checkpoint = self.open_checkpoint(manifest)
+        closest_visible_towers = self.visible_links(
+            self.school_coords, dists_towers.lookup, checkpoint
         )
-        i = 0
-        for school_coord in iterable:
-            if i>j:
-                if school_coord.coordinate_id not in dists_towers.lookup:
-                    continue
-                closest_pairs: List[PairwiseDistance] = dists_towers.lookup[
-                    school_coord.coordinate_id
-                ]
-                closest_visible_towers += self.prune_obstructed_towers(
-                    school_coord, closest_pairs
-                )
-            
-                if i%1000==0:
-                    to_save = {"index":i,"closest_visible_towers":closest_visible_towers}
-                    with open("aux_closest_visible_towers.pkl", "wb") as f:
-                        pickle.dump(to_save, f)
-            i += 1
 
         # Build and return the final cache.
         dist_cache = [p.reversed() for p in closest_visible_towers]
         p2p_cache = SingleLookupDistanceCache.from_distances(dist_cache)
         if self.args.export_to_file:
-            p2p_cache.to_json(
-                os.path.join(
-                    self.args.workspace_directory, f"p2p{self.args.file_suffix}.json"
-                )
+            store_cache(
+                p2p_cache,
+                self.args.workspace_directory,
+                file,
+                manifest,
+                getattr(self.args, "output_format", "both"),
             )
+            if self._profiles is not None:
+                self.save_profiles(manifest)
+        checkpoint.clear()
+        return p2p_cache
 
 
 def main():
@@ -221,18 +525,99 @@ def main():
         help="Specifies the height of the school-side receiver in meters",
     )
     optional.add_argument(
-        "--file-closest-towers",
-        "-fct",
+        "--earth-curvature",
+        "-ec",
+        action="store_true",
+        help=(
+            "Specifies whether the line-of-sight model accounts for the curvature of "
+            "the earth"
+        ),
+        default=False,
+    )
+    optional.add_argument(
+        "--fresnel-frequency-ghz",
+        "-ff",
+        type=float,
+        default=None,
+        help=(
+            "Specifies the link frequency in GHz, the line-of-sight model then "
+            "requires clearance of the first Fresnel zone"
+        ),
+    )
+    optional.add_argument(
+        "--n-elevation-workers",
+        "-new",
+        type=int,
+        default=DEFAULT_ELEVATION_WORKERS,
+        help="Specifies the number of workers sampling elevation profiles concurrently",
+    )
+    optional.add_argument(
+        "--n-los-workers",
+        "-nlw",
+        type=int,
+        default=DEFAULT_LOS_WORKERS,
+        help=(
+            "Specifies the number of workers evaluating the line of sight of sampled "
+            "profiles concurrently"
+        ),
+    )
+    optional.add_argument(
+        "--no-resume",
+        "-nr",
+        dest="resume",
+        action="store_false",
+        help=(
+            "Specifies not to resume from the checkpoint of an interrupted run, it is "
+            "discarded"
+        ),
+        default=True,
+    )
+    optional.add_argument(
+        "--dem-directory",
+        "-dem",
         type=str,
-        default="",
-        help="Specifies the intermediate file with closest towers",
+        default=None,
+        help=(
+            "Specifies a directory of SRTM/ASTER elevation tiles to sample the "
+            "elevation profiles from instead of the elevation API"
+        ),
+    )
+    optional.add_argument(
+        "--no-store-profiles",
+        "-nsp",
+        dest="store_profiles",
+        action="store_false",
+        help=(
+            "Specifies not to store the elevation profiles of the candidate pairs, "
+            "which recompute-los needs"
+        ),
+        default=True,
+    )
+    optional.add_argument(
+        "--profile-dtype",
+        "-pd",
+        type=str,
+        choices=PROFILE_DTYPES,
+        default=DEFAULT_PROFILE_DTYPE,
+        help="Specifies the type the stored elevation profiles are written as",
+    )
+    optional.add_argument(
+        "--replace",
+        "-r",
+        action="store_true",
+        help="Specifies whether to fully replace the existing cache",
+        default=False,
     )
     optional.add_argument(
-        "--file-visible-towers",
-        "-fvt",
+        "--output-format",
+        "-of",
         type=str,
-        default="",
-        help="Specifies the intermediate file with closest visible towers",
+        choices=CACHE_OUTPUT_FORMATS,
+        default="both",
+        help=(
+            "Specifies whether to write the cache as json, "
+            "in the binary memory-mapped format or both"
+        ),
     )
     args: P2PCacheCreatorArgs = parser.parse_args()
     args.progress_bar = True
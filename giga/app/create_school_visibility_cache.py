@@ -4,29 +4,38 @@ load_dotenv()
 import os
 import argparse
 import math
+import numpy as np
 
 from giga.utils.logging import LOGGER
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
-from giga.models.nodes.elevation.elevation_profile_generator import (
-    ElevationProfileGenerator,
-)
 #from giga.models.nodes.graph.greedy_distance_connector import GreedyDistanceConnector
 from giga.schemas.school import GigaSchoolTable
 from giga.schemas.cellular import CellTowerTable, CellularTower
 from giga.schemas.geo import (
     UniqueCoordinate,
-    ElevationProfile,
-    LatLonPoint,
     PairwiseDistance,
 )
-from giga.models.nodes.elevation.line_of_sight_model import LineofSightModel
 from giga.models.nodes.graph.vectorized_distance_model import VectorizedDistanceModel
 from giga.schemas.distance_cache import (
     SingleLookupDistanceCache,
     MultiLookupDistanceCache,
+    store_cache,
+    reuse_cache,
+    CACHE_OUTPUT_FORMATS,
+)
+from giga.schemas.cache_manifest import CacheManifest
+from giga.schemas.profile_store import (
+    profile_options,
+    PROFILE_DTYPES,
+    DEFAULT_PROFILE_DTYPE,
+)
+from giga.app.create_p2p_distance_cache import (
+    LinkCacheCreator,
+    line_of_sight_options,
+    DEFAULT_ELEVATION_WORKERS,
+    DEFAULT_LOS_WORKERS,
 )
-from giga.utils.progress_bar import progress_bar as pb
 import json
 import pickle
 
@@ -41,18 +50,37 @@ class VisibilityCacheCreatorArgs:
     progress_bar: bool = True
     file_suffix: str = "_cache"
     export_to_file: bool = True
+    output_format: str = "both"
     include_connected: bool = False
+    replace: bool = False
+    dem_directory: str = None
+    earth_curvature: bool = False
+    fresnel_frequency_ghz: float = None
+    store_profiles: bool = True
+    profile_dtype: str = DEFAULT_PROFILE_DTYPE
+    n_elevation_workers: int = DEFAULT_ELEVATION_WORKERS
+    n_los_workers: int = DEFAULT_LOS_WORKERS
+    resume: bool = True
 
 
-class VisibilityCacheCreator:
+class VisibilityCacheCreator(LinkCacheCreator):
     args: VisibilityCacheCreatorArgs = None
 
-    def __init__(self, args: VisibilityCacheCreatorArgs):
-        self.args = args
+    def __init__(
+        self,
+        args: VisibilityCacheCreatorArgs,
+        school_coords: List[UniqueCoordinate] = None,
+        collect_profiles: bool = False,
+    ):
+        """
+        :param school_coords, the schools to build links for, read from the workspace
+          when not given
+        :param collect_profiles, collect the raw profiles of the evaluated links for
+          save_profiles
+        """
+        super().__init__(args, collect_profiles)
         #self._towers: Dict[UniqueCoordinate, CellularTower] = None
-        self._school_coords: List[UniqueCoordinate] = None
-        self._egp: ElevationProfileGenerator = ElevationProfileGenerator()
-        self._los: LineofSightModel = LineofSightModel()
+        self._school_coords: List[UniqueCoordinate] = school_coords
 
     # Mapping from coordinate ID (== tower ID) to tower.
     #@property
@@ -93,26 +121,73 @@ class VisibilityCacheCreator:
     def prune_obstructed_schools(
         self, school_coord: UniqueCoordinate, pairs: List[PairwiseDistance]
     ) -> List[PairwiseDistance]:
-        
-        coords = [
-            [school_coord.coordinate, t.coordinate1.coordinate] for t in pairs
-        ]
-        profiles: List[ElevationProfile] = self._egp.run(
-            coords, samples=self.args.n_elevation_profile_samples
-        )
+        return self.prune_obstructed_links([(school_coord, pairs)])
 
-        # Account for height buffer, school receiver height, and cell tower height.
-        for ep in profiles:
-            ep.points[0].elevation += self.args.receiver_height_meters
-            ep.points[-1].elevation += self.args.receiver_height_meters
-            for pt in ep.points[1:-1]:
-                pt.elevation += self.args.los_buffer_meters
+    def sample_links(
+        self, batch: List[Tuple[UniqueCoordinate, List[PairwiseDistance]]]
+    ) -> Tuple[List[PairwiseDistance], np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Samples the elevation profiles of the school pairs of many schools at once
+        :param batch, the candidate school pairs of each school
+        :return the pairs, the receiver heights of the neighbors and (n, samples) arrays
+          of the lat, lon and elevation of their profiles
+        """
+        pairs = [p for _, school_pairs in batch for p in school_pairs]
+        starts = np.array(
+            [
+                school_coord.coordinate
+                for school_coord, school_pairs in batch
+                for _ in school_pairs
+            ],
+            dtype=np.float64,
+        ).reshape(-1, 2)
+        ends = np.array(
+            [p.coordinate1.coordinate for p in pairs], dtype=np.float64
+        ).reshape(-1, 2)
+        lats, lons, elevations = self._egp.profiles(
+            starts, ends, self.args.n_elevation_profile_samples
+        )
+        # the line of sight is evaluated on the profiles as stored, so that
+        # recompute-los reproduces it
+        elevations = elevations.astype(
+            getattr(self.args, "profile_dtype", DEFAULT_PROFILE_DTYPE)
+        )
+        heights = np.full(
+            len(pairs), self.args.receiver_height_meters, dtype=np.float64
+        )
+        return pairs, heights, lats, lons, elevations
 
-        los_results: List[bool] = self._los.run(profiles)
-        closests = [p for p, has_los in zip(pairs, los_results) if has_los]
-        return closests
+    def manifest(self) -> CacheManifest:
+        """Manifest of the inputs and the parameters of the school visibility cache"""
+        return CacheManifest.from_workspace(
+            self.args.workspace_directory,
+            f"school_visibility{self.args.file_suffix}",
+            ["schools.csv"],
+            n_nearest_neighbors=self.args.n_nearest_neighbors,
+            maximum_distance_meters=self.args.maximum_distance_meters,
+            n_elevation_profile_samples=self.args.n_elevation_profile_samples,
+            los_buffer_meters=self.args.los_buffer_meters,
+            receiver_height_meters=self.args.receiver_height_meters,
+            include_connected=self.args.include_connected,
+            **line_of_sight_options(self.args),
+            **profile_options(self.args),
+            # profiles sampled from local tiles differ from those of the elevation API
+            **(
+                {"dem_directory": self._egp.dem.directory}
+                if self._egp.dem is not None
+                else {}
+            ),
+        )
 
     def run(self) -> SingleLookupDistanceCache:
+        file = f"school_visibility{self.args.file_suffix}.json"
+        manifest = self.manifest()
+        if (
+            self.args.export_to_file
+            and not getattr(self.args, "replace", False)
+            and reuse_cache(self.args.workspace_directory, file, manifest)
+        ):
+            return
         school_table = GigaSchoolTable.from_csv(
         os.path.join(self.args.workspace_directory, "schools.csv")
         )
@@ -139,23 +214,12 @@ class VisibilityCacheCreator:
             dists_schools, n_neighbors=self.args.n_nearest_neighbors
         )
 
-        closest_visible_schools = []
-        iterable = (
-            pb(school_coords) if self.args.progress_bar else school_coords
+        if getattr(self.args, "store_profiles", True):
+            self._profiles = []
+        checkpoint = self.open_checkpoint(manifest)
+        closest_visible_schools = self.visible_links(
+            school_coords, school_cache.lookup, checkpoint
         )
-        i = 0
-        j = -1
-        for school_coord in iterable:
-            if i>j:
-                if school_coord.coordinate_id not in school_cache.lookup:
-                    continue
-                closest_pairs: List[PairwiseDistance] = school_cache.lookup[
-                    school_coord.coordinate_id
-                ]
-                closest_visible_schools += self.prune_obstructed_schools(
-                    school_coord, closest_pairs
-                )
-            i += 1
 
         # Build and return the final cache.
         #dist_cache = [p.reversed() for p in closest_visible_schools]
@@ -164,11 +228,16 @@ class VisibilityCacheCreator:
             closest_visible_schools, n_neighbors=self.args.n_nearest_neighbors
         )
         if self.args.export_to_file:
-            school_visibility_cache.to_json(
-                os.path.join(
-                    self.args.workspace_directory, f"school_visibility{self.args.file_suffix}.json"
-                )
+            store_cache(
+                school_visibility_cache,
+                self.args.workspace_directory,
+                file,
+                manifest,
+                getattr(self.args, "output_format", "both"),
             )
+            if self._profiles is not None:
+                self.save_profiles(manifest)
+        checkpoint.clear()
 
 
 def main():
@@ -232,6 +301,54 @@ def main():
         default=5,
         help="Specifies the height of the school-side receiver in meters",
     )
+    optional.add_argument(
+        "--earth-curvature",
+        "-ec",
+        action="store_true",
+        help=(
+            "Specifies whether the line-of-sight model accounts for the curvature of "
+            "the earth"
+        ),
+        default=False,
+    )
+    optional.add_argument(
+        "--fresnel-frequency-ghz",
+        "-ff",
+        type=float,
+        default=None,
+        help=(
+            "Specifies the link frequency in GHz, the line-of-sight model then "
+            "requires clearance of the first Fresnel zone"
+        ),
+    )
+    optional.add_argument(
+        "--n-elevation-workers",
+        "-new",
+        type=int,
+        default=DEFAULT_ELEVATION_WORKERS,
+        help="Specifies the number of workers sampling elevation profiles concurrently",
+    )
+    optional.add_argument(
+        "--n-los-workers",
+        "-nlw",
+        type=int,
+        default=DEFAULT_LOS_WORKERS,
+        help=(
+            "Specifies the number of workers evaluating the line of sight of sampled "
+            "profiles concurrently"
+        ),
+    )
+    optional.add_argument(
+        "--no-resume",
+        "-nr",
+        dest="resume",
+        action="store_false",
+        help=(
+            "Specifies not to resume from the checkpoint of an interrupted run, it is "
+            "discarded"
+        ),
+        default=True,
+    )
     optional.add_argument(
         "--file-closest-towers",
         "-fct",
@@ -246,6 +363,53 @@ def main():
         default="",
         help="Specifies the intermediate file with closest visible towers",
     )
+    optional.add_argument(
+        "--dem-directory",
+        "-dem",
+        type=str,
+        default=None,
+        help=(
+            "Specifies a directory of SRTM/ASTER elevation tiles to sample the "
+            "elevation profiles from instead of the elevation API"
+        ),
+    )
+    optional.add_argument(
+        "--no-store-profiles",
+        "-nsp",
+        dest="store_profiles",
+        action="store_false",
+        help=(
+            "Specifies not to store the elevation profiles of the candidate pairs, "
+            "which recompute-los needs"
+        ),
+        default=True,
+    )
+    optional.add_argument(
+        "--profile-dtype",
+        "-pd",
+        type=str,
+        choices=PROFILE_DTYPES,
+        default=DEFAULT_PROFILE_DTYPE,
+        help="Specifies the type the stored elevation profiles are written as",
+    )
+    optional.add_argument(
+        "--replace",
+        "-r",
+        action="store_true",
+        help="Specifies whether to fully replace the existing cache",
+        default=False,
+    )
+    optional.add_argument(
+        "--output-format",
+        "-of",
+        type=str,
+        choices=CACHE_OUTPUT_FORMATS,
+        default="both",
+        help=(
+            "Specifies whether to write the cache as json, "
+            "in the binary memory-mapped format or both"
+        ),
+    )
     args: VisibilityCacheCreatorArgs = parser.parse_args()
     args.progress_bar = True
     args.export_to_file = True
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+import math
+import time
+import asyncio
+import argparse
+import numpy as np
+from aiohttp import web
+
+from giga.models.nodes.elevation.dem_tile_engine import DEMTileEngine
+from giga.models.nodes.elevation.elevation_api_client import MAX_LOCATIONS_PER_REQUEST
+from giga.utils.logging import LOGGER
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5000
+
+
+def synthetic_elevation(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Deterministic rolling terrain used when the server has no elevation tiles, in meters"""
+    return (
+        500
+        + 300 * np.sin(np.radians(lats) * 400)
+        + 200 * np.cos(np.radians(lons) * 300)
+        + 50 * np.sin(np.radians(lats + lons) * 3000)
+    )
+
+
+class ElevationAPIServer:
+    """
+    Local stand-in for the opentopodata API, for testing and benchmarking the elevation clients offline.
+    Serves GET and POST requests to /v1/<dataset> with locations in the "lat,lon|lat,lon" format,
+    returns responses with the shape of the API and enforces its limits on the number of locations
+    per request and, optionally, on the number of requests per second.
+    Elevations are sampled from local elevation tiles when a tile directory is given and
+    from synthetic terrain otherwise.
+    """
+
+    def __init__(self, **kwargs):
+        dem_directory = kwargs.get("dem_directory", None)
+        self.dem = DEMTileEngine(dem_directory) if dem_directory else None
+        self.max_locations = kwargs.get("max_locations", MAX_LOCATIONS_PER_REQUEST)
+        self.requests_per_second = kwargs.get("requests_per_second", 0)
+        self.latency = kwargs.get("latency", 0.0)
+        self.n_requests = 0
+        self.n_locations = 0
+        self.n_rate_limited = 0
+        self._last_request = -math.inf
+
+    def elevations(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        if self.dem is not None:
+            return self.dem.elevations(lats, lons)
+        return synthetic_elevation(lats, lons)
+
+    @staticmethod
+    def _error(message: str, status: int = 400) -> web.Response:
+        return web.json_response({"error": message, "status": "INVALID_REQUEST"}, status=status)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        now = time.monotonic()
+        if self.requests_per_second > 0 and now - self._last_request < 1.0 / self.requests_per_second:
+            self.n_rate_limited += 1
+            return self._error("Too many requests", status=429)
+        self._last_request = now
+        params = dict(request.query)
+        if request.method == "POST":
+            params.update(await request.post())
+        locations = params.get("locations", "")
+        try:
+            points = np.array(
+                [[float(x) for x in p.split(",")] for p in locations.split("|") if p.strip()],
+                dtype=np.float64,
+            ).reshape(-1, 2)
+        except ValueError:
+            return self._error(f"Invalid locations: {locations}")
+        if len(points) == 0:
+            return self._error("No locations provided.")
+        if len(points) > self.max_locations:
+            return self._error(
+                f"Too many locations provided ({len(points)}), the limit is {self.max_locations}."
+            )
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        self.n_requests += 1
+        self.n_locations += len(points)
+        elevations = self.elevations(points[:, 0], points[:, 1])
+        dataset = request.match_info["dataset"]
+        results = [
+            {
+                "dataset": dataset,
+                "elevation": None if math.isnan(e) else e,
+                "location": {"lat": lat, "lng": lon},
+            }
+            for (lat, lon), e in zip(points.tolist(), elevations.tolist())
+        ]
+        return web.json_response({"results": results, "status": "OK"})
+
+    def application(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("GET", "/v1/{dataset}", self.handle)
+        app.router.add_route("POST", "/v1/{dataset}", self.handle)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    optional = parser.add_argument_group("optional arguments")
+    optional.add_argument("--host", type=str, default=DEFAULT_HOST, help="Specifies the host to listen on")
+    optional.add_argument("--port", "-p", type=int, default=DEFAULT_PORT, help="Specifies the port to listen on")
+    optional.add_argument(
+        "--dem-directory",
+        "-dem",
+        type=str,
+        default=None,
+        help="Specifies a directory of SRTM/ASTER elevation tiles to serve, synthetic terrain is served otherwise",
+    )
+    optional.add_argument(
+        "--requests-per-second",
+        "-rps",
+        type=float,
+        default=0,
+        help="Specifies the rate limit of the server, requests above it are answered with status 429, 0 disables it",
+    )
+    optional.add_argument(
+        "--latency",
+        "-l",
+        type=float,
+        default=0.0,
+        help="Specifies a delay in seconds added to every request to mimic the network latency of the API",
+    )
+    args = parser.parse_args()
+    server = ElevationAPIServer(
+        dem_directory=args.dem_directory,
+        requests_per_second=args.requests_per_second,
+        latency=args.latency,
+    )
+    LOGGER.info(f"Serving elevations on http://{args.host}:{args.port}/v1/<dataset>")
+    web.run_app(server.application(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+from dotenv import load_dotenv
+load_dotenv()
+import os
+import argparse
+from typing import List, Dict
+import numpy as np
+
+from giga.utils.logging import LOGGER
+from giga.schemas.cellular import CellTowerTable
+from giga.schemas.distance_cache import (
+    SingleLookupDistanceCache,
+    MultiLookupDistanceCache,
+    store_cache,
+    CACHE_OUTPUT_FORMATS,
+)
+from giga.schemas.cache_manifest import CacheManifest, file_sha256
+from giga.schemas.profile_store import ElevationProfileStore, profile_store_path
+from giga.data.store.compression import COMPRESSIONS
+from giga.models.nodes.elevation.line_of_sight_model import LineofSightModel
+from giga.models.nodes.elevation.elevation_utilities import sample_profile_points
+from giga.app.create_p2p_distance_cache import line_of_sight_options
+
+
+PROFILE_CACHE_NAMES = ["p2p", "school_visibility"]
+# input files of the caches, as recorded in their manifests
+CACHE_INPUTS = {"p2p": ["schools.csv", "cellular.csv"], "school_visibility": ["schools.csv"]}
+# number of profiles evaluated at once, bounds the memory of the line of sight model
+RECOMPUTE_CHUNK_PROFILES = 100000
+
+
+class LOSRecomputeArgs:
+    workspace_directory: str = None
+    caches: List[str] = PROFILE_CACHE_NAMES
+    los_buffer_meters: float = 5
+    receiver_height_meters: float = 5
+    earth_curvature: bool = False
+    fresnel_frequency_ghz: float = None
+    file_suffix: str = "_cache"
+    output_format: str = "both"
+    compression: str = None
+
+
+class LOSRecomputePipeline:
+    """
+    Rebuilds the P2P and school visibility caches of a workspace for new receiver height, tower height,
+    buffer, earth curvature or Fresnel zone settings, from the elevation profiles stored by the cache builders.
+    No elevation is sampled, so a cache is rebuilt in seconds. Tower heights are read from the current
+    cellular.csv, the schools and the tower locations must be the ones the profiles were sampled for.
+    """
+
+    def __init__(self, args: LOSRecomputeArgs):
+        self.args = args
+        self._los: LineofSightModel = LineofSightModel()
+
+    def _path(self, file):
+        return os.path.join(self.args.workspace_directory, file)
+
+    def _file(self, name):
+        return f"{name}{self.args.file_suffix}.json"
+
+    def parameters(self) -> Dict:
+        """Line of sight parameters of the rebuilt caches, in the form of the cache builders"""
+        return dict(
+            los_buffer_meters=self.args.los_buffer_meters,
+            receiver_height_meters=self.args.receiver_height_meters,
+            **line_of_sight_options(self.args),
+        )
+
+    def _check_schools(self, manifest: Dict):
+        if file_sha256(self._path("schools.csv")) != manifest["inputs"].get("schools.csv"):
+            raise ValueError(
+                f"schools.csv changed since the profiles of {manifest['cache']} were stored, rebuild the cache instead"
+            )
+
+    def _tower_heights(self, store: ElevationProfileStore) -> np.ndarray:
+        """Heights of the towers at the ends of the profiles, from the current cellular.csv"""
+        towers = {t.tower_id: t for t in CellTowerTable.from_csv(self._path("cellular.csv")).towers}
+        ends = np.unique(store.ends)
+        heights = np.zeros(len(store.ids))
+        for i in ends.tolist():
+            tower = towers.get(store.ids[i], None)
+            if tower is None or not np.array_equal(store.coordinates[i], [tower.lat, tower.lon]):
+                raise ValueError(
+                    f"Cell tower {store.ids[i]} was removed or moved since the profiles were stored, "
+                    f"rebuild the P2P cache instead"
+                )
+            heights[i] = tower.height
+        return heights[store.ends]
+
+    def obstructions(self, store: ElevationProfileStore, end_heights) -> np.ndarray:
+        """Line of sight results of the stored profiles, for the configured settings"""
+        results = np.zeros(len(store), dtype=bool)
+        end_heights = np.broadcast_to(np.asarray(end_heights, dtype=np.float64), (len(store),))
+        for i in range(0, len(store), RECOMPUTE_CHUNK_PROFILES):
+            rows = slice(i, i + RECOMPUTE_CHUNK_PROFILES)
+            lats, lons = sample_profile_points(
+                store.coordinates[store.starts[rows]],
+                store.coordinates[store.ends[rows]],
+                store.samples,
+            )
+            results[rows] = self._los.obstructions(
+                lats,
+                lons,
+                store.elevations[rows],
+                start_heights=self.args.receiver_height_meters,
+                end_heights=end_heights[rows],
+                elevation_buffer_meters=self.args.los_buffer_meters,
+                **line_of_sight_options(self.args),
+            )
+        return results
+
+    def recompute(self, name: str):
+        """
+        Rebuilds a cache from its stored profiles and stores it in the workspace
+        :param name, the name of the cache, p2p or school_visibility
+        :return the rebuilt cache
+        """
+        assert name in PROFILE_CACHE_NAMES, f"Unsupported cache {name}"
+        directory = profile_store_path(self.args.workspace_directory, f"{name}{self.args.file_suffix}")
+        store, manifest = ElevationProfileStore.load(directory)
+        self._check_schools(manifest)
+        if name == "p2p":
+            end_heights = self._tower_heights(store)
+        else:
+            end_heights = self.args.receiver_height_meters
+        rows = np.flatnonzero(self.obstructions(store, end_heights))
+        visible = store.pairs(rows, manifest.get("distance_type", "euclidean"))
+        if name == "p2p":
+            cache = SingleLookupDistanceCache.from_distances([p.reversed() for p in visible])
+        else:
+            cache = MultiLookupDistanceCache.from_distances(
+                visible, n_neighbors=manifest["parameters"]["n_nearest_neighbors"]
+            )
+        cache_manifest = CacheManifest.from_workspace(
+            self.args.workspace_directory,
+            manifest["cache"],
+            CACHE_INPUTS[name],
+            **manifest["parameters"],
+            **self.parameters(),
+        )
+        store_cache(
+            cache,
+            self.args.workspace_directory,
+            self._file(name),
+            cache_manifest,
+            self.args.output_format,
+            compression=self.args.compression,
+        )
+        LOGGER.info(
+            f"Recomputed {self._file(name)} from {len(store)} stored profiles, {len(rows)} pairs kept"
+        )
+        return cache
+
+    def run(self) -> List[str]:
+        """
+        Rebuilds the configured caches
+        :return the names of the caches that were rebuilt
+        """
+        for name in self.args.caches:
+            self.recompute(name)
+        return list(self.args.caches)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    required = parser.add_argument_group("required arguments")
+    required.add_argument("--workspace-directory", "-w", required=True)
+    optional = parser.add_argument_group("optional arguments")
+    optional.add_argument(
+        "--caches",
+        "-c",
+        nargs="+",
+        choices=PROFILE_CACHE_NAMES,
+        default=PROFILE_CACHE_NAMES,
+        help="Specifies the caches to recompute from their stored elevation profiles",
+    )
+    optional.add_argument(
+        "--los-buffer-meters",
+        "-lb",
+        type=float,
+        default=5,
+        help="Specifies the buffer to use for the line-of-sight model",
+    )
+    optional.add_argument(
+        "--receiver-height-meters",
+        "-rh",
+        type=float,
+        default=5,
+        help="Specifies the height of the school-side receiver in meters",
+    )
+    optional.add_argument(
+        "--earth-curvature",
+        "-ec",
+        action="store_true",
+        help="Specifies whether the line-of-sight model accounts for the curvature of the earth",
+        default=False,
+    )
+    optional.add_argument(
+        "--fresnel-frequency-ghz",
+        "-ff",
+        type=float,
+        default=None,
+        help="Specifies the link frequency in GHz, the line-of-sight model then requires clearance of the first Fresnel zone",
+    )
+    optional.add_argument(
+        "--file-suffix",
+        "-fs",
+        type=str,
+        default="_cache",
+        help="Specifies the suffix of the cache files",
+    )
+    optional.add_argument(
+        "--output-format",
+        "-of",
+        type=str,
+        choices=CACHE_OUTPUT_FORMATS,
+        default="both",
+        help="Specifies whether to write the caches as json, in the binary memory-mapped format or both",
+    )
+    optional.add_argument(
+        "--compression",
+        "-z",
+        type=str,
+        choices=COMPRESSIONS,
+        default=None,
+        help="Specifies the compression of the json caches, they are decompressed transparently when loaded",
+    )
+    args: LOSRecomputeArgs = parser.parse_args()
+    LOSRecomputePipeline(args).run()
+
+
+if __name__ == "__main__":
+    main()
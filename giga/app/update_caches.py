@@ -0,0 +1,633 @@
+import os
+import math
+from typing import List, Dict, Tuple, Set
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+from sklearn.neighbors import BallTree
+
+from giga.utils.logging import LOGGER
+from giga.schemas.school import GigaSchoolTable
+from giga.schemas.cellular import CellTowerTable
+from giga.schemas.geo import UniqueCoordinateTable, CoordinateArray, PairwiseDistance
+from giga.models.nodes.graph.vectorized_distance_model import (
+    VectorizedDistanceModel,
+    RADIUS_EARTH_M,
+    DEFAULT_LEAF_SIZE,
+)
+from giga.schemas.distance_cache import (
+    SingleLookupDistanceCache,
+    MultiLookupDistanceCache,
+    write_cache,
+    binary_cache_path,
+    BINARY_CACHE_MANIFEST,
+)
+from giga.schemas.cache_manifest import (
+    CacheManifest,
+    published_manifest,
+    cache_manifest_path,
+    clear_published_manifest,
+)
+from giga.app.create_p2p_distance_cache import (
+    P2PCacheCreator,
+    P2PCacheCreatorArgs,
+)
+from giga.app.create_school_visibility_cache import (
+    VisibilityCacheCreator,
+    VisibilityCacheCreatorArgs,
+)
+from giga.schemas.profile_store import clear_profile_store
+from giga.models.nodes.elevation.elevation_api_client import ElevationServiceError
+from giga.data.store.stores import COUNTRY_DATA_STORE as data_store
+from giga.utils.globals import (
+    FIBER_FILE,
+    CELL_FILE,
+    FIBER_CACHE_FILE,
+    CELL_CACHE_FILE,
+    P2P_CACHE_FILE,
+    SCHOOLS_CACHE_FILE,
+    SCHOOLS_VISIBILITY_CACHE_FILE,
+)
+
+
+# columns of the school file the distance caches depend on
+SCHOOL_KEY_COLUMNS = ["giga_id_school", "lat", "lon"]
+# expected failures of an update, missing or unreadable files and errors of the
+# elevation tiles or service, the caches they affect are left as they are
+CACHE_UPDATE_ERRORS = (OSError, ElevationServiceError)
+# builder parameters recorded in cache manifests that the updater reproduces, caches
+# built with others are cleared
+BUILDER_PARAMETERS = [
+    "n_nearest_neighbors",
+    "maximum_distance_meters",
+    "include_connected",
+    "n_elevation_profile_samples",
+    "los_buffer_meters",
+    "receiver_height_meters",
+    "earth_curvature",
+    "fresnel_frequency_ghz",
+    "profile_dtype",
+    "dem_directory",
+]
+
+
+class SchoolDiff(BaseModel):
+    """Schools added, removed and moved between two versions of a school file"""
+
+    added: List[str] = []
+    removed: List[str] = []
+    moved: List[str] = []
+
+    @staticmethod
+    def from_frames(previous: pd.DataFrame, current: pd.DataFrame) -> "SchoolDiff":
+        """
+        Compares two school frames by giga_id_school
+        :param previous, the school frame the existing caches were built from
+        :param current, the updated school frame
+        """
+        old = _school_locations(previous)
+        new = _school_locations(current)
+        common = new.index.intersection(old.index, sort=False)
+        a = old.loc[common].to_numpy(dtype=np.float64)
+        b = new.loc[common].to_numpy(dtype=np.float64)
+        moved = ((a != b) & ~(np.isnan(a) & np.isnan(b))).any(axis=1)
+        return SchoolDiff(
+            added=[str(x) for x in new.index.difference(old.index, sort=False)],
+            removed=[str(x) for x in old.index.difference(new.index, sort=False)],
+            moved=[str(x) for x in common[moved]],
+        )
+
+    @property
+    def changed(self) -> List[str]:
+        """Schools whose cache entries have to be computed"""
+        return self.added + self.moved
+
+    @property
+    def stale(self) -> List[str]:
+        """Schools whose existing cache entries are no longer valid"""
+        return self.removed + self.moved
+
+    @property
+    def is_empty(self) -> bool:
+        return len(self.added) == 0 and len(self.removed) == 0 and len(self.moved) == 0
+
+
+def _school_locations(frame: pd.DataFrame) -> pd.DataFrame:
+    frame = frame[SCHOOL_KEY_COLUMNS].dropna(subset=["giga_id_school"])
+    frame = frame.drop_duplicates(subset=["giga_id_school"])
+    return frame.set_index(frame["giga_id_school"].astype(str))[["lat", "lon"]]
+
+
+def read_school_frame(file_name: str) -> pd.DataFrame:
+    """
+    Reads a school file the way the school file of a country is compared when it is
+    updated
+    """
+    with data_store.open(file_name, "r") as f:
+        return pd.read_csv(f, dtype={"lat": "float32", "lon": "float32"})
+
+
+def school_coordinate_array(
+    file_name: str, include_connected: bool = False
+) -> CoordinateArray:
+    """
+    Reads the coordinates of the schools in a school file as the cache builders do
+    :param include_connected, if False schools that are already connected are left out
+    """
+    table = GigaSchoolTable.from_csv(file_name)
+    if not include_connected:
+        schools = [s for s in table.schools if not s.connected]
+        if len(schools) == 0:
+            return CoordinateArray([], np.empty((0, 2)))
+        table = GigaSchoolTable(schools=schools)
+    return table.to_coordinate_array()
+
+
+def nearest_school_neighbors(
+    schools: CoordinateArray, n_neighbors: int, maximum_distance: float = math.inf
+) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Finds the nearest neighbors of every school among the schools themselves the way the
+    cache builders do, the n nearest including the school itself within the maximum
+    distance, with the school then left out
+    :return a lookup of school id to arrays of neighbor rows and distances in meters,
+      sorted by distance
+    """
+    rows = np.flatnonzero(np.isfinite(schools.coordinates).all(axis=1))
+    if len(rows) == 0 or n_neighbors < 1:
+        return {}
+    radians = schools.radians[rows]
+    tree = BallTree(radians, leaf_size=DEFAULT_LEAF_SIZE, metric="haversine")
+    distances, idxs = tree.query(radians, k=min(int(n_neighbors), len(rows)))
+    distances = distances * RADIUS_EARTH_M
+    lookup = {}
+    for i, row_idxs, row_distances in zip(rows, idxs, distances):
+        neighbors = rows[row_idxs]
+        keep = (neighbors != i) & (row_distances <= maximum_distance)
+        lookup[schools.coordinate_ids[i]] = (neighbors[keep], row_distances[keep])
+    return lookup
+
+
+def affected_schools(
+    old_schools: CoordinateArray,
+    old_neighbors: Dict,
+    new_schools: CoordinateArray,
+    new_neighbors: Dict,
+    diff: SchoolDiff,
+) -> Set[str]:
+    """
+    Finds the schools whose nearest neighbors changed between two versions of the
+    schools: changed schools, schools with different neighbors and schools with a moved
+    neighbor
+    """
+    changed = set(diff.changed)
+    affected = set()
+    for s, (neighbors, _) in new_neighbors.items():
+        ids = tuple(new_schools.coordinate_ids[neighbors])
+        if s in changed or s not in old_neighbors or any(n in changed for n in ids):
+            affected.add(s)
+        elif ids != tuple(old_schools.coordinate_ids[old_neighbors[s][0]]):
+            affected.add(s)
+    return affected
+
+
+def neighbor_pairs(
+    schools: CoordinateArray, i: int, neighbors: np.ndarray, distances: np.ndarray
+) -> List[PairwiseDistance]:
+    """
+    Pairs (neighbor, school) of a school at row i, in the orientation of the school
+    cache
+    """
+    school = schools.coordinate(i)
+    return [
+        PairwiseDistance(
+            pair_ids=(schools.coordinate_ids[j], school.coordinate_id),
+            distance=d,
+            coordinate1=schools.coordinate(j),
+            coordinate2=school,
+        )
+        for j, d in zip(neighbors.tolist(), distances.tolist())
+    ]
+
+
+class UnreproducibleCacheError(ValueError):
+    """A cache was built with parameters the incremental updater cannot reproduce"""
+
+
+def builder_parameters(parameters: Dict, include_connected: bool) -> Dict:
+    """
+    Builder parameters of a cache from its manifest, in the form of the builder args
+    :param include_connected, whether the updater includes connected schools, it must
+      match the cache
+    :raise UnreproducibleCacheError if the cache was built with parameters the updater
+      cannot reproduce
+    """
+    unknown = sorted(set(parameters) - set(BUILDER_PARAMETERS))
+    if len(unknown) > 0:
+        raise UnreproducibleCacheError(
+            f"the builder parameters {unknown} cannot be reproduced"
+        )
+    if parameters.get("include_connected", include_connected) != include_connected:
+        raise UnreproducibleCacheError(
+            "the cache was built with "
+            f"include_connected={parameters['include_connected']}"
+        )
+    dem_directory = parameters.get("dem_directory", None)
+    if dem_directory is not None and not os.path.isdir(dem_directory):
+        raise UnreproducibleCacheError(
+            f"the elevation tiles in {dem_directory} are not available"
+        )
+    parameters = dict(parameters)
+    if "maximum_distance_meters" in parameters:
+        # non finite distances are stored as strings in manifests
+        parameters["maximum_distance_meters"] = float(
+            parameters["maximum_distance_meters"]
+        )
+    return parameters
+
+
+def creator_args(args, parameters: Dict):
+    """Sets builder parameters on the args of a cache builder"""
+    for k, v in parameters.items():
+        setattr(args, k, v)
+    return args
+
+
+class IncrementalCacheUpdaterArgs:
+    workspace_directory: str = None
+    include_connected: bool = False
+    fiber_maximum_distance_meters: float = math.inf
+    cellular_maximum_distance_meters: float = math.inf
+    school_maximum_distance_meters: float = math.inf
+    visibility_maximum_distance_meters: float = 65000
+    p2p_n_nearest_neighbors: int = 20
+    p2p_maximum_distance_meters: float = math.inf
+    # patching the P2P and school visibility caches queries elevations and line of
+    # sight, when disabled they are cleared instead
+    update_line_of_sight: bool = True
+    progress_bar: bool = False
+
+
+class IncrementalCacheUpdater:
+    """
+    Patches the distance caches of a country in place when its schools change, instead
+    of clearing them and rebuilding them in full. Only the entries of added and moved
+    schools and of the schools whose nearest neighbors they affect are recomputed, line
+    of sight is only queried for those entries. Entries are recomputed with the builder
+    parameters recorded in the manifest of each cache, parameters of caches without a
+    manifest are taken from the args, whose defaults match the cache builders. Caches
+    built with parameters the updater cannot reproduce are cleared so that they get
+    rebuilt, and the elevation profile stores of patched caches are removed as they no
+    longer match them. A cache whose update fails with one of CACHE_UPDATE_ERRORS is
+    left as it is, its manifest no longer matches the schools so it is refused on load
+    until it is rebuilt. Other errors are raised.
+    """
+
+    args: IncrementalCacheUpdaterArgs = None
+
+    def __init__(self, args: IncrementalCacheUpdaterArgs):
+        self.args = args
+
+    def _path(self, file):
+        return os.path.join(self.args.workspace_directory, file)
+
+    def _clear_profiles(self, file, manifest):
+        cache_name = os.path.splitext(file)[0] if manifest is None else manifest.cache
+        if clear_profile_store(self.args.workspace_directory, cache_name):
+            LOGGER.info(
+                f"Removed the elevation profiles of {cache_name}, "
+                "they do not match the updated cache"
+            )
+
+    def clear(self, file, cache_class):
+        """Replaces a cache with an empty one so that it gets rebuilt"""
+        path = self._path(file)
+        if not data_store.file_exists(path):
+            return
+        if cache_class == SingleLookupDistanceCache:
+            cache = SingleLookupDistanceCache(lookup={})
+        else:
+            cache = MultiLookupDistanceCache(lookup={}, n_neighbors=0)
+        write_cache(cache, path, "json")
+        binary_manifest = os.path.join(binary_cache_path(path), BINARY_CACHE_MANIFEST)
+        if data_store.file_exists(binary_manifest):
+            data_store.remove(binary_manifest)
+        manifest = published_manifest(self.args.workspace_directory, file)
+        clear_published_manifest(self.args.workspace_directory, file)
+        self._clear_profiles(file, manifest)
+
+    def _update(self, file, cache_class, update_fn):
+        """
+        Loads a cache, applies the update with the builder parameters of its manifest
+        and writes it back in the formats it was stored in. A cache built with
+        parameters that cannot be reproduced is cleared so that it gets rebuilt, one
+        whose update fails with an expected error is left as it is.
+        """
+        path = self._path(file)
+        if not data_store.file_exists(path):
+            return
+        binary = data_store.file_exists(
+            os.path.join(binary_cache_path(path), BINARY_CACHE_MANIFEST)
+        )
+        manifest = published_manifest(self.args.workspace_directory, file)
+        try:
+            cache = cache_class.from_json(path)
+            if len(cache) == 0 and manifest is None:
+                # empty caches without a manifest were never built, nothing to patch
+                return
+            parameters = {} if manifest is None else manifest.parameters
+            update_fn(
+                cache, builder_parameters(parameters, self.args.include_connected)
+            )
+        except UnreproducibleCacheError as e:
+            LOGGER.warning(f"Could not update {file} incrementally, clearing it: {e}")
+            self.clear(file, cache_class)
+            return
+        except CACHE_UPDATE_ERRORS:
+            LOGGER.warning(
+                f"Could not update {file} incrementally, leaving it as it is",
+                exc_info=True,
+            )
+            return
+        write_cache(cache, path, "both" if binary else "json")
+        self._clear_profiles(file, manifest)
+        if manifest is not None:
+            # the patched cache corresponds to the current input files, with the same
+            # builder parameters
+            CacheManifest.from_workspace(
+                self.args.workspace_directory,
+                manifest.cache,
+                list(manifest.inputs),
+                **manifest.parameters,
+            ).save(cache_manifest_path(path))
+
+    def update_nearest_cache(
+        self,
+        cache: SingleLookupDistanceCache,
+        schools: CoordinateArray,
+        targets: CoordinateArray,
+        diff: SchoolDiff,
+        maximum_distance: float = math.inf,
+    ):
+        """
+        Updates a one to one cache of the nearest target of each school, e.g. fiber
+        nodes or cell towers
+        """
+        for s in diff.stale:
+            cache.lookup.pop(s, None)
+        changed = schools.take(
+            [schools.index[s] for s in diff.changed if s in schools.index]
+        )
+        if len(changed) == 0 or len(targets) == 0:
+            return
+        model = VectorizedDistanceModel(
+            n_nearest_neighbors=1, maximum_distance=maximum_distance
+        )
+        distances = model.run((changed, targets))
+        cache.lookup.update(SingleLookupDistanceCache.from_distances(distances).lookup)
+
+    def update_p2p_cache(
+        self,
+        cache: SingleLookupDistanceCache,
+        schools: CoordinateArray,
+        diff: SchoolDiff,
+        parameters: Dict = {},
+    ):
+        """
+        Updates the closest visible tower of the changed schools
+        :param parameters, the builder parameters of the cache
+        """
+        for s in diff.stale:
+            cache.lookup.pop(s, None)
+        changed = schools.take(
+            [schools.index[s] for s in diff.changed if s in schools.index]
+        )
+        if len(changed) == 0:
+            return
+        args = P2PCacheCreatorArgs()
+        args.workspace_directory = self.args.workspace_directory
+        args.n_nearest_neighbors = self.args.p2p_n_nearest_neighbors
+        args.maximum_distance_meters = self.args.p2p_maximum_distance_meters
+        args.progress_bar = self.args.progress_bar
+        args.export_to_file = False
+        creator_args(args, parameters)
+        creator = P2PCacheCreator(args, school_coords=changed.to_coordinates())
+        if len(creator.towers) == 0:
+            return
+        closest_towers = MultiLookupDistanceCache.from_distances(
+            creator.closest_towers()
+        )
+        visible = creator.visible_links(creator.school_coords, closest_towers.lookup)
+        cache.lookup.update(
+            SingleLookupDistanceCache.from_distances(
+                [p.reversed() for p in visible]
+            ).lookup
+        )
+
+    def update_school_cache(
+        self,
+        cache: MultiLookupDistanceCache,
+        old_schools: CoordinateArray,
+        new_schools: CoordinateArray,
+        diff: SchoolDiff,
+        parameters: Dict = {},
+    ):
+        """Recomputes the nearest school neighbors of the affected schools"""
+        maximum_distance = parameters.get(
+            "maximum_distance_meters", self.args.school_maximum_distance_meters
+        )
+        # empty caches do not record their number of neighbors, their manifest does
+        k = int(parameters.get("n_nearest_neighbors", cache.n_neighbors))
+        cache.n_neighbors = k
+        old_neighbors = nearest_school_neighbors(old_schools, k, maximum_distance)
+        new_neighbors = nearest_school_neighbors(new_schools, k, maximum_distance)
+        affected = affected_schools(
+            old_schools, old_neighbors, new_schools, new_neighbors, diff
+        )
+        for s in set(diff.stale) | (set(old_neighbors) - set(new_neighbors)):
+            cache.lookup.pop(s, None)
+        for s in affected:
+            row = neighbor_pairs(new_schools, new_schools.index[s], *new_neighbors[s])
+            if len(row) > 0:
+                cache.lookup[s] = row
+            else:
+                cache.lookup.pop(s, None)
+        LOGGER.info(f"Updated the school distances of {len(affected)} schools")
+
+    def update_visibility_cache(
+        self,
+        cache: MultiLookupDistanceCache,
+        old_schools: CoordinateArray,
+        new_schools: CoordinateArray,
+        diff: SchoolDiff,
+        parameters: Dict = {},
+    ):
+        """
+        Updates the visible school neighbors, the cache holds for each school the
+        schools that have it among their nearest neighbors with line of sight, as pairs
+        (school, neighbor). Line of sight is queried for the pairs of the affected
+        schools and for the neighbors that lost an entry of a full row, as an entry that
+        did not fit in that row before may now take its place.
+        :param parameters, the builder parameters of the cache
+        """
+        # empty caches do not record their number of neighbors, their manifest does
+        k = int(parameters.get("n_nearest_neighbors", cache.n_neighbors))
+        cache.n_neighbors = k
+        maximum_distance = parameters.get(
+            "maximum_distance_meters", self.args.visibility_maximum_distance_meters
+        )
+        old_neighbors = nearest_school_neighbors(old_schools, k, maximum_distance)
+        new_neighbors = nearest_school_neighbors(new_schools, k, maximum_distance)
+        affected = affected_schools(
+            old_schools, old_neighbors, new_schools, new_neighbors, diff
+        )
+        removed = set(diff.stale) | (set(old_neighbors) - set(new_neighbors))
+        invalid = affected | removed
+        # drop the pairs of the affected schools
+        reopened = set()
+        for x in list(cache.lookup):
+            if x in removed:
+                del cache.lookup[x]
+                continue
+            row = cache.lookup[x]
+            kept = [p for p in row if p.pair_ids[0] not in invalid]
+            if len(kept) < len(row):
+                if len(row) >= k:
+                    reopened.add(x)
+                if len(kept) > 0:
+                    cache.lookup[x] = kept
+                else:
+                    del cache.lookup[x]
+        # candidate neighbors to check the line of sight to, per school
+        candidates = {s: set(new_neighbors[s][0].tolist()) for s in affected}
+        if len(reopened) > 0:
+            for s, (neighbors, _) in new_neighbors.items():
+                if s in invalid:
+                    continue
+                for j in neighbors.tolist():
+                    x = new_schools.coordinate_ids[j]
+                    if x in reopened and not any(
+                        p.pair_ids[0] == s for p in cache.lookup.get(x, [])
+                    ):
+                        candidates.setdefault(s, set()).add(j)
+        args = VisibilityCacheCreatorArgs()
+        args.workspace_directory = self.args.workspace_directory
+        args.n_nearest_neighbors = k
+        args.maximum_distance_meters = maximum_distance
+        args.progress_bar = self.args.progress_bar
+        args.export_to_file = False
+        creator_args(
+            args, {p: v for p, v in parameters.items() if p != "n_nearest_neighbors"}
+        )
+        creator = VisibilityCacheCreator(args)
+        touched = set(reopened)
+        batch = []
+        for s, rows in candidates.items():
+            if len(rows) == 0:
+                continue
+            i = new_schools.index[s]
+            neighbors, distances = new_neighbors[s]
+            keep = np.isin(neighbors, list(rows))
+            batch.append(
+                (
+                    new_schools.coordinate(i),
+                    neighbor_pairs(new_schools, i, neighbors[keep], distances[keep]),
+                )
+            )
+        for p in creator.prune_obstructed_links(batch):
+            x = p.pair_ids[0]
+            cache.lookup.setdefault(x, []).append(p.reversed())
+            touched.add(x)
+        for x in touched:
+            row = sorted(cache.lookup.get(x, []), key=lambda p: p.distance)[0:k]
+            if len(row) > 0:
+                cache.lookup[x] = row
+            else:
+                cache.lookup.pop(x, None)
+        LOGGER.info(
+            f"Updated the school visibility of {len(candidates)} schools "
+            f"and {len(touched)} neighbors"
+        )
+
+    def run(self, previous_file: str, current_file: str) -> SchoolDiff:
+        """
+        Updates the distance caches in the workspace directory from the previous to the
+        current schools
+        :param previous_file, the school file the existing caches were built from
+        :param current_file, the updated school file
+        :return the differences between the schools that were applied to the caches
+        """
+        diff = SchoolDiff.from_frames(
+            read_school_frame(previous_file), read_school_frame(current_file)
+        )
+        if diff.is_empty:
+            return diff
+        LOGGER.info(
+            f"Updating distance caches in {self.args.workspace_directory}: "
+            f"{len(diff.added)} schools added, {len(diff.removed)} removed "
+            f"and {len(diff.moved)} moved"
+        )
+        include_connected = self.args.include_connected
+        old_schools = school_coordinate_array(previous_file, include_connected)
+        new_schools = school_coordinate_array(current_file, include_connected)
+        self._update(
+            FIBER_CACHE_FILE,
+            SingleLookupDistanceCache,
+            lambda cache, parameters: self.update_nearest_cache(
+                cache,
+                new_schools,
+                UniqueCoordinateTable.array_from_csv(self._path(FIBER_FILE)),
+                diff,
+                parameters.get(
+                    "maximum_distance_meters", self.args.fiber_maximum_distance_meters
+                ),
+            ),
+        )
+        self._update(
+            CELL_CACHE_FILE,
+            SingleLookupDistanceCache,
+            lambda cache, parameters: self.update_nearest_cache(
+                cache,
+                new_schools,
+                CellTowerTable.from_csv(self._path(CELL_FILE)).to_coordinate_array(),
+                diff,
+                parameters.get(
+                    "maximum_distance_meters",
+                    self.args.cellular_maximum_distance_meters,
+                ),
+            ),
+        )
+        self._update(
+            SCHOOLS_CACHE_FILE,
+            MultiLookupDistanceCache,
+            lambda cache, parameters: self.update_school_cache(
+                cache, old_schools, new_schools, diff, parameters
+            ),
+        )
+        if not self.args.update_line_of_sight:
+            LOGGER.info(
+                "Clearing the P2P and school visibility caches, they are not patched"
+            )
+            self.clear(P2P_CACHE_FILE, SingleLookupDistanceCache)
+            self.clear(SCHOOLS_VISIBILITY_CACHE_FILE, MultiLookupDistanceCache)
+            return diff
+        # the p2p cache is built for all schools
+        self._update(
+            P2P_CACHE_FILE,
+            SingleLookupDistanceCache,
+            lambda cache, parameters: self.update_p2p_cache(
+                cache,
+                school_coordinate_array(current_file, include_connected=True),
+                diff,
+                parameters,
+            ),
+        )
+        self._update(
+            SCHOOLS_VISIBILITY_CACHE_FILE,
+            MultiLookupDistanceCache,
+            lambda cache, parameters: self.update_visibility_cache(
+                cache, old_schools, new_schools, diff, parameters
+            ),
+        )
+        return diff
@@ -1,6 +1,6 @@
 import os
 import io
-from typing import Literal
+from typing import Literal, List
 from pydantic import BaseModel, validator
 
 from giga.schemas.geo import UniqueCoordinateTable
@@ -78,8 +78,13 @@ class LocalConnectCachePipeline(BaseModel):
             raise ValueError(f"Invalid workspace {v}")
         return v
 
-    def load(self, **kwargs):
-        return GreedyConnectCache.from_workspace(self.workspace, **kwargs)
+    def load(self, school_ids: List[str] = None, **kwargs):
+        """
+        Loads the caches of the workspace, if school ids are given only their entries are kept,
+        binary caches are memory-mapped so only the selected rows are read
+        and JSON caches only parse the selected entries
+        """
+        return GreedyConnectCache.from_workspace(self.workspace, school_ids=school_ids, **kwargs)
 
 
 class UploadedTablePipeline(BaseModel):
@@ -2,7 +2,7 @@ import pandas as pd
 import numpy as np
 import networkx as nx
 
-from giga.schemas.geo import PairwiseDistance
+from giga.schemas.geo import PairwiseDistance, CoordinateArray, EdgeArray
 
 
 class ConnectedCostGraph:
@@ -12,9 +12,11 @@ class ConnectedCostGraph:
     connecting the school to connectivity infrastructure.
     """
 
-    def __init__(self, graph, coordinates=None):
+    def __init__(self, graph, coordinates=None, edges=None):
         self.graph = graph
         self.coordinates = coordinates
+        # edge array the graph was built from, holds node coordinates and cluster roots
+        self.edges = edges
 
     @staticmethod
     def from_pairwise_distances(distances):
@@ -37,6 +39,21 @@ class ConnectedCostGraph:
         )
         return ConnectedCostGraph(G, coords)
 
+    @staticmethod
+    def from_edge_array(edges: EdgeArray):
+        # Create a directed graph from an edge array, node coordinates stay in the edge array
+        frame = pd.DataFrame(
+            {
+                "source": edges.source_ids,
+                "target": edges.target_ids,
+                "weight": np.round(edges.distance).astype(int),
+            }
+        )
+        G = nx.from_pandas_edgelist(
+            frame, edge_attr="weight", create_using=nx.DiGraph()
+        )
+        return ConnectedCostGraph(G, edges=edges)
+
     @property
     def total_cost(self):
         # The total cost of the graph is the sum of the weights of all edges
@@ -78,3 +95,22 @@ class ConnectedCostGraph:
             )
             for e in edges
         ]
+
+    def to_edge_array(self):
+        # Convert the graph back to an edge array that shares the nodes of the input edges
+        edges = list(self.graph.edges(data=True))
+        if self.edges is None:
+            nodes = CoordinateArray.from_coordinates(list((self.coordinates or {}).values()))
+            roots = None
+        else:
+            nodes = self.edges.nodes
+            roots = self.edges.node_roots
+        if len(edges) == 0:
+            return EdgeArray.empty(nodes)
+        index = nodes.index
+        source = np.array([index[e[0]] for e in edges], dtype=np.int32)
+        target = np.array([index[e[1]] for e in edges], dtype=np.int32)
+        distance = [e[2]["weight"] for e in edges]
+        return EdgeArray(
+            nodes, source, target, distance, None if roots is None else roots[target]
+        )
@@ -26,12 +26,17 @@ class ModelDataSpace:
         self._fiber_map = None
         self._cell_tower_map = None
         self._cell_tower_coordinates = None
+        self._school_coordinate_array = None
+        self._fiber_coordinate_array = None
+        self._cell_tower_coordinate_array = None
         self._fiber_cache = None
         self._cellular_cache = None
         self._p2p_cache = None
         self._for_infra_fiber_cache = None
         self._for_infra_unconnected_schools = None
         self._for_infra_connected_schools = None
+        # school ids of a filtered space, caches are loaded only for these schools
+        self._cache_school_ids = None
         self.selected_space = False
 
     @property
@@ -81,6 +86,15 @@ class ModelDataSpace:
         """
         return self.schools.to_coordinates()
     
+    @property
+    def school_coordinate_array(self):
+        """
+        Accessor for school coordinates as a columnar CoordinateArray - id, lat, lon arrays
+        """
+        if self._school_coordinate_array is None:
+            self._school_coordinate_array = self.schools.to_coordinate_array()
+        return self._school_coordinate_array
+
     @property
     def school_with_electricity_coordinates(self):
         """
@@ -128,6 +142,15 @@ class ModelDataSpace:
         """
         return self.fiber_map.coordinates
 
+    @property
+    def fiber_coordinate_array(self):
+        """
+        Accessor to fiber coordinates as a columnar CoordinateArray - id, lat, lon arrays
+        """
+        if self._fiber_coordinate_array is None:
+            self._fiber_coordinate_array = self.fiber_map.to_coordinate_array()
+        return self._fiber_coordinate_array
+
     @property
     def cell_tower_map(self):
         """
@@ -149,6 +172,15 @@ class ModelDataSpace:
             self._cell_tower_coordinates = self.cell_tower_map.to_coordinates()
         return self._cell_tower_coordinates
 
+    @property
+    def cell_tower_coordinate_array(self):
+        """
+        Accessor to cell tower coordinates as a columnar CoordinateArray - id, lat, lon arrays
+        """
+        if self._cell_tower_coordinate_array is None:
+            self._cell_tower_coordinate_array = self.cell_tower_map.to_coordinate_array()
+        return self._cell_tower_coordinate_array
+
     @property
     def fiber_cache(self):
         """
@@ -161,7 +193,9 @@ class ModelDataSpace:
                 # skip and return None if no configuration
                 return self._fiber_cache
             else:
-                self._fiber_cache = self.config.fiber_distance_cache_conf.load()
+                self._fiber_cache = self.config.fiber_distance_cache_conf.load(
+                    school_ids=self._cache_school_ids
+                )
         return self._fiber_cache
 
     @property
@@ -175,7 +209,9 @@ class ModelDataSpace:
                 # skip and return None if no configuration
                 return self._cellular_cache
             else:
-                self._cellular_cache = self.config.cellular_distance_cache_conf.load()
+                self._cellular_cache = self.config.cellular_distance_cache_conf.load(
+                    school_ids=self._cache_school_ids
+                )
         return self._cellular_cache
 
     @property
@@ -190,9 +226,15 @@ class ModelDataSpace:
                 # skip and return None if no configuration
                 return self._p2p_cache
             else:
-                self._p2p_cache = self.config.p2p_distance_cache_conf.load()
+                self._p2p_cache = self.config.p2p_distance_cache_conf.load(
+                    school_ids=self._cache_school_ids
+                )
         return self._p2p_cache
 
+    @staticmethod
+    def _subset_cache(cache, school_ids: List[str]):
+        return None if cache is None else cache.subset(school_ids)
+
     def filter_schools(self, school_ids: List[str]):
         """
         Filters and returns the school entities with the specified ids
@@ -221,9 +263,19 @@ class ModelDataSpace:
         new_space._fiber_map = self._fiber_map
         new_space._cell_tower_map = self._cell_tower_map
         new_space._cell_tower_coordinates = self._cell_tower_coordinates
-        new_space._fiber_cache = self._fiber_cache
-        new_space._cellular_cache = self._cellular_cache
-        new_space._p2p_cache = self._p2p_cache
+        new_space._fiber_coordinate_array = self._fiber_coordinate_array
+        new_space._cell_tower_coordinate_array = self._cell_tower_coordinate_array
+        if len(school_ids)==len(self._all_schools.school_ids):
+            new_space._cache_school_ids = self._cache_school_ids
+            new_space._fiber_cache = self._fiber_cache
+            new_space._cellular_cache = self._cellular_cache
+            new_space._p2p_cache = self._p2p_cache
+        else:
+            # caches that are already loaded are subset, others are loaded lazily for the selection only
+            new_space._cache_school_ids = list(school_ids)
+            new_space._fiber_cache = self._subset_cache(self._fiber_cache, school_ids)
+            new_space._cellular_cache = self._subset_cache(self._cellular_cache, school_ids)
+            new_space._p2p_cache = self._subset_cache(self._p2p_cache, school_ids)
         new_space.selected_space = True
         return new_space
 
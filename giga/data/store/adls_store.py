@@ -1,9 +1,11 @@
 import contextlib
 import io
 import logging
-from typing import Any, List, Generator, IO
+from typing import Any, List, Generator, IO, Optional, Tuple
+from azure.core.exceptions import ResourceNotFoundError
 from azure.storage.blob import BlobServiceClient
 from .data_store import DataStore
+from .compression import IteratorReader, decompressing_reader, compression_from_path, compress_bytes, TEXT_ENCODING
 import os
 
 from giga.utils.globals import COUNTRY_DEFAULT_RELATIVE_DIR
@@ -55,10 +57,9 @@ class ADLSDataStore(DataStore):
         return path
 
     def read_file(self, path: str) -> Any:
-        blob_file_path = self._adls_path(path)
-        blob_client = self.blob_service_client.get_blob_client(container=self.container, blob=blob_file_path,
-                                                               snapshot=None)
-        return blob_client.download_blob(encoding='UTF-8').readall()
+        # streamed and decompressed by open
+        with self.open(path, 'r') as f:
+            return f.read()
 
     def write_file(self, path: str, data: Any) -> None:
         blob_file_path = self._adls_path(path)
@@ -79,6 +80,16 @@ class ADLSDataStore(DataStore):
         blob_client = self.blob_service_client.get_blob_client(container=self.container, blob=blob_file_path,
                                                                snapshot=None)
         return blob_client.exists()
+
+    def file_version(self, path: str) -> Optional[Tuple]:
+        blob_file_path = self._adls_path(path)
+        blob_client = self.blob_service_client.get_blob_client(container=self.container, blob=blob_file_path,
+                                                               snapshot=None)
+        try:
+            properties = blob_client.get_blob_properties()
+        except ResourceNotFoundError:
+            return None
+        return (properties.etag, properties.size, properties.last_modified)
     
     def file_size(self, path: str) -> float:
         blob_file_path = self._adls_path(path)
@@ -105,24 +116,32 @@ class ADLSDataStore(DataStore):
             yield (dirpath, [], [filename])
 
     @contextlib.contextmanager
-    def open(self, path: str, mode: str = 'r') -> IO:
+    def open(self, path: str, mode: str = 'r', compression: str = None) -> IO:
         # read or write depending on operation
-        if mode == 'w':
+        if mode in ('w', 'wb'):
             # create file object that will be written to
-            file = io.StringIO()
+            file = io.StringIO() if mode == 'w' else io.BytesIO()
             yield file
 
-            # save the data from the file object to blob storage
+            # save the data from the file object to blob storage, compressed if requested
             data = file.getvalue()
-            self.write_file(path, data)
-
-        elif mode == 'r':
-            # download the data from blob storage
-            data = self.read_file(path)
+            if mode == 'w':
+                data = data.encode(TEXT_ENCODING)
+            self.write_file(path, compress_bytes(data, compression or compression_from_path(path)))
+
+        elif mode in ('r', 'rb'):
+            # stream the blob in chunks and decompress it while it is read
+            blob_file_path = self._adls_path(path)
+            blob_client = self.blob_service_client.get_blob_client(container=self.container, blob=blob_file_path,
+                                                                   snapshot=None)
+            file = decompressing_reader(IteratorReader(blob_client.download_blob().chunks()), mode)
+            try:
+                yield file
+            finally:
+                file.close()
 
-            # add data to the file object so that it can be read
-            file = io.StringIO(data)
-            yield file
+        else:
+            raise ValueError(f"Unsupported file mode {mode}")
 
     def is_file(self, path: str) -> bool:
         return self.file_exists(path)
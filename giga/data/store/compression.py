@@ -0,0 +1,153 @@
+import io
+import gzip
+from typing import IO, Iterator, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+COMPRESSIONS = ["gzip", "zstd"]
+COMPRESSION_EXTENSIONS = {".gz": "gzip", ".zst": "zstd"}
+GZIP_COMPRESSION_LEVEL = 6
+ZSTD_COMPRESSION_LEVEL = 3
+TEXT_ENCODING = "utf-8"
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError(
+            "zstd compressed files require the zstandard package, install it with: pip install zstandard"
+        )
+
+
+def detect_compression(header: bytes) -> Optional[str]:
+    """Compression of a file from its first bytes, None for uncompressed files"""
+    if header.startswith(GZIP_MAGIC):
+        return "gzip"
+    if header.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return None
+
+
+def compression_from_path(path: str) -> Optional[str]:
+    """Compression implied by the extension of a file name, e.g. schools.csv.zst"""
+    for extension, compression in COMPRESSION_EXTENSIONS.items():
+        if path.endswith(extension):
+            return compression
+    return None
+
+
+def _check_compression(compression: Optional[str]):
+    assert compression is None or compression in COMPRESSIONS, f"Unsupported compression {compression}"
+
+
+class _ClosingGzipFile(gzip.GzipFile):
+    # a gzip stream that also closes the file object it wraps
+    def close(self):
+        fileobj = self.fileobj
+        try:
+            super().close()
+        finally:
+            if fileobj is not None:
+                fileobj.close()
+
+
+class IteratorReader(io.RawIOBase):
+    """A readable binary stream over an iterator of byte chunks, e.g. a blob download"""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self.chunks = iter(chunks)
+        self.pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.pending:
+            self.pending = next(self.chunks, None)
+            if self.pending is None:
+                self.pending = b""
+                return 0
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+
+def _peek_header(raw: IO[bytes]):
+    # reads the first bytes of a stream without consuming them
+    if hasattr(raw, "peek"):
+        return raw, raw.peek(4)[:4]
+    if raw.seekable():
+        header = raw.read(4)
+        raw.seek(0)
+        return raw, header
+    raw = io.BufferedReader(raw)
+    return raw, raw.peek(4)[:4]
+
+
+def decompressing_reader(raw: IO[bytes], mode: str = "rb") -> IO:
+    """
+    Wraps a binary stream so that gzip and zstd compressed contents are decompressed while they are read,
+    the compression is detected from the first bytes of the stream
+    :param mode, "rb" for a binary stream or "r" for a text stream
+    """
+    raw, header = _peek_header(raw)
+    compression = detect_compression(header)
+    if compression == "gzip":
+        stream = _ClosingGzipFile(fileobj=raw, mode="rb")
+    elif compression == "zstd":
+        _require_zstandard()
+        stream = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True))
+    else:
+        stream = raw
+    if "b" in mode:
+        return stream
+    return io.TextIOWrapper(stream, encoding=TEXT_ENCODING)
+
+
+def compressing_writer(raw: IO[bytes], compression: str, mode: str = "wb") -> IO:
+    """
+    Wraps a binary stream so that the data written to it is compressed
+    :param compression, one of "gzip" or "zstd"
+    :param mode, "wb" for a binary stream or "w" for a text stream
+    """
+    _check_compression(compression)
+    if compression == "gzip":
+        # a fixed modification time keeps the compressed output deterministic
+        stream = _ClosingGzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_COMPRESSION_LEVEL, mtime=0)
+    else:
+        _require_zstandard()
+        stream = io.BufferedWriter(
+            zstandard.ZstdCompressor(level=ZSTD_COMPRESSION_LEVEL).stream_writer(raw, closefd=True)
+        )
+    if "b" in mode:
+        return stream
+    return io.TextIOWrapper(stream, encoding=TEXT_ENCODING)
+
+
+def compress_bytes(data: bytes, compression: Optional[str]) -> bytes:
+    """Compresses data in memory, data is returned as is without compression"""
+    _check_compression(compression)
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_COMPRESSION_LEVEL, mtime=0)
+    if compression == "zstd":
+        _require_zstandard()
+        return zstandard.ZstdCompressor(level=ZSTD_COMPRESSION_LEVEL).compress(data)
+    return data
+
+
+def decompress_bytes(data: bytes) -> bytes:
+    """Decompresses gzip and zstd compressed data in memory, uncompressed data is returned as is"""
+    compression = detect_compression(data[:4])
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "zstd":
+        _require_zstandard()
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as reader:
+            return reader.read()
+    return data
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Any, List, Generator, IO
+from typing import Any, List, Generator, IO, Optional, Tuple
 
 
 class DataStore(ABC):
@@ -35,6 +35,15 @@ class DataStore(ABC):
         """
         pass
 
+    @abstractmethod
+    def file_version(self, path: str) -> Optional[Tuple]:
+        """
+        Identify the current version of a file in the data store from its metadata, without reading it.
+        :param path: Path to the file in the data store.
+        :return: A tuple that changes whenever the contents of the file change, None if the file does not exist.
+        """
+        pass
+
     @abstractmethod
     def list_files(self, path: str) -> List[str]:
         """
@@ -54,11 +63,14 @@ class DataStore(ABC):
         pass
 
     @abstractmethod
-    def open(self, file: str, mode: str='r') -> IO:
+    def open(self, file: str, mode: str='r', compression: str=None) -> IO:
         """
-        Open a file.
+        Open a file. Gzip and zstd compressed files are detected when reading and
+        decompressed transparently while they are streamed.
         :param file: The file path.
         :param mode: The mode in which the file is opened.
+        :param compression: The compression applied when writing, "gzip" or "zstd".
+                            Defaults to the compression implied by the file extension (.gz or .zst).
         :return: a file object.
         """
         pass
@@ -1,6 +1,7 @@
-from typing import Any, List, Generator, IO
+from typing import Any, List, Generator, IO, Optional, Tuple
 from google.cloud import storage
 from .data_store import DataStore
+from .compression import decompressing_reader, compressing_writer, compression_from_path, decompress_bytes, TEXT_ENCODING
 import os
 import gcsfs
 import json
@@ -51,7 +52,7 @@ class GCSDataStore(DataStore):
 
     def read_file(self, path: str) -> Any:
         blob = self.bucket.blob(self._gcs_path(path))
-        return blob.download_as_text()
+        return decompress_bytes(blob.download_as_bytes()).decode(TEXT_ENCODING)
 
     def write_file(self, path: str, data: Any) -> None:
         blob = self.bucket.blob(self._gcs_path(path))
@@ -60,6 +61,13 @@ class GCSDataStore(DataStore):
     def file_exists(self, path: str) -> bool:
         blob = self.bucket.blob(self._gcs_path(path))
         return blob.exists()
+
+    def file_version(self, path: str) -> Optional[Tuple]:
+        # the metadata of the blob, None if it does not exist
+        blob = self.bucket.get_blob(self._gcs_path(path))
+        if blob is None:
+            return None
+        return (blob.etag, blob.size, blob.updated)
     
     def list_files(self, path: str) -> List[str]:
         blobs = self.client.list_blobs(self.bucket, prefix=self._gcs_path(path))
@@ -73,8 +81,13 @@ class GCSDataStore(DataStore):
             dirpath, filename = os.path.split(blob.name)
             yield (dirpath, [], [filename])
 
-    def open(self, file: str, mode: str='r') -> IO:
+    def open(self, file: str, mode: str='r', compression: str=None) -> IO:
         fs_path = f"{GCS_BUCKET_NAME}/{self._gcs_path(file)}"
+        if mode in ('r', 'rb'):
+            return decompressing_reader(self.fs.open(fs_path, 'rb'), mode)
+        compression = compression or compression_from_path(file)
+        if compression is not None and mode in ('w', 'wb'):
+            return compressing_writer(self.fs.open(fs_path, 'wb'), compression, mode)
         return self.fs.open(fs_path, mode)
     
     def is_file(self, path: str) -> bool:
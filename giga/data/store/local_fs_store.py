@@ -1,6 +1,7 @@
 import os
-from typing import Any, List, Generator, IO
+from typing import Any, List, Generator, IO, Optional, Tuple
 from .data_store import DataStore
+from .compression import decompressing_reader, compressing_writer, compression_from_path
 
 
 class LocalFS(DataStore):
@@ -11,7 +12,7 @@ class LocalFS(DataStore):
     """
 
     def read_file(self, path: str) -> Any:
-        with open(path, "r") as f:
+        with self.open(path, "r") as f:
             return f.read()
 
     def write_file(self, path: str, data: Any) -> None:
@@ -20,6 +21,12 @@ class LocalFS(DataStore):
 
     def file_exists(self, path: str) -> bool:
         return os.path.isfile(path)
+
+    def file_version(self, path: str) -> Optional[Tuple]:
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        return (stat.st_size, stat.st_mtime_ns)
     
     def list_files(self, path: str) -> List[str]:
         return [f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
@@ -27,7 +34,12 @@ class LocalFS(DataStore):
     def walk(self, top: str) -> Generator:
         return os.walk(top)
     
-    def open(self, file: str, mode: str='r') -> IO:
+    def open(self, file: str, mode: str='r', compression: str=None) -> IO:
+        if mode in ('r', 'rb'):
+            return decompressing_reader(open(file, 'rb'), mode)
+        compression = compression or compression_from_path(file)
+        if compression is not None and mode in ('w', 'wb'):
+            return compressing_writer(open(file, 'wb'), compression, mode)
         return open(file, mode)
     
     def is_file(self, path: str) -> bool:
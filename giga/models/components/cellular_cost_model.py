@@ -1,11 +1,11 @@
-from typing import List
+from typing import List, Union
 import math
 from pydantic import validate_arguments
 
 from giga.models.nodes.graph.greedy_distance_connector import GreedyDistanceConnector
 from giga.schemas.conf.models import CellularTechnologyCostConf
 from giga.schemas.output import CostResultSpace, SchoolConnectionCosts
-from giga.schemas.geo import PairwiseDistance
+from giga.schemas.geo import PairwiseDistance, EdgeArray
 from giga.data.space.model_data_space import ModelDataSpace
 from giga.models.components.electricity_cost_model import ElectricityCostModel
 from giga.utils.logging import LOGGER
@@ -41,7 +41,7 @@ class CellularCostModel:
         )
 
     def compute_costs(
-        self, distances: List[PairwiseDistance], data_space: ModelDataSpace, tower_coordinates: List
+        self, distances: Union[EdgeArray, List[PairwiseDistance]], data_space: ModelDataSpace, tower_coordinates: List
     ) -> List[SchoolConnectionCosts]:
         """
         Compute the cost of cellular connectivity for each school in the data space.
@@ -51,7 +51,7 @@ class CellularCostModel:
         """
         new_electricity = self.config.electricity_config.constraints.allow_new_electricity
         electricity_model = ElectricityCostModel(self.config)
-        connected_set = set([x.coordinate1.coordinate_id for x in distances])
+        connected_set = set(EdgeArray.from_distances(distances).target_ids)
         capex_consumer = self._cost_of_setup()
         costs = []
         for school in data_space.school_entities:
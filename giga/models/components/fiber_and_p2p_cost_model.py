@@ -1,13 +1,16 @@
-from typing import List
+from typing import List, Union
 import math
 from pydantic import validate_arguments
 
-from giga.models.nodes.graph.greedy_distance_connector import DoubleGreedyDistanceConnector
+from giga.models.nodes.graph.competitive_distance_connector import (
+    CompetitiveDistanceConnector,
+    TechnologySource,
+)
 from giga.models.nodes.graph.pairwise_distance_model import PairwiseDistanceModel
 from giga.models.nodes.graph.vectorized_distance_model import VectorizedDistanceModel
 from giga.schemas.conf.models import FiberTechnologyCostConf, P2PTechnologyCostConf
 from giga.schemas.output import CostResultSpace, SchoolConnectionCosts
-from giga.schemas.geo import PairwiseDistance, UniqueCoordinate
+from giga.schemas.geo import PairwiseDistance, UniqueCoordinate, EdgeArray
 from giga.data.space.model_data_space import ModelDataSpace
 from giga.models.components.electricity_cost_model import ElectricityCostModel
 from giga.utils.logging import LOGGER
@@ -52,23 +55,23 @@ class FiberP2PCostModel:
     def fiber_cost_of_maintenance(self, distance_km):
         return distance_km * self.fiber_config.constraints.correction_coeficient * self.fiber_config.opex.cost_per_km
 
-    def fiber_distance_to_capex(self, distances: List[PairwiseDistance]):
+    def fiber_distance_to_capex(self, distances: EdgeArray):
         by_school = {
-            x.coordinate1.coordinate_id: {
-                "school_id": x.coordinate1.coordinate_id,
-                "capex": self.fiber_cost_of_connection(x.distance / METERS_IN_KM),
+            sid: {
+                "school_id": sid,
+                "capex": self.fiber_cost_of_connection(float(distance) / METERS_IN_KM),
             }
-            for x in distances
+            for sid, distance in zip(distances.target_ids, distances.distance)
         }
         return by_school
 
-    def fiber_distance_to_opex(self, distances: List[PairwiseDistance]):
+    def fiber_distance_to_opex(self, distances: EdgeArray):
         by_school = {
-            x.coordinate1.coordinate_id: {
-                "school_id": x.coordinate1.coordinate_id,
-                "opex": self.fiber_cost_of_maintenance(x.distance / METERS_IN_KM),
+            sid: {
+                "school_id": sid,
+                "opex": self.fiber_cost_of_maintenance(float(distance) / METERS_IN_KM),
             }
-            for x in distances
+            for sid, distance in zip(distances.target_ids, distances.distance)
         }
         return by_school
 
@@ -82,7 +85,7 @@ class FiberP2PCostModel:
         return self.fiber_config.capex.fixed_costs
 
     def compute_fiber_costs(
-        self, distances: List[PairwiseDistance], data_space: ModelDataSpace
+        self, distances: Union[EdgeArray, List[PairwiseDistance]], data_space: ModelDataSpace
     ) -> List[SchoolConnectionCosts]:
         """
         Computes the cost of connecting a school to the internet using fiber technology.
@@ -92,6 +95,7 @@ class FiberP2PCostModel:
         """
         new_electricity = self.fiber_config.electricity_config.constraints.allow_new_electricity
         electricity_model = ElectricityCostModel(self.fiber_config)
+        distances = EdgeArray.from_distances(distances)
         capex_costs_provider = self.fiber_distance_to_capex(distances)
         opex_costs_provider = self.fiber_distance_to_opex(distances)
         costs = []
@@ -129,7 +133,7 @@ class FiberP2PCostModel:
         return costs
     
     def compute_p2p_costs(
-        self, distances: List[PairwiseDistance], data_space: ModelDataSpace
+        self, distances: Union[EdgeArray, List[PairwiseDistance]], data_space: ModelDataSpace
     ) -> List[SchoolConnectionCosts]:
         """
         Computes the cost of connecting a school to the internet using P2P technology.
@@ -139,7 +143,7 @@ class FiberP2PCostModel:
         """
         new_electricity = self.p2p_config.electricity_config.constraints.allow_new_electricity
         electricity_model = ElectricityCostModel(self.p2p_config)
-        connected_set = set([x.coordinate1.coordinate_id for x in distances])
+        connected_set = set(EdgeArray.from_distances(distances).target_ids)
         capex_provider = self.p2p_cost_of_setup_provider()
         capex_consumer = self.p2p_cost_of_setup_consumer()
         costs = []
@@ -229,14 +233,26 @@ class FiberP2PCostModel:
 
         distance_threshold = self.get_distance_threshold()* METERS_IN_KM
 
-        connection_model = DoubleGreedyDistanceConnector(
-            [connected,data_space.cell_tower_coordinates],
+        # fiber competes by distance, P2P at the fiber distance where both cost the same
+        fiber_source = TechnologySource(
+            "fiber",
+            connected,
+            distance_cache=data_space.fiber_cache,
             dynamic_connect=self.fiber_config.capex.economies_of_scale,
-            maximum_connection_length_m=[self.fiber_config.constraints.maximum_connection_length * METERS_IN_KM,self.p2p_config.constraints.maximum_range * METERS_IN_KM],
+            maximum_connection_length_m=self.fiber_config.constraints.maximum_connection_length * METERS_IN_KM,
             distance_model=distance_model,
-            progress_bar=progress_bar,
-            distance_cache=[data_space.fiber_cache,data_space.p2p_cache],
-            distance_threshold=distance_threshold
+        )
+        p2p_source = TechnologySource(
+            "p2p",
+            data_space.cell_tower_coordinates,
+            distance_cache=data_space.p2p_cache,
+            dynamic_connect=self.fiber_config.capex.economies_of_scale,
+            maximum_connection_length_m=self.p2p_config.constraints.maximum_range * METERS_IN_KM,
+            distance_model=distance_model,
+            cost_fn=lambda distance: distance_threshold,
+        )
+        connection_model = CompetitiveDistanceConnector(
+            [fiber_source, p2p_source], progress_bar=progress_bar
         )
         new_electricity = self.fiber_config.electricity_config.constraints.allow_new_electricity
         # determine which schools can be connected and their distances
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Union
 import math
 from pydantic import validate_arguments
 
@@ -7,7 +7,7 @@ from giga.models.nodes.graph.pairwise_distance_model import PairwiseDistanceMode
 from giga.models.nodes.graph.vectorized_distance_model import VectorizedDistanceModel
 from giga.schemas.conf.models import FiberTechnologyCostConf
 from giga.schemas.output import CostResultSpace, SchoolConnectionCosts
-from giga.schemas.geo import PairwiseDistance, UniqueCoordinate
+from giga.schemas.geo import PairwiseDistance, UniqueCoordinate, EdgeArray
 from giga.data.space.model_data_space import ModelDataSpace
 from giga.models.components.electricity_cost_model import ElectricityCostModel
 from giga.utils.logging import LOGGER
@@ -39,23 +39,23 @@ class FiberCostModel:
     def _cost_of_maintenance(self, distance_km):
         return distance_km * self.config.constraints.correction_coeficient * self.config.opex.cost_per_km
 
-    def _distance_to_capex(self, distances: List[PairwiseDistance]):
+    def _distance_to_capex(self, distances: EdgeArray):
         by_school = {
-            x.coordinate1.coordinate_id: {
-                "school_id": x.coordinate1.coordinate_id,
-                "capex": self._cost_of_connection(x.distance / METERS_IN_KM),
+            sid: {
+                "school_id": sid,
+                "capex": self._cost_of_connection(float(distance) / METERS_IN_KM),
             }
-            for x in distances
+            for sid, distance in zip(distances.target_ids, distances.distance)
         }
         return by_school
 
-    def _distance_to_opex(self, distances: List[PairwiseDistance]):
+    def _distance_to_opex(self, distances: EdgeArray):
         by_school = {
-            x.coordinate1.coordinate_id: {
-                "school_id": x.coordinate1.coordinate_id,
-                "opex": self._cost_of_maintenance(x.distance / METERS_IN_KM),
+            sid: {
+                "school_id": sid,
+                "opex": self._cost_of_maintenance(float(distance) / METERS_IN_KM),
             }
-            for x in distances
+            for sid, distance in zip(distances.target_ids, distances.distance)
         }
         return by_school
 
@@ -69,7 +69,7 @@ class FiberCostModel:
         return self.config.capex.fixed_costs
 
     def compute_costs(
-        self, distances: List[PairwiseDistance], data_space: ModelDataSpace
+        self, distances: Union[EdgeArray, List[PairwiseDistance]], data_space: ModelDataSpace
     ) -> List[SchoolConnectionCosts]:
         """
         Computes the cost of connecting a school to the internet using fiber technology.
@@ -79,6 +79,7 @@ class FiberCostModel:
         """
         new_electricity = self.config.electricity_config.constraints.allow_new_electricity
         electricity_model = ElectricityCostModel(self.config)
+        distances = EdgeArray.from_distances(distances)
         capex_costs_provider = self._distance_to_capex(distances)
         opex_costs_provider = self._distance_to_opex(distances)
         costs = []
@@ -4,7 +4,7 @@ from typing import List, Set, Dict
 from giga.schemas.output import OutputSpace
 from giga.schemas.conf.models import CostMinimizerConf
 from giga.data.space.connected_cost_graph import ConnectedCostGraph
-from giga.schemas.geo import PairwiseDistanceTable, PairwiseDistance
+from giga.schemas.geo import EdgeArray
 from giga.schemas.output import SchoolConnectionCosts
 from giga.models.nodes.graph.cost_tree_pruner import CostTreePruner,CostTreePrunerV2
 from giga.utils.logging import LOGGER
@@ -30,7 +30,7 @@ class ConstrainedEconomiesOfScaleMinimizer:
         """
         costs = []
         for c in clusters:
-            initial_cost_graph = ConnectedCostGraph.from_pairwise_distances(c)
+            initial_cost_graph = ConnectedCostGraph.from_edge_array(c)
             minimized_cost_graph = pruner.run(initial_cost_graph)
             cluster_schools = [
                 n
@@ -68,7 +68,7 @@ class ConstrainedEconomiesOfScaleMinimizer:
         )
         budget_remaining -= connectivity_cost
         # get the connections between the schools
-        connections = cost_graph.to_pairwise_distances()
+        connections = cost_graph.to_edge_array()
         return budget_remaining, schools, connections
 
     def _process_cost_graph_over_budget(
@@ -85,13 +85,13 @@ class ConstrainedEconomiesOfScaleMinimizer:
             constrained_schools, tech_name, self.config.years_opex
         )
         budget_remaining -= constrained_costs
-        connections = cost_graph.to_pairwise_distances()
+        connections = cost_graph.to_edge_array()
         return budget_remaining, constrained_schools, connections
 
     def minimize_economies_of_scale(
         self,
         output: OutputSpace,
-        clusters: List[List[PairwiseDistance]],
+        clusters: List[EdgeArray],
         root_nodes: Set[str],
         baseline_cost_lookup: Dict[str, SchoolConnectionCosts],
         scenario_id: str,
@@ -150,7 +150,7 @@ class ConstrainedEconomiesOfScaleMinimizer:
                     budget_remaining_l, cost_graph, root_nodes, output,tech_name
                 )
                 school_ids += cluster_schools
-                connections += cluster_connections
+                connections.append(cluster_connections)
             else:
                 # if the cluster cost is above budget, drop leaf nodes until the budget constraint is satisfied
                 pruner = CostTreePruner(
@@ -169,11 +169,11 @@ class ConstrainedEconomiesOfScaleMinimizer:
                     budget_remaining_l, cost_graph, root_nodes, output, pruner,tech_name
                 )
                 school_ids += cluster_schools
-                connections += cost_graph.to_pairwise_distances()
+                connections.append(cost_graph.to_edge_array())
                 break
         # generate a cost collection for the schools that are cost optimal with economies of scale
         minimums = output.get_technology_cost_collection(school_ids, tech_name)
-        return minimums, connections, school_ids, budget_remaining_l
+        return minimums, EdgeArray.concat(connections), school_ids, budget_remaining_l
 
     def minimize_baseline_costs(
         self,
@@ -237,10 +237,10 @@ class ConstrainedEconomiesOfScaleMinimizer:
         )
 
         if "fiber" in self.economies_of_scale:
-            distances = PairwiseDistanceTable(distances=output.fiber_distances)
+            distances = EdgeArray.from_distances(output.fiber_distances)
             # group schools into clusters based on their root node (e.g. fiber nodes)
-            clusters = list(distances.group_by_source().values())
-            root_nodes = set(distances.group_by_source().keys())
+            clusters = list(distances.group_by_root().values())
+            root_nodes = set(distances.group_by_root().keys())
             tech_name = "fiber"
             # minimize the economies of scale costs under the budget constraint
             (
@@ -260,10 +260,10 @@ class ConstrainedEconomiesOfScaleMinimizer:
                 output.fiber_costs.technology_results.distances = connections
 
             if "p2p" in self.economies_of_scale:
-                distances_p2p = PairwiseDistanceTable(distances=output.p2p_distances)
+                distances_p2p = EdgeArray.from_distances(output.p2p_distances)
                 # group schools into clusters based on their root node (e.g. fiber nodes)
-                clusters = list(distances_p2p.group_by_source().values())
-                root_nodes = list(distances_p2p.group_by_source().keys())
+                clusters = list(distances_p2p.group_by_root().values())
+                root_nodes = list(distances_p2p.group_by_root().keys())
                 tech_name = "p2p"
 
                 # minimize the economies of scale costs under the budget constraint
@@ -287,10 +287,10 @@ class ConstrainedEconomiesOfScaleMinimizer:
                     output.p2p_costs.technology_results.distances = connections_p2p
 
         else:#only p2p or nothing
-            distances = PairwiseDistanceTable(distances=output.p2p_distances)
+            distances = EdgeArray.from_distances(output.p2p_distances)
             # group schools into clusters based on their root node (e.g. fiber nodes)
-            clusters = list(distances.group_by_source().values())
-            root_nodes = set(distances.group_by_source().keys())
+            clusters = list(distances.group_by_root().values())
+            root_nodes = set(distances.group_by_root().keys())
             tech_name = "p2p"
             # minimize the economies of scale costs under the budget constraint
             (
@@ -367,16 +367,16 @@ class ConstrainedEconomiesOfScaleMinimizer:
         )
 
         if "fiber" in self.economies_of_scale:
-            distances = PairwiseDistanceTable(distances=output.fiber_distances)
+            distances = EdgeArray.from_distances(output.fiber_distances)
             # group schools into clusters based on their root node (e.g. fiber nodes)
-            clusters = list(distances.group_by_source().values())
-            root_nodes = set(distances.group_by_source().keys())
+            clusters = list(distances.group_by_root().values())
+            root_nodes = set(distances.group_by_root().keys())
             tech_name = "fiber"
         else:
-            distances = PairwiseDistanceTable(distances=output.p2p_distances)
+            distances = EdgeArray.from_distances(output.p2p_distances)
             # group schools into clusters based on their root node (e.g. fiber nodes)
-            clusters = list(distances.group_by_source().values())
-            root_nodes = set(distances.group_by_source().keys())
+            clusters = list(distances.group_by_root().values())
+            root_nodes = set(distances.group_by_root().keys())
             tech_name = "p2p"
         # minimize the economies of scale costs under the budget constraint
         (
@@ -4,7 +4,7 @@ from typing import List, Set, Dict
 from giga.schemas.output import OutputSpace
 from giga.schemas.conf.models import CostMinimizerConf
 from giga.data.space.connected_cost_graph import ConnectedCostGraph
-from giga.schemas.geo import PairwiseDistanceTable, PairwiseDistance
+from giga.schemas.geo import EdgeArray
 from giga.schemas.output import SchoolConnectionCosts
 from giga.models.nodes.graph.cost_tree_pruner import CostTreePrunerV3
 from giga.utils.logging import LOGGER
@@ -32,7 +32,7 @@ class ConstrainedPriorityMinimizer:
         """
         costs = []
         for c in clusters:
-            initial_cost_graph = ConnectedCostGraph.from_pairwise_distances(c)
+            initial_cost_graph = ConnectedCostGraph.from_edge_array(c)
             #minimized_cost_graph = pruner.run(initial_cost_graph)
             cluster_schools = [
                 n
@@ -70,7 +70,7 @@ class ConstrainedPriorityMinimizer:
         )
         budget_remaining -= connectivity_cost
         # get the connections between the schools
-        connections = cost_graph.to_pairwise_distances()
+        connections = cost_graph.to_edge_array()
         return budget_remaining, schools, connections
 
     def _process_cost_graph_over_budget(
@@ -87,13 +87,13 @@ class ConstrainedPriorityMinimizer:
             constrained_schools, self.tech_name, self.config.years_opex
         )
         budget_remaining -= constrained_costs
-        connections = constrained_graph.to_pairwise_distances()
+        connections = constrained_graph.to_edge_array()
         return budget_remaining, constrained_schools, connections
 
     def minimize_economies_of_scale(
         self,
         output: OutputSpace,
-        clusters: List[List[PairwiseDistance]],
+        clusters: List[EdgeArray],
         root_nodes: Set[str],
     ):
         """
@@ -138,7 +138,7 @@ class ConstrainedPriorityMinimizer:
                     budget_remaining, cost_graph, root_nodes, output
                 )
                 school_ids += cluster_schools
-                connections += cluster_connections
+                connections.append(cluster_connections)
             else:
                 # if the cluster cost is above budget, drop leaf nodes until the budget constraint is satisfied
                 pruner = CostTreePrunerV3(
@@ -157,11 +157,11 @@ class ConstrainedPriorityMinimizer:
                     budget_remaining, cost_graph, root_nodes, output, pruner
                 )
                 school_ids += cluster_schools
-                connections += cluster_connections
+                connections.append(cluster_connections)
                 break
         # generate a cost collection for the schools that are cost optimal with economies of scale
         minimums = output.get_technology_cost_collection(school_ids, self.tech_name)
-        return minimums, connections, school_ids, budget_remaining
+        return minimums, EdgeArray.concat(connections), school_ids, budget_remaining
 
     def minimize_baseline_costs(
         self,
@@ -217,10 +217,10 @@ class ConstrainedPriorityMinimizer:
 
     def run(self, output: OutputSpace, new_schools: List[str]):
         if self.tech_name == "fiber":
-            distances = PairwiseDistanceTable(distances=output.fiber_distances)
+            distances = EdgeArray.from_distances(output.fiber_distances)
             # group schools into clusters based on their root node (e.g. fiber nodes)
-            clusters = list(distances.group_by_source().values())
-            root_nodes = set(distances.group_by_source().keys())
+            clusters = list(distances.group_by_root().values())
+            root_nodes = set(distances.group_by_root().keys())
             # minimize the economies of scale costs under the budget constraint
             (
                 economies_of_scale_costs,
@@ -239,10 +239,10 @@ class ConstrainedPriorityMinimizer:
             return self.current_cost+costs,removed_ids
             
         if self.tech_name == "p2p":
-            distances = PairwiseDistanceTable(distances=output.p2p_distances)
+            distances = EdgeArray.from_distances(output.p2p_distances)
             # group schools into clusters based on their root node (e.g. fiber nodes)
-            clusters = list(distances.group_by_source().values())
-            root_nodes = set(distances.group_by_source().keys())
+            clusters = list(distances.group_by_root().values())
+            root_nodes = set(distances.group_by_root().keys())
             # minimize the economies of scale costs under the budget constraint
             (
                 economies_of_scale_costs,
@@ -293,10 +293,10 @@ class ConstrainedPriorityMinimizer:
         baseline_cost_lookup = output.priority_cost_lookup()
 
         if self.tech_name == "fiber":
-            distances = PairwiseDistanceTable(distances=output.fiber_distances)
+            distances = EdgeArray.from_distances(output.fiber_distances)
             # group schools into clusters based on their root node (e.g. fiber nodes)
-            clusters = list(distances.group_by_source().values())
-            root_nodes = set(distances.group_by_source().keys())
+            clusters = list(distances.group_by_root().values())
+            root_nodes = set(distances.group_by_root().keys())
             # minimize the economies of scale costs under the budget constraint
             (
                 economies_of_scale_costs,
@@ -307,10 +307,10 @@ class ConstrainedPriorityMinimizer:
                 output, clusters, root_nodes, baseline_cost_lookup
             )
         elif self.tech_name == "p2p":
-            distances = PairwiseDistanceTable(distances=output.p2p_distances)
+            distances = EdgeArray.from_distances(output.p2p_distances)
             # group schools into clusters based on their root node (e.g. fiber nodes)
-            clusters = list(distances.group_by_source().values())
-            root_nodes = set(distances.group_by_source().keys())
+            clusters = list(distances.group_by_root().values())
+            root_nodes = set(distances.group_by_root().keys())
             # minimize the economies of scale costs under the budget constraint
             (
                 economies_of_scale_costs,
@@ -3,7 +3,7 @@ from typing import List
 from giga.schemas.output import OutputSpace
 from giga.schemas.conf.models import CostMinimizerConf
 from giga.data.space.connected_cost_graph import ConnectedCostGraph
-from giga.schemas.geo import PairwiseDistanceTable, PairwiseDistance
+from giga.schemas.geo import EdgeArray
 from giga.models.nodes.graph.cost_tree_pruner import CostTreePruner
 from giga.models.nodes.graph.cost_tree_pruner import CostTreePrunerV2
 from giga.utils.logging import LOGGER
@@ -27,7 +27,7 @@ class EconomiesOfScaleMinimizer:
     def compute_economies_of_scale_minimums(
         self,
         output: OutputSpace,
-        clusters: List[List[PairwiseDistance]],
+        clusters: List[EdgeArray],
         pruner: CostTreePrunerV2,
         tech_name: str,
     ):
@@ -35,7 +35,7 @@ class EconomiesOfScaleMinimizer:
         This method computes the minimum cost of a connected cost graph
         for each cluster of schools.
         :param output: OutputSpace, that contains cost results for individual technologies
-        :param clusters: List[List[PairwiseDistance]], a list of clusters of schools
+        :param clusters: List[EdgeArray], a list of clusters of schools
         :param pruner: CostTreePruner, a pruner that can be used to remove the largest cost leaf nodes iteratively
         :return: tuple of minimums, economies_of_scale_ids, new_connections which represent
                  the minimum costs for each school in all the clusters that are cost optimal with economies of scale,
@@ -47,7 +47,7 @@ class EconomiesOfScaleMinimizer:
         new_connections = []
         for c in clusters:
             # for each cluster of schools, find the minimum cost graph
-            initial_cost_graph = ConnectedCostGraph.from_pairwise_distances(c)
+            initial_cost_graph = ConnectedCostGraph.from_edge_array(c)
             minimized_cost_graph = pruner.run(initial_cost_graph)
             # track schools that are cost optimal with economies of scale
             economies_of_scale_ids += [
@@ -55,12 +55,12 @@ class EconomiesOfScaleMinimizer:
                 for n in list(minimized_cost_graph.graph.nodes())
                 if n not in pruner.root_nodes
             ]
-            new_connections += minimized_cost_graph.to_pairwise_distances()
+            new_connections.append(minimized_cost_graph.to_edge_array())
         # generate a cost collection for the schools that are cost optimal with economies of scale
         minimums = output.get_technology_cost_collection(
             economies_of_scale_ids, tech_name
         )
-        return minimums, economies_of_scale_ids, new_connections
+        return minimums, economies_of_scale_ids, EdgeArray.concat(new_connections)
     
 
     def run(self, output: OutputSpace, scenario_id: str):
@@ -91,10 +91,10 @@ class EconomiesOfScaleMinimizer:
 
         # For now, only p2p and fiber are school to school, we might want to do a for loop at some point
         if "fiber" in self.economies_of_scale:
-            distances_fiber = PairwiseDistanceTable(distances=output.fiber_distances)
+            distances_fiber = EdgeArray.from_distances(output.fiber_distances)
             # group schools into clusters based on their root node (e.g. fiber nodes)
-            clusters = list(distances_fiber.group_by_source().values())
-            root_nodes = list(distances_fiber.group_by_source().keys())
+            clusters = list(distances_fiber.group_by_root().values())
+            root_nodes = list(distances_fiber.group_by_root().keys())
             tech_name = "fiber"
 
             # create a pruner to remove schools that exceed baseline costs or budget constraints
@@ -120,10 +120,10 @@ class EconomiesOfScaleMinimizer:
                 output.fiber_costs.technology_results.distances = new_connections
 
             if "p2p" in self.economies_of_scale:
-                distances_p2p = PairwiseDistanceTable(distances=output.p2p_distances)
+                distances_p2p = EdgeArray.from_distances(output.p2p_distances)
                 # group schools into clusters based on their root node (e.g. fiber nodes)
-                clusters = list(distances_p2p.group_by_source().values())
-                root_nodes = list(distances_p2p.group_by_source().keys())
+                clusters = list(distances_p2p.group_by_root().values())
+                root_nodes = list(distances_p2p.group_by_root().keys())
                 tech_name = "p2p"
 
                 # create a pruner to remove schools that exceed baseline costs or budget constraints
@@ -155,10 +155,10 @@ class EconomiesOfScaleMinimizer:
 
         else:#only p2p or nothing
             tech_name = "p2p"
-            distances_p2p = PairwiseDistanceTable(distances=output.p2p_distances)
+            distances_p2p = EdgeArray.from_distances(output.p2p_distances)
             # group schools into clusters based on their root node (e.g. fiber nodes)
-            clusters = list(distances_p2p.group_by_source().values())
-            root_nodes = list(distances_p2p.group_by_source().keys())
+            clusters = list(distances_p2p.group_by_root().values())
+            root_nodes = list(distances_p2p.group_by_root().keys())
             tech_name = "p2p"
 
             # create a pruner to remove schools that exceed baseline costs or budget constraints
@@ -223,16 +223,16 @@ class EconomiesOfScaleMinimizer:
 
         # For now, only p2p and fiber are school to school, we might want to do a for loop at some point
         if "fiber" in self.economies_of_scale:
-            distances_fiber = PairwiseDistanceTable(distances=output.fiber_distances)
+            distances_fiber = EdgeArray.from_distances(output.fiber_distances)
             # group schools into clusters based on their root node (e.g. fiber nodes)
-            clusters = list(distances_fiber.group_by_source().values())
-            root_nodes = list(distances_fiber.group_by_source().keys())
+            clusters = list(distances_fiber.group_by_root().values())
+            root_nodes = list(distances_fiber.group_by_root().keys())
             tech_name = "fiber"
         else:
-            distances_p2p = PairwiseDistanceTable(distances=output.p2p_distances)
+            distances_p2p = EdgeArray.from_distances(output.p2p_distances)
             # group schools into clusters based on their root node (e.g. fiber nodes)
-            clusters = list(distances_p2p.group_by_source().values())
-            root_nodes = list(distances_p2p.group_by_source().keys())
+            clusters = list(distances_p2p.group_by_root().values())
+            root_nodes = list(distances_p2p.group_by_root().keys())
             tech_name = "p2p"
 
         # create a pruner to remove schools that exceed baseline costs or budget constraints
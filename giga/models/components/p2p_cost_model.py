@@ -1,11 +1,11 @@
-from typing import List
+from typing import List, Union
 import math
 from pydantic import validate_arguments
 
 from giga.models.nodes.graph.greedy_distance_connector import GreedyDistanceConnector
 from giga.schemas.conf.models import P2PTechnologyCostConf
 from giga.schemas.output import CostResultSpace, SchoolConnectionCosts
-from giga.schemas.geo import PairwiseDistance, PairwiseDistanceTable
+from giga.schemas.geo import PairwiseDistance, PairwiseDistanceTable, EdgeArray
 from giga.data.space.model_data_space import ModelDataSpace
 from giga.models.components.electricity_cost_model import ElectricityCostModel
 from giga.utils.logging import LOGGER
@@ -37,8 +37,32 @@ class P2PCostModel:
             + self.config.opex.fixed_costs
         )
 
+    def _line_of_sight_options(self, data_space: ModelDataSpace):
+        """Line of sight options of the connection model, the P2P cache or a lazy line of sight model"""
+        conf = self.config.line_of_sight
+        if conf is None:
+            return dict(distance_cache=data_space.p2p_cache)
+        # the elevation models are only needed, and imported, when line of sight is evaluated on demand
+        from giga.models.nodes.elevation.line_of_sight_pair_cache import OnDemandLineOfSightModel
+
+        line_of_sight = OnDemandLineOfSightModel(
+            n_elevation_profile_samples=conf.n_elevation_profile_samples,
+            los_buffer_meters=conf.los_buffer_meters,
+            receiver_height_meters=conf.receiver_height_meters,
+            earth_curvature=conf.earth_curvature,
+            fresnel_frequency_ghz=conf.fresnel_frequency_ghz,
+            dem_directory=conf.dem_directory,
+            heights={t.tower_id: t.height for t in data_space.cell_tower_map.towers},
+        )
+        return dict(
+            line_of_sight=line_of_sight,
+            n_nearest_neighbors=conf.n_nearest_neighbors,
+            n_nearest_unconnected=conf.n_nearest_schools,
+            maximum_unconnected_distance_m=conf.maximum_school_distance,
+        )
+
     def compute_costs(
-        self, distances: List[PairwiseDistance], data_space: ModelDataSpace
+        self, distances: Union[EdgeArray, List[PairwiseDistance]], data_space: ModelDataSpace
     ) -> List[SchoolConnectionCosts]:
         """
         Computes the cost of connecting a school to the internet using P2P technology.
@@ -48,7 +72,7 @@ class P2PCostModel:
         """
         new_electricity = self.config.electricity_config.constraints.allow_new_electricity
         electricity_model = ElectricityCostModel(self.config)
-        connected_set = set([x.coordinate1.coordinate_id for x in distances])
+        connected_set = set(EdgeArray.from_distances(distances).target_ids)
         capex_provider = self._cost_of_setup_provider()
         capex_consumer = self._cost_of_setup_consumer()
         costs = []
@@ -98,7 +122,7 @@ class P2PCostModel:
             dynamic_connect=True,  # this will create closest distance pairs
             progress_bar=progress_bar,
             maximum_connection_length_m=self.config.constraints.maximum_range * METERS_IN_KM,
-            distance_cache=data_space.p2p_cache,
+            **self._line_of_sight_options(data_space),
         )
         new_electricity = self.config.electricity_config.constraints.allow_new_electricity
         # determine which schools can be connected and their distances
@@ -0,0 +1,240 @@
+import os
+import re
+import math
+from collections import OrderedDict
+from threading import Lock
+from typing import List, Tuple, Dict, Optional
+import numpy as np
+
+from giga.schemas.geo import LatLonPoint, ElevationProfile
+from giga.models.nodes.elevation.elevation_utilities import (
+    sample_profile_points,
+    profile_endpoints,
+    to_elevation_profiles,
+)
+from giga.utils.logging import LOGGER
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+try:
+    import rasterio
+except ImportError:
+    rasterio = None
+
+
+HGT_EXTENSION = ".hgt"
+GEOTIFF_EXTENSIONS = (".tif", ".tiff")
+# SRTM void value, also used by ASTER GDEM tiles without a GDAL_NODATA tag
+DEM_NODATA = -32768
+# maximum number of tiles kept open at once
+MAX_OPEN_TILES = 64
+# tiles are named after the lat/lon of their south west corner, e.g. N01E034.hgt or ASTGTMV003_N01E034_dem.tif
+TILE_NAME_PATTERN = re.compile(r"([NS])(\d{2})([EW])(\d{3})", re.IGNORECASE)
+
+
+def tile_key(lat: float, lon: float) -> Tuple[int, int]:
+    """Key of the one degree tile that contains a lat/lon point, the lat/lon of its south west corner"""
+    return math.floor(lat), math.floor(lon)
+
+
+def parse_tile_name(file_name: str) -> Optional[Tuple[int, int]]:
+    """Tile key encoded in the name of a tile file, None if the name does not encode one"""
+    match = TILE_NAME_PATTERN.search(os.path.basename(file_name))
+    if match is None:
+        return None
+    ns, lat, ew, lon = match.groups()
+    lat = int(lat) * (1 if ns.upper() == "N" else -1)
+    lon = int(lon) * (1 if ew.upper() == "E" else -1)
+    return lat, lon
+
+
+class DEMTile:
+    """
+    A raster of elevation values on a regular lat/lon grid.
+    Row 0 is the northern edge of the tile and column 0 its western edge, values are sampled at
+    lat0 - row * dlat, lon0 + column * dlon.
+    """
+
+    def __init__(
+        self,
+        data: np.ndarray,
+        lat0: float,
+        lon0: float,
+        dlat: float,
+        dlon: float,
+        nodata: float = DEM_NODATA,
+    ):
+        self.data = data
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self.dlat = dlat
+        self.dlon = dlon
+        self.nodata = nodata
+
+    @staticmethod
+    def from_hgt(path: str, key: Tuple[int, int]) -> "DEMTile":
+        """
+        Memory-maps an SRTM .hgt tile, a square grid of big endian 16 bit integers
+        that includes the edges of the tile (1201 samples for 3 arc-seconds, 3601 for 1 arc-second)
+        """
+        n = int(round(math.sqrt(os.path.getsize(path) // 2)))
+        assert n * n * 2 == os.path.getsize(path), f"{path} is not a square SRTM tile"
+        data = np.memmap(path, dtype=">i2", mode="r", shape=(n, n))
+        lat, lon = key
+        return DEMTile(data, lat + 1.0, float(lon), 1.0 / (n - 1), 1.0 / (n - 1))
+
+    @staticmethod
+    def from_geotiff(path: str) -> "DEMTile":
+        """
+        Reads a GeoTIFF tile georeferenced in lat/lon, e.g. SRTM or ASTER GDEM tiles.
+        Uncompressed tiles are memory-mapped with tifffile, other tiles are read into memory
+        with tifffile or rasterio, whichever is installed.
+        """
+        if tifffile is not None:
+            with tifffile.TiffFile(path) as tif:
+                page = tif.pages[0]
+                geo = tif.geotiff_metadata or {}
+                scale = geo.get("ModelPixelScale")
+                tiepoint = geo.get("ModelTiepoint")
+                assert scale is not None and tiepoint is not None, f"{path} is not georeferenced"
+                nodata = page.tags.get("GDAL_NODATA")
+                nodata = DEM_NODATA if nodata is None else float(str(nodata.value).strip("\x00 "))
+                # pixel values represent areas by default, their samples are at the centre of the pixels
+                offset = 0.0 if int(geo.get("GTRasterTypeGeoKey", 1)) == 2 else 0.5
+                i, j, _, x, y, _ = tiepoint[:6]
+                try:
+                    data = tifffile.memmap(path, mode="r")
+                except ValueError:
+                    data = page.asarray()
+            return DEMTile(
+                data,
+                y - (offset - j) * scale[1],
+                x + (offset - i) * scale[0],
+                scale[1],
+                scale[0],
+                nodata,
+            )
+        if rasterio is not None:
+            with rasterio.open(path) as src:
+                data = src.read(1)
+                t = src.transform
+                nodata = DEM_NODATA if src.nodata is None else src.nodata
+            return DEMTile(data, t.f + t.e / 2, t.c + t.a / 2, -t.e, t.a, nodata)
+        raise ImportError(
+            "GeoTIFF elevation tiles require tifffile or rasterio, install one with: pip install tifffile"
+        )
+
+    def sample(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """
+        Bilinear interpolation of the elevation at lat/lon points, NaN where a neighbouring sample is void.
+        Points outside of the tile are clamped to its edges.
+        """
+        n_rows, n_cols = self.data.shape
+        rows = np.clip((self.lat0 - lats) / self.dlat, 0, n_rows - 1)
+        cols = np.clip((lons - self.lon0) / self.dlon, 0, n_cols - 1)
+        r0 = np.minimum(np.floor(rows).astype(np.intp), n_rows - 2)
+        c0 = np.minimum(np.floor(cols).astype(np.intp), n_cols - 2)
+        fr, fc = rows - r0, cols - c0
+        # fetch the four neighbouring samples, only the touched pages of a memory-mapped tile are read
+        z00 = self.data[r0, c0].astype(np.float64)
+        z01 = self.data[r0, c0 + 1].astype(np.float64)
+        z10 = self.data[r0 + 1, c0].astype(np.float64)
+        z11 = self.data[r0 + 1, c0 + 1].astype(np.float64)
+        z = (z00 * (1 - fc) + z01 * fc) * (1 - fr) + (z10 * (1 - fc) + z11 * fc) * fr
+        void = (z00 == self.nodata) | (z01 == self.nodata) | (z10 == self.nodata) | (z11 == self.nodata)
+        z[void] = np.nan
+        return z
+
+
+class DEMTileEngine:
+    """
+    Samples elevations from a directory of digital elevation model tiles, one tile per degree of lat/lon,
+    as SRTM .hgt files or SRTM/ASTER GeoTIFFs. Tiles are opened lazily and kept open up to a limit,
+    points are grouped by tile and interpolated together so that thousands of profiles are sampled at once.
+    Points without a tile or on void samples have no elevation.
+    """
+
+    def __init__(self, directory: str, max_open_tiles: int = MAX_OPEN_TILES):
+        self.directory = directory
+        self.max_open_tiles = max_open_tiles
+        self._files: Dict[Tuple[int, int], str] = self._index(directory)
+        self._tiles: "OrderedDict[Tuple[int, int], DEMTile]" = OrderedDict()
+        self._missing = set()
+        self._lock = Lock()
+        LOGGER.info(f"Found {len(self._files)} elevation tiles in {directory}")
+
+    @staticmethod
+    def _index(directory: str) -> Dict[Tuple[int, int], str]:
+        files = {}
+        for root, _, names in os.walk(directory):
+            for name in sorted(names):
+                key = parse_tile_name(name)
+                if key is None or not name.lower().endswith((HGT_EXTENSION,) + GEOTIFF_EXTENSIONS):
+                    continue
+                # .hgt tiles are preferred when a tile is available in both formats
+                if key not in files or name.lower().endswith(HGT_EXTENSION):
+                    files[key] = os.path.join(root, name)
+        return files
+
+    def tile(self, key: Tuple[int, int]) -> Optional[DEMTile]:
+        """Opens the tile with a key, the least recently used tile is closed when too many are open"""
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+            if key not in self._files:
+                if key not in self._missing:
+                    self._missing.add(key)
+                    LOGGER.warning(f"No elevation tile for lat {key[0]} lon {key[1]} in {self.directory}")
+                return None
+            path = self._files[key]
+            if path.lower().endswith(HGT_EXTENSION):
+                tile = DEMTile.from_hgt(path, key)
+            else:
+                tile = DEMTile.from_geotiff(path)
+            self._tiles[key] = tile
+            if len(self._tiles) > self.max_open_tiles:
+                self._tiles.popitem(last=False)
+            return tile
+
+    def elevations(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """Elevations in meters at arrays of lat/lon points, NaN where no elevation is available"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        shape = lats.shape
+        lats, lons = lats.ravel(), lons.ravel()
+        result = np.full(len(lats), np.nan)
+        keys = np.stack([np.floor(lats), np.floor(lons)], axis=1).astype(np.int64)
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        for k, (lat, lon) in enumerate(unique.tolist()):
+            tile = self.tile((lat, lon))
+            if tile is None:
+                continue
+            rows = np.flatnonzero(inverse == k)
+            result[rows] = tile.sample(lats[rows], lons[rows])
+        return result.reshape(shape)
+
+    def profiles(
+        self, starts: np.ndarray, ends: np.ndarray, samples: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Samples elevation profiles between pairs of points, evenly spaced in lat/lon including both endpoints
+        :param starts, ends, (n, 2) arrays of the lat/lon of the endpoints of the profiles
+        :param samples, the number of samples of each profile
+        :return (n, samples) arrays of the lat, lon and elevation of the samples
+        """
+        lats, lons = sample_profile_points(starts, ends, samples)
+        return lats, lons, self.elevations(lats, lons)
+
+    def elevation_profiles(self, data: List[List[LatLonPoint]], samples: int) -> List[ElevationProfile]:
+        """
+        Samples the elevation profiles of pairs of lat/lon points, in the shape of the profiles of the elevation API
+        :param data, pairs of lat/lon points, empty pairs result in empty profiles
+        """
+        rows, starts, ends = profile_endpoints(data)
+        lats, lons, elevations = self.profiles(starts, ends, samples)
+        return to_elevation_profiles(len(data), rows, lats, lons, elevations)
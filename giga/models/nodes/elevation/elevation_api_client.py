@@ -0,0 +1,214 @@
+import os
+import time
+import asyncio
+import threading
+from typing import List, Text
+import numpy as np
+import aiohttp
+
+from giga.models.nodes.elevation.elevation_utilities import (
+    sample_profile_points,
+    profile_endpoints,
+    to_elevation_profiles,
+)
+from giga.schemas.geo import LatLonPoint, ElevationProfile
+from giga.utils.logging import LOGGER
+
+# Constants
+ELEVATION_API_URL = os.environ.get("ELEVATION_API_URL", "https://api.opentopodata.org/v1")
+DEFAULT_DATASET = "aster30m"
+# the API accepts up to 100 locations per request
+MAX_LOCATIONS_PER_REQUEST = 100
+# the public API allows one request per second
+DEFAULT_REQUESTS_PER_SECOND = float(os.environ.get("ELEVATION_API_REQUESTS_PER_SECOND", 1.0))
+DEFAULT_BURST = 1
+DEFAULT_CONCURRENCY = int(os.environ.get("ELEVATION_API_CONCURRENCY", 4))
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 1.0
+DEFAULT_TIMEOUT_SECONDS = 60
+# status codes that are worth retrying, e.g. rate limiting and server errors
+RETRY_STATUS_CODES = frozenset([408, 429, 500, 502, 503, 504])
+
+
+class ElevationServiceError(RuntimeError):
+    """The elevation API could not answer a request, e.g. during an outage"""
+
+
+class TokenBucket:
+    """
+    Paces requests to a sustained rate, allowing short bursts up to the capacity of the bucket.
+    Each request takes a token, tokens refill continuously at the configured rate.
+    """
+
+    def __init__(self, rate: float, capacity: int = DEFAULT_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        # the lock hands out tokens in order of arrival
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class ElevationAPIClient:
+    """
+    Asynchronous client for the opentopodata elevation API.
+    Locations are deduplicated and sent in batches of up to 100 per request, requests share one pooled
+    session, are paced by a token bucket to stay under the rate limit of the API and run with a configurable
+    concurrency. Failed requests are retried with exponential backoff.
+    The client runs its own event loop in a background thread, so it can be used from synchronous code
+    and notebooks, and the session and rate limit are shared by all the queries of the client.
+    """
+
+    def __init__(self, **kwargs):
+        self.url = kwargs.get("url", ELEVATION_API_URL).rstrip("/")
+        self.max_locations = kwargs.get("max_locations", MAX_LOCATIONS_PER_REQUEST)
+        self.requests_per_second = kwargs.get("requests_per_second", DEFAULT_REQUESTS_PER_SECOND)
+        self.burst = kwargs.get("burst", DEFAULT_BURST)
+        self.concurrency = kwargs.get("concurrency", DEFAULT_CONCURRENCY)
+        self.retries = kwargs.get("retries", DEFAULT_RETRIES)
+        self.backoff = kwargs.get("backoff", DEFAULT_BACKOFF)
+        self.timeout = kwargs.get("timeout", DEFAULT_TIMEOUT_SECONDS)
+        self._loop: asyncio.AbstractEventLoop = None
+        self._thread: threading.Thread = None
+        self._session: aiohttp.ClientSession = None
+        self._bucket: TokenBucket = None
+        self._semaphore: asyncio.Semaphore = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+                self._thread.start()
+
+    def _run(self, coroutine):
+        self._start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _open(self):
+        # the session and its pacing primitives belong to the event loop of the client
+        if self._session is None:
+            self._bucket = TokenBucket(self.requests_per_second, self.burst)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def _post(self, locations: np.ndarray, dataset: Text) -> List:
+        session = await self._open()
+        data = {"locations": "|".join(f"{lat},{lon}" for lat, lon in locations.tolist())}
+        url = f"{self.url}/{dataset}"
+        for attempt in range(self.retries + 1):
+            async with self._semaphore:
+                await self._bucket.acquire()
+                try:
+                    async with session.post(url, data=data) as response:
+                        if response.status not in RETRY_STATUS_CODES:
+                            result = await response.json(content_type=None)
+                            if "results" not in result:
+                                raise ElevationServiceError(f"Unexpected OpenTopoData API response: {result}")
+                            return result["results"]
+                        error = f"status {response.status}"
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = repr(e)
+            if attempt == self.retries:
+                raise ElevationServiceError(
+                    f"OpenTopoData API request failed after {self.retries} retries: {error}"
+                )
+            LOGGER.warning(f"Retrying OpenTopoData API request after {error}")
+            await asyncio.sleep(self.backoff * 2**attempt)
+
+    async def query_async(self, locations: np.ndarray, dataset: Text = DEFAULT_DATASET) -> np.ndarray:
+        """
+        Queries the elevation of lat/lon locations, duplicate locations are only queried once
+        :param locations, an (n, 2) array of lat/lon locations
+        :return an array of n elevations in meters, NaN where the dataset has no elevation
+        """
+        locations = np.asarray(locations, dtype=np.float64).reshape(-1, 2)
+        if len(locations) == 0:
+            return np.empty(0)
+        unique, inverse = np.unique(locations, axis=0, return_inverse=True)
+        batches = [
+            unique[i : i + self.max_locations] for i in range(0, len(unique), self.max_locations)
+        ]
+        results = await asyncio.gather(*[self._post(b, dataset) for b in batches])
+        elevations = np.array(
+            [np.nan if x["elevation"] is None else x["elevation"] for r in results for x in r],
+            dtype=np.float64,
+        )
+        return elevations[inverse.ravel()]
+
+    def elevations(self, locations: np.ndarray, dataset: Text = DEFAULT_DATASET) -> np.ndarray:
+        """Synchronous version of query_async"""
+        return self._run(self.query_async(locations, dataset))
+
+    def profiles(self, starts: np.ndarray, ends: np.ndarray, samples: int, dataset: Text = DEFAULT_DATASET):
+        """
+        Samples elevation profiles between pairs of points, evenly spaced in lat/lon including both endpoints
+        :param starts, ends, (n, 2) arrays of the lat/lon of the endpoints of the profiles
+        :param samples, the number of samples of each profile
+        :return (n, samples) arrays of the lat, lon and elevation of the samples
+        """
+        lats, lons = sample_profile_points(starts, ends, samples)
+        elevations = self.elevations(np.stack([lats.ravel(), lons.ravel()], axis=1), dataset)
+        return lats, lons, elevations.reshape(lats.shape)
+
+    def elevation_profiles(
+        self, data: List[List[LatLonPoint]], samples: int, dataset: Text = DEFAULT_DATASET
+    ) -> List[ElevationProfile]:
+        """
+        Queries the elevation profiles of pairs of lat/lon points
+        :param data, pairs of lat/lon points, empty pairs result in empty profiles
+        """
+        rows, starts, ends = profile_endpoints(data)
+        lats, lons, elevations = self.profiles(starts, ends, samples, dataset)
+        return to_elevation_profiles(len(data), rows, lats, lons, elevations)
+
+    async def _close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def close(self):
+        """Closes the session and stops the event loop of the client"""
+        if self._loop is None:
+            return
+        self._run(self._close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop, self._thread = None, None
+
+
+_SHARED_CLIENT: ElevationAPIClient = None
+_SHARED_CLIENT_LOCK = threading.Lock()
+
+
+def shared_client() -> ElevationAPIClient:
+    """
+    Default client of the process, shared by the elevation models so that their requests
+    go through the same session and rate limit
+    """
+    global _SHARED_CLIENT
+    with _SHARED_CLIENT_LOCK:
+        if _SHARED_CLIENT is None:
+            _SHARED_CLIENT = ElevationAPIClient()
+        return _SHARED_CLIENT
@@ -0,0 +1,213 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Text, Tuple
+import numpy as np
+
+from giga.utils.logging import LOGGER
+
+# Constants
+# persistent cache shared by all workspaces, an empty value disables it
+ELEVATION_CACHE_FILE = os.environ.get(
+    "ELEVATION_CACHE_FILE",
+    os.path.join(os.path.expanduser("~"), ".cache", "giga", "elevation_points.sqlite"),
+)
+# points are snapped to a grid of 1 arc-second, the resolution of the 30m elevation datasets
+QUANTUM_ARC_SECONDS = 1
+# number of elevations kept in memory in front of the database
+MAX_MEMORY_ENTRIES = 1_000_000
+# maximum number of parameters of a single sqlite query
+SQLITE_MAX_PARAMETERS = 900
+SQLITE_TIMEOUT_SECONDS = 60
+
+
+def connect_cache_database(path: str, schema: Text) -> Optional[sqlite3.Connection]:
+    """
+    Opens the sqlite database of a persistent cache, creating its directory and table if needed
+    :param schema, the statement that creates the table of the cache
+    :return the connection, or None when the database cannot be opened, e.g. in a read-only home directory,
+    in which case the cache is disabled
+    """
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(path, timeout=SQLITE_TIMEOUT_SECONDS, check_same_thread=False)
+        # write ahead logging lets several builder processes read while one writes
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(schema)
+        connection.commit()
+        return connection
+    except (OSError, sqlite3.OperationalError) as e:
+        LOGGER.warning(f"Could not open the cache database {path}, the cache is disabled: {e}")
+        return None
+
+
+class ElevationPointCache:
+    """
+    Persistent cache of point elevations, shared between pairs, runs and countries.
+    Points are quantised to a grid (1 arc-second, about 30m, by default) and each grid node is stored once
+    per dataset in a sqlite database, with a least recently used in-memory front.
+    Elevations of uncached nodes are fetched from the source at the node itself, so that a node
+    always has the same elevation whichever point first requested it.
+    Missing elevations are cached too, as NaN.
+    The database is opened on the first lookup, when it cannot be opened or written to
+    elevations are only cached in memory.
+    """
+
+    def __init__(
+        self,
+        path: str = ELEVATION_CACHE_FILE,
+        quantum_arc_seconds: float = QUANTUM_ARC_SECONDS,
+        max_memory_entries: int = MAX_MEMORY_ENTRIES,
+    ):
+        self.path = path
+        self.scale = 3600.0 / quantum_arc_seconds
+        self.max_memory_entries = max_memory_entries
+        self._memory: "OrderedDict[Tuple[str, int], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._opened = False
+
+    def _database(self) -> Optional[sqlite3.Connection]:
+        """The database connection, opened on first use, None when the database is disabled"""
+        if not self._opened:
+            self._opened = True
+            self._connection = connect_cache_database(
+                self.path,
+                "CREATE TABLE IF NOT EXISTS elevations "
+                "(dataset TEXT, quantum REAL, key INTEGER, elevation REAL, PRIMARY KEY (dataset, quantum, key)) WITHOUT ROWID",
+            )
+            if self._connection is not None:
+                LOGGER.info(f"Caching point elevations in {self.path}")
+        return self._connection
+
+    def _disable(self, error: Exception):
+        LOGGER.warning(f"Could not write to the cache database {self.path}, the cache is disabled: {error}")
+        self._connection.close()
+        self._connection = None
+
+    def quantise(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Snaps lat/lon points to the grid of the cache
+        :param points, an (n, 2) array of lat/lon points
+        :return the keys of the grid nodes and an (n, 2) array of their lat/lon
+        """
+        indices = np.rint(np.asarray(points, dtype=np.float64).reshape(-1, 2) * self.scale).astype(np.int64)
+        # offset the indices so that they are positive and combine them into one key
+        lat = indices[:, 0] + int(90 * self.scale)
+        lon = indices[:, 1] + int(180 * self.scale)
+        return lat * (int(360 * self.scale) + 1) + lon, indices / self.scale
+
+    def _quantum(self) -> float:
+        return 3600.0 / self.scale
+
+    def _select(self, dataset: Text, keys: np.ndarray) -> dict:
+        found = {}
+        if self._database() is None:
+            return found
+        quantum = self._quantum()
+        keys = keys.tolist()
+        for i in range(0, len(keys), SQLITE_MAX_PARAMETERS):
+            chunk = keys[i : i + SQLITE_MAX_PARAMETERS]
+            rows = self._connection.execute(
+                f"SELECT key, elevation FROM elevations WHERE dataset = ? AND quantum = ? "
+                f"AND key IN ({','.join('?' * len(chunk))})",
+                [dataset, quantum] + chunk,
+            ).fetchall()
+            found.update((k, np.nan if e is None else e) for k, e in rows)
+        return found
+
+    def _insert(self, dataset: Text, keys: np.ndarray, elevations: np.ndarray):
+        if self._database() is None:
+            return
+        quantum = self._quantum()
+        try:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO elevations (dataset, quantum, key, elevation) VALUES (?, ?, ?, ?)",
+                [
+                    (dataset, quantum, k, None if np.isnan(e) else e)
+                    for k, e in zip(keys.tolist(), elevations.tolist())
+                ],
+            )
+            self._connection.commit()
+        except sqlite3.OperationalError as e:
+            self._disable(e)
+
+    def _remember(self, dataset: Text, keys, elevations):
+        for k, e in zip(keys, elevations):
+            self._memory[(dataset, k)] = e
+            self._memory.move_to_end((dataset, k))
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def elevations(
+        self, points: np.ndarray, dataset: Text, fetch: Callable[[np.ndarray], np.ndarray]
+    ) -> np.ndarray:
+        """
+        Elevations of lat/lon points, from memory, then from the database, then from the source
+        :param points, an (n, 2) array of lat/lon points
+        :param dataset, the name of the elevation source, elevations of different sources are cached separately
+        :param fetch, queries the source for the elevations of an (m, 2) array of lat/lon points
+        :return an array of n elevations in meters, NaN where the source has no elevation
+        """
+        keys, nodes = self.quantise(points)
+        if len(keys) == 0:
+            return np.empty(0)
+        unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        values = np.full(len(unique), np.nan)
+        with self._lock:
+            missing = []
+            for i, k in enumerate(unique.tolist()):
+                e = self._memory.get((dataset, k))
+                if e is None:
+                    missing.append(i)
+                else:
+                    self._memory.move_to_end((dataset, k))
+                    values[i] = e
+            missing = np.array(missing, dtype=np.intp)
+            if len(missing) > 0:
+                stored = self._select(dataset, unique[missing])
+                hits = [i for i in missing.tolist() if unique[i] in stored]
+                values[hits] = [stored[unique[i]] for i in hits]
+                self._remember(dataset, unique[hits].tolist(), values[hits].tolist())
+                missing = np.array([i for i in missing.tolist() if unique[i] not in stored], dtype=np.intp)
+        if len(missing) > 0:
+            # the source is queried outside of the lock, it can be slow
+            fetched = np.asarray(fetch(nodes[first[missing]]), dtype=np.float64)
+            values[missing] = fetched
+            with self._lock:
+                self._insert(dataset, unique[missing], fetched)
+                self._remember(dataset, unique[missing].tolist(), fetched.tolist())
+        return values[inverse.ravel()]
+
+    def __len__(self):
+        with self._lock:
+            if self._database() is None:
+                return 0
+            return self._connection.execute("SELECT COUNT(*) FROM elevations").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+_SHARED_CACHES = {}
+_SHARED_CACHES_LOCK = threading.Lock()
+
+
+def shared_elevation_cache(path: str = ELEVATION_CACHE_FILE) -> ElevationPointCache:
+    """
+    Elevation cache of the process for a database file, shared by the elevation models.
+    Returns None when the path is empty, which disables caching.
+    The database is only opened when elevations are first looked up.
+    """
+    if not path:
+        return None
+    with _SHARED_CACHES_LOCK:
+        if path not in _SHARED_CACHES:
+            _SHARED_CACHES[path] = ElevationPointCache(path)
+        return _SHARED_CACHES[path]
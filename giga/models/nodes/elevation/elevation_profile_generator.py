@@ -1,31 +1,70 @@
 from pydantic import validate_arguments
 from typing import List, Text
 
-import requests
-import time
-from requests.adapters import HTTPAdapter, Retry
+import os
+import numpy as np
 
 from giga.models.nodes.elevation.elevation_utilities import (
     format_opendata_request_multipoint_request,
+    sample_profile_points,
+    profile_endpoints,
+    to_elevation_profiles,
 )
-from giga.schemas.geo import LatLonPoint, RawElevationPoint, ElevationProfile
+from giga.models.nodes.elevation.dem_tile_engine import DEMTileEngine
+from giga.models.nodes.elevation.elevation_api_client import (
+    ElevationAPIClient,
+    shared_client,
+)
+from giga.models.nodes.elevation.elevation_point_cache import (
+    ElevationPointCache,
+    shared_elevation_cache,
+    ELEVATION_CACHE_FILE,
+)
+from giga.schemas.geo import LatLonPoint, ElevationProfile
 
 # Constants
 NUMBER_OF_SAMPLES = 10
 DEFAULT_DATASET = "aster30m"
-DEFAULT_RETRIES = 5
-DEFAULT_BACKOFF = 1.0
-
-# retry on all status codes that are 300+
-DEFAULT_FORCELIST = [x for x in requests.status_codes._codes if x >= 300]
+# directory of local elevation tiles, profiles are sampled from the tiles instead of the
+# API when configured
+ELEVATION_DEM_DIRECTORY = os.environ.get("ELEVATION_DEM_DIRECTORY", "")
 
 
 class ElevationProfileGenerator:
     """
-    Generates an elevation profile for lat/lon points using
-    open source data sets.
+    Generates an elevation profile for lat/lon points using open source data sets.
+    Profiles are sampled from local elevation tiles when a tile directory is configured,
+    either with the dem_directory argument or the ELEVATION_DEM_DIRECTORY environment
+    variable, and are otherwise queried from the opentopodata API with a batched, rate
+    limited client. Point elevations go through the persistent elevation point cache
+    before any tile or API lookup, the elevation_cache_file argument selects its
+    database and an empty value disables it. Other keyword arguments configure the
+    client, e.g. url, concurrency or requests_per_second.
     """
 
+    def __init__(self, **kwargs):
+        dem_directory = kwargs.pop("dem_directory", None) or ELEVATION_DEM_DIRECTORY
+        self.dem: DEMTileEngine = (
+            DEMTileEngine(dem_directory) if dem_directory else None
+        )
+        self.elevation_cache: ElevationPointCache = shared_elevation_cache(
+            kwargs.pop("elevation_cache_file", ELEVATION_CACHE_FILE)
+        )
+        self._client_kwargs = kwargs
+        self._client: ElevationAPIClient = None
+
+    @property
+    def client(self) -> ElevationAPIClient:
+        # the client and its session are shared by all the queries of the generator,
+        # and by all the generators of the process unless the client is configured
+        if self._client is None:
+            self._client = (
+                ElevationAPIClient(**self._client_kwargs)
+                if self._client_kwargs
+                else shared_client()
+            )
+        return self._client
+
     def format_data(self, data: List) -> Text:
         transformer = lambda x: format_opendata_request_multipoint_request(x)
         data_transformed = transformer(data)
@@ -33,51 +72,64 @@ class ElevationProfileGenerator:
 
     def query_elevation_dataset(self, data: List, dataset: Text, samples: int) -> List:
         """
-        Queries the opentopodata API to create an elevation profile
-        A profile is a collection of ordered 3D points including lat/lon and elevation values
+        Queries the opentopodata API to create an elevation profile.
+        A profile is a collection of ordered 3D points including lat/lon and elevation
+        values. The sample points of all the profiles are queried together, in batches
+        of up to 100 locations per request.
 
         :param data, list of lat/lon points between which elevation profiles are created
         :param dataset, the type of elevation dataset to query, generally aster30m
-        :param samples, the number of elevation samples to include in the profile in addition to the two root points
+        :param samples, the number of elevation samples in the profile, including the
+          two root points
         :returns List of elevation profiles (e.g. a list of lists of 3D points)
         """
-        elevation_profile_list = list()
-        for points in data:
-            if points == []:
-                elevation_profile_list.append([])
-            else:
-                # Format data for request
-                values = self.format_data(points)
-                # create payload for POST request using formatted values
-                params = {"locations": f"{values}", "samples": f"{samples}"}
-                url = f"https://api.opentopodata.org/v1/{dataset}?"
-                session = requests.Session()
-                retries = Retry(
-                    total=DEFAULT_RETRIES,
-                    backoff_factor=DEFAULT_BACKOFF,
-                    status_forcelist=frozenset(DEFAULT_FORCELIST),
-                    raise_on_redirect=True,
-                    raise_on_status=True,
-                )
-                session.mount("https://", HTTPAdapter(max_retries=retries))
-                session.mount("http://", HTTPAdapter(max_retries=retries))
-                response = session.post(url, params)
-                if "results" not in response.json():
-                    raise RuntimeError(
-                        f"Unexpected OpenTopoData API response: {response.json()}"
-                    )
-                result = response.json()["results"]
-                result_transformed = RawElevationPoint.elevation_point_transformer(
-                    result
-                )
-                ele_profile = ElevationProfile.from_raw_elevation_profile(
-                    result_transformed
-                )
-                elevation_profile_list.append(ele_profile)
-                # TODO: This is added to avoid rate-limiting failures (1/sec).
-                #       We should batch the requests better (it supports <=100 locations/req).
-                time.sleep(1.3)
-        return elevation_profile_list
+        return self.client.elevation_profiles(data, samples, dataset)
+
+    def source(self, dataset: Text = DEFAULT_DATASET) -> Text:
+        """
+        Name of the source elevations are sampled from, elevations of different sources
+        are cached separately
+        """
+        if self.dem is not None:
+            return f"dem:{os.path.abspath(self.dem.directory)}"
+        return f"{self.client.url}/{dataset}"
+
+    def elevations(
+        self, points: np.ndarray, dataset: Text = DEFAULT_DATASET
+    ) -> np.ndarray:
+        """
+        Elevations of an (n, 2) array of lat/lon points, from the elevation point cache
+        when possible
+        :return an array of n elevations in meters, NaN where no elevation is available
+        """
+        if self.dem is not None:
+            fetch = lambda p: self.dem.elevations(p[:, 0], p[:, 1])
+        else:
+            fetch = lambda p: self.client.elevations(p, dataset)
+        if self.elevation_cache is None:
+            return fetch(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+        return self.elevation_cache.elevations(points, self.source(dataset), fetch)
+
+    def profiles(
+        self,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        samples: int,
+        dataset: Text = DEFAULT_DATASET,
+    ):
+        """
+        Samples elevation profiles between pairs of points, evenly spaced in lat/lon
+        including both endpoints
+        :param starts, ends, (n, 2) arrays of the lat/lon of the endpoints of the
+          profiles
+        :param samples, the number of samples of each profile
+        :return (n, samples) arrays of the lat, lon and elevation of the samples
+        """
+        lats, lons = sample_profile_points(starts, ends, samples)
+        elevations = self.elevations(
+            np.stack([lats.ravel(), lons.ravel()], axis=1), dataset
+        )
+        return lats, lons, elevations.reshape(lats.shape)
 
     @validate_arguments
     def run(
@@ -90,9 +142,10 @@ class ElevationProfileGenerator:
         Runs the elevation profile generator model.
         :param data, ordered list of lists of lat/lon coordinates e.g: [[1,2], [3,4]]
         :param dataset, the type of elevation dataset to query, defaults to aster30m
-        :param samples, the number of elevation samples to include in the profile in addition to the two root points
-               defaults to 10
+        :param samples, the number of elevation samples in the profile, including the
+          two root points, defaults to 10
         :return a list of elevation profiles (e.g. a list of lists of 3D points)
         """
-        results = self.query_elevation_dataset(data, dataset, samples)
-        return results
+        rows, starts, ends = profile_endpoints(data)
+        lats, lons, elevations = self.profiles(starts, ends, samples, dataset)
+        return to_elevation_profiles(len(data), rows, lats, lons, elevations)
@@ -1,6 +1,8 @@
-from typing import List, Text
+import math
+from typing import List, Text, Tuple
+import numpy as np
 
-from giga.schemas.geo import LatLonPoint
+from giga.schemas.geo import LatLonPoint, ElevationPoint, ElevationProfile
 
 
 def format_opendata_request_singular_request(array: List[LatLonPoint]) -> Text:
@@ -49,3 +51,56 @@ def format_opendata_request_multipoint_request(array: List[LatLonPoint]) -> Text
     )
 
     return data
+
+
+def sample_profile_points(
+    starts: np.ndarray, ends: np.ndarray, samples: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Samples points between pairs of lat/lon points, evenly spaced in lat/lon and including both endpoints
+
+      Input: starts, ends: (n, 2) arrays of the lat/lon of the endpoints
+             samples: the number of points of each profile
+      Output: (n, samples) arrays of the lat and lon of the points
+    """
+    starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+    t = np.linspace(0.0, 1.0, max(samples, 2))
+    lats = starts[:, 0:1] + (ends[:, 0:1] - starts[:, 0:1]) * t
+    lons = starts[:, 1:2] + (ends[:, 1:2] - starts[:, 1:2]) * t
+    return lats, lons
+
+
+def profile_endpoints(data: List[List[LatLonPoint]]) -> Tuple[List[int], np.ndarray, np.ndarray]:
+    """
+    Splits pairs of lat/lon points into arrays of start and end points
+
+      Input: data: pairs of lat/lon points, empty pairs are skipped
+      Output: the indices of the non empty pairs and (n, 2) arrays of their start and end points
+    """
+    rows = [i for i, points in enumerate(data) if len(points) > 0]
+    starts = np.array([data[i][0] for i in rows], dtype=np.float64).reshape(-1, 2)
+    ends = np.array([data[i][-1] for i in rows], dtype=np.float64).reshape(-1, 2)
+    return rows, starts, ends
+
+
+def to_elevation_profiles(
+    n_profiles: int, rows: List[int], lats: np.ndarray, lons: np.ndarray, elevations: np.ndarray
+) -> List[ElevationProfile]:
+    """
+    Creates elevation profiles from arrays of sampled points, NaN elevations are missing
+
+      Input: n_profiles: the number of profiles, the profiles that are not in rows are empty
+             rows: the index of the profile of each row of the arrays
+             lats, lons, elevations: (len(rows), samples) arrays of the sampled points
+      Output: List of elevation profiles
+    """
+    results = [[] for _ in range(n_profiles)]
+    for row, la, lo, el in zip(rows, lats.tolist(), lons.tolist(), elevations.tolist()):
+        results[row] = ElevationProfile(
+            points=[
+                ElevationPoint(coordinates=(a, b), elevation=None if math.isnan(e) else e)
+                for a, b, e in zip(la, lo, el)
+            ]
+        )
+    return results
@@ -1,10 +1,33 @@
 from pydantic import validate_arguments
-from typing import List, Text
-from haversine import haversine, Unit
+from typing import List, Text, Union
+import numpy as np
+from haversine import haversine, haversine_vector, Unit
 from shapely.geometry import Point, LineString
 from giga.schemas.geo import LatLonPoint, ElevationProfile
 
 DEFAULT_BUFFER = 0.0
+# mean earth radius used by the haversine distances
+EARTH_RADIUS_METERS = 6371008.8
+# effective earth radius factor of standard atmospheric refraction
+DEFAULT_K_FACTOR = 4.0 / 3.0
+SPEED_OF_LIGHT_METERS_PER_SECOND = 299792458.0
+# fraction of the first Fresnel zone that has to be clear of the terrain
+DEFAULT_FRESNEL_CLEARANCE = 0.6
+
+
+def profile_distances(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """
+    Haversine distances in meters of the samples of profiles from the start of their profile
+    :param lats, lons, (n, samples) arrays of the lat/lon of the samples of n profiles
+    :return an (n, samples) array of distances
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if lats.size == 0:
+        return np.zeros(lats.shape)
+    points = np.stack([lats.ravel(), lons.ravel()], axis=1)
+    starts = np.repeat(points[:: lats.shape[1]], lats.shape[1], axis=0)
+    return haversine_vector(starts, points, Unit.METERS).reshape(lats.shape)
 
 
 class LineofSightModel:
@@ -89,6 +112,72 @@ class LineofSightModel:
         else:
             return False
 
+    def obstructions(
+        self,
+        lats: np.ndarray,
+        lons: np.ndarray,
+        elevations: np.ndarray,
+        start_heights: Union[float, np.ndarray] = 0.0,
+        end_heights: Union[float, np.ndarray] = 0.0,
+        elevation_buffer_meters: float = DEFAULT_BUFFER,
+        earth_curvature: bool = False,
+        k_factor: float = DEFAULT_K_FACTOR,
+        fresnel_frequency_ghz: float = None,
+        fresnel_clearance: float = DEFAULT_FRESNEL_CLEARANCE,
+    ) -> np.ndarray:
+        """
+        Batch version of determine_obstructions, evaluates thousands of profiles at once.
+        As in determine_obstructions, the line of sight is obstructed when the terrain line through
+        the intermediate samples crosses or touches the line between the start and end points,
+        missing elevations count as 0.
+        :param lats, lons, elevations, (n, samples) arrays of the lat/lon and elevation of the samples of n profiles
+        :param start_heights, end_heights, heights in meters added to the start and end points, scalars or arrays of n values
+        :param elevation_buffer_meters, the desired buffer value added to the intermediate samples
+        :param earth_curvature, raises the intermediate samples by the bulge of the earth
+        :param k_factor, the effective earth radius factor of the bulge, 4/3 for standard refraction
+        :param fresnel_frequency_ghz, the frequency of the link, raises the intermediate samples by the
+               required clearance of the first Fresnel zone when given
+        :param fresnel_clearance, the fraction of the first Fresnel zone that has to be clear
+        :return an array of n booleans, the result of determine_obstructions for each profile, True where
+                the terrain line crosses or touches the line between the end points. As with run,
+                the cache builders keep the links for which it is True
+        """
+        elevations = np.nan_to_num(np.array(elevations, dtype=np.float64), nan=0.0)
+        if elevations.ndim != 2 or elevations.shape[1] < 3:
+            # profiles without intermediate samples have no terrain in between
+            return np.zeros(len(elevations), dtype=bool)
+        distances = profile_distances(lats, lons)
+        z0 = elevations[:, 0] + start_heights
+        z1 = elevations[:, -1] + end_heights
+        x = distances[:, 1:-1]
+        z = elevations[:, 1:-1] + elevation_buffer_meters
+        length = distances[:, -1:]
+        if earth_curvature or fresnel_frequency_ghz:
+            # products of the distances to both ends, shared by the curvature and Fresnel terms
+            d1d2 = x * np.maximum(length - x, 0.0)
+            if earth_curvature:
+                z += d1d2 / (2 * k_factor * EARTH_RADIUS_METERS)
+            if fresnel_frequency_ghz:
+                wavelength = SPEED_OF_LIGHT_METERS_PER_SECOND / (fresnel_frequency_ghz * 1e9)
+                z += fresnel_clearance * np.sqrt(
+                    wavelength * d1d2 / np.where(length > 0, length, 1.0)
+                )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            line = z0[:, None] + (z1 - z0)[:, None] * np.where(length > 0, x / length, 0.0)
+        # height of the terrain above the line of sight at each intermediate sample,
+        # consecutive samples on opposite sides of the line cross it
+        above = z - line
+        if above.shape[1] == 1:
+            obstructed = above[:, 0] >= 0
+        else:
+            obstructed = np.any(above[:, :-1] * above[:, 1:] <= 0, axis=1)
+        # profiles of coincident endpoints are vertical, the terrain obstructs them when their heights overlap
+        flat = length[:, 0] <= 0
+        if np.any(flat):
+            low, high = np.minimum(z0, z1), np.maximum(z0, z1)
+            obstructed[flat] = (z[flat].min(axis=1) <= high[flat]) & (z[flat].max(axis=1) >= low[flat])
+        return obstructed
+
     @validate_arguments
     def run(
         self,
@@ -0,0 +1,224 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List, Optional, Text
+import numpy as np
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from giga.schemas.geo import UniqueCoordinate
+from giga.schemas.profile_store import DEFAULT_PROFILE_DTYPE
+from giga.models.nodes.elevation.elevation_profile_generator import (
+    ElevationProfileGenerator,
+    DEFAULT_DATASET,
+)
+from giga.models.nodes.elevation.line_of_sight_model import LineofSightModel
+from giga.models.nodes.elevation.elevation_point_cache import connect_cache_database
+from giga.utils.logging import LOGGER
+
+# Constants
+# persistent cache of line of sight results shared by all workspaces, an empty value disables it
+LOS_PAIR_CACHE_FILE = os.environ.get(
+    "LOS_PAIR_CACHE_FILE",
+    os.path.join(os.path.expanduser("~"), ".cache", "giga", "los_pairs.sqlite"),
+)
+# defaults of the P2P and school visibility cache builders
+DEFAULT_PROFILE_SAMPLES = 4
+DEFAULT_LOS_BUFFER_METERS = 5.0
+DEFAULT_RECEIVER_HEIGHT_METERS = 5.0
+SQLITE_MAX_PARAMETERS = 900
+
+
+class LineOfSightPairCache:
+    """
+    Persistent cache of the line of sight results of links, in a sqlite database.
+    Results are keyed by the exact endpoints and end height of a link and by a digest of the settings
+    they were evaluated with, so that results of different heights, buffers or elevation sources never mix.
+    The database is opened on the first lookup, when it cannot be opened or written to
+    results are only cached in memory.
+    """
+
+    def __init__(self, path: str = LOS_PAIR_CACHE_FILE):
+        self.path = path
+        self._memory: Dict = {}
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._opened = False
+
+    def _database(self) -> Optional[sqlite3.Connection]:
+        """The database connection, opened on first use, None when the database is disabled"""
+        if not self._opened:
+            self._opened = True
+            self._connection = connect_cache_database(
+                self.path,
+                "CREATE TABLE IF NOT EXISTS los_pairs "
+                "(settings TEXT, key TEXT, result INTEGER, PRIMARY KEY (settings, key)) WITHOUT ROWID",
+            )
+            if self._connection is not None:
+                LOGGER.info(f"Caching line of sight results in {self.path}")
+        return self._connection
+
+    def get(self, settings: Text, keys: List[Text]) -> Dict[Text, bool]:
+        """Cached results of the links with the given keys, links without a result are left out"""
+        with self._lock:
+            found = {k: self._memory[(settings, k)] for k in keys if (settings, k) in self._memory}
+            missing = [k for k in keys if k not in found]
+            if self._database() is None:
+                return found
+            for i in range(0, len(missing), SQLITE_MAX_PARAMETERS):
+                chunk = missing[i : i + SQLITE_MAX_PARAMETERS]
+                rows = self._connection.execute(
+                    f"SELECT key, result FROM los_pairs WHERE settings = ? "
+                    f"AND key IN ({','.join('?' * len(chunk))})",
+                    [settings] + chunk,
+                ).fetchall()
+                for k, r in rows:
+                    found[k] = self._memory[(settings, k)] = bool(r)
+        return found
+
+    def put(self, settings: Text, keys: List[Text], results: List[bool]):
+        with self._lock:
+            if self._database() is not None:
+                try:
+                    self._connection.executemany(
+                        "INSERT OR REPLACE INTO los_pairs (settings, key, result) VALUES (?, ?, ?)",
+                        [(settings, k, int(r)) for k, r in zip(keys, results)],
+                    )
+                    self._connection.commit()
+                except sqlite3.OperationalError as e:
+                    LOGGER.warning(f"Could not write to the cache database {self.path}, the cache is disabled: {e}")
+                    self._connection.close()
+                    self._connection = None
+            self._memory.update(((settings, k), bool(r)) for k, r in zip(keys, results))
+
+    def __len__(self):
+        with self._lock:
+            if self._database() is None:
+                return 0
+            return self._connection.execute("SELECT COUNT(*) FROM los_pairs").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+_SHARED_CACHES = {}
+_SHARED_CACHES_LOCK = threading.Lock()
+
+
+def shared_pair_cache(path: str = LOS_PAIR_CACHE_FILE) -> LineOfSightPairCache:
+    """
+    Line of sight pair cache of the process for a database file.
+    Returns None when the path is empty, which disables caching.
+    The database is only opened when results are first looked up.
+    """
+    if not path:
+        return None
+    with _SHARED_CACHES_LOCK:
+        if path not in _SHARED_CACHES:
+            _SHARED_CACHES[path] = LineOfSightPairCache(path)
+        return _SHARED_CACHES[path]
+
+
+class OnDemandLineOfSightModel:
+    """
+    Evaluates the line of sight of individual links when they are needed, instead of pre-computing it for
+    every candidate link in the P2P and school visibility caches.
+    Links are evaluated like the cache builders do: the profile starts at a school with the receiver height,
+    ends at a tower with its height, or at another school with the receiver height, and its intermediate samples
+    are raised by the buffer. Results are kept in the persistent line of sight pair cache.
+    """
+
+    def __init__(self, **kwargs):
+        self.n_elevation_profile_samples = kwargs.get("n_elevation_profile_samples", DEFAULT_PROFILE_SAMPLES)
+        self.los_buffer_meters = kwargs.get("los_buffer_meters", DEFAULT_LOS_BUFFER_METERS)
+        self.receiver_height_meters = kwargs.get("receiver_height_meters", DEFAULT_RECEIVER_HEIGHT_METERS)
+        self.earth_curvature = kwargs.get("earth_curvature", False)
+        self.fresnel_frequency_ghz = kwargs.get("fresnel_frequency_ghz", None)
+        self.profile_dtype = kwargs.get("profile_dtype", DEFAULT_PROFILE_DTYPE)
+        self.dataset = kwargs.get("dataset", DEFAULT_DATASET)
+        # heights of the end points of links by coordinate id, e.g. cell towers, others have the receiver height
+        self.heights: Dict[str, float] = kwargs.get("heights", {})
+        generator_kwargs = {"dem_directory": kwargs.get("dem_directory", None)}
+        if "elevation_cache_file" in kwargs:
+            generator_kwargs["elevation_cache_file"] = kwargs["elevation_cache_file"]
+        self._egp = ElevationProfileGenerator(**generator_kwargs)
+        self._los = LineofSightModel()
+        self.pair_cache = shared_pair_cache(kwargs.get("pair_cache_file", LOS_PAIR_CACHE_FILE))
+        self.n_evaluated = 0
+        self._settings = None
+
+    @property
+    def settings(self) -> Text:
+        """Digest of the settings and the elevation source results depend on"""
+        if self._settings is None:
+            settings = dict(
+                source=self._egp.source(self.dataset),
+                n_elevation_profile_samples=self.n_elevation_profile_samples,
+                los_buffer_meters=self.los_buffer_meters,
+                receiver_height_meters=self.receiver_height_meters,
+                earth_curvature=self.earth_curvature,
+                fresnel_frequency_ghz=self.fresnel_frequency_ghz,
+                profile_dtype=self.profile_dtype,
+            )
+            key = json.dumps(settings, sort_keys=True)
+            self._settings = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        return self._settings
+
+    def evaluate(self, starts: np.ndarray, ends: np.ndarray, end_heights: np.ndarray) -> np.ndarray:
+        """
+        Evaluates links without the pair cache
+        :param starts, ends, (n, 2) arrays of the lat/lon of the ends of the links
+        :param end_heights, the heights of the end points of the links
+        :return an array of n booleans, True for the links the cache builders keep
+        """
+        lats, lons, elevations = self._egp.profiles(
+            starts, ends, self.n_elevation_profile_samples, self.dataset
+        )
+        self.n_evaluated += len(starts)
+        return self._los.obstructions(
+            lats,
+            lons,
+            elevations.astype(self.profile_dtype),
+            start_heights=self.receiver_height_meters,
+            end_heights=end_heights,
+            elevation_buffer_meters=self.los_buffer_meters,
+            earth_curvature=self.earth_curvature,
+            fresnel_frequency_ghz=self.fresnel_frequency_ghz,
+        )
+
+    def has_line_of_sight(
+        self, starts: List[UniqueCoordinate], ends: List[UniqueCoordinate]
+    ) -> np.ndarray:
+        """
+        Line of sight of links from schools to towers or other schools, from the pair cache when possible
+        :param starts, the schools the links start at
+        :param ends, the towers or schools the links end at
+        :return an array of booleans, True for the links the cache builders keep
+        """
+        start_points = np.array([c.coordinate for c in starts], dtype=np.float64).reshape(-1, 2)
+        end_points = np.array([c.coordinate for c in ends], dtype=np.float64).reshape(-1, 2)
+        end_heights = np.array(
+            [self.heights.get(c.coordinate_id, self.receiver_height_meters) for c in ends],
+            dtype=np.float64,
+        )
+        if self.pair_cache is None:
+            return self.evaluate(start_points, end_points, end_heights)
+        keys = [
+            f"{s[0]!r},{s[1]!r},{e[0]!r},{e[1]!r},{h!r}"
+            for s, e, h in zip(start_points.tolist(), end_points.tolist(), end_heights.tolist())
+        ]
+        cached = self.pair_cache.get(self.settings, keys)
+        results = np.array([cached.get(k, False) for k in keys], dtype=bool)
+        missing = np.array([i for i, k in enumerate(keys) if k not in cached], dtype=np.intp)
+        if len(missing) > 0:
+            evaluated = self.evaluate(start_points[missing], end_points[missing], end_heights[missing])
+            results[missing] = evaluated
+            self.pair_cache.put(self.settings, [keys[i] for i in missing.tolist()], evaluated.tolist())
+        return results
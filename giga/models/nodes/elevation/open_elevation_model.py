@@ -1,28 +1,37 @@
 from pydantic import validate_arguments
 from typing import List, Text
-from requests.adapters import HTTPAdapter, Retry
-import requests
+import math
+import numpy as np
 
 from giga.schemas.geo import LatLonPoint
 from giga.models.nodes.elevation.elevation_utilities import (
     format_opendata_request_singular_request,
 )
+from giga.models.nodes.elevation.elevation_api_client import ElevationAPIClient, shared_client
+from giga.models.nodes.elevation.elevation_point_cache import (
+    ElevationPointCache,
+    shared_elevation_cache,
+    ELEVATION_CACHE_FILE,
+)
 
 # Constants
 DEFAULT_DATASET = "aster30m"
-DEFAULT_RETRIES = 5
-DEFAULT_BACKOFF = 0.3
-
-# retry on all status codes that are 300+
-DEFAULT_FORCELIST = [x for x in requests.status_codes._codes if x >= 300]
 
 
 class OpenElevationModel:
     """
     Generates an elevation profile for lat/lon points using
     open source data sets.
+    Elevations are looked up in the persistent elevation point cache first,
+    the remaining points are queried from the API in batches.
     """
 
+    def __init__(self, **kwargs):
+        self.elevation_cache: ElevationPointCache = shared_elevation_cache(
+            kwargs.pop("elevation_cache_file", ELEVATION_CACHE_FILE)
+        )
+        self.client: ElevationAPIClient = ElevationAPIClient(**kwargs) if kwargs else shared_client()
+
     def format_data(self, x):
         data_transformed = format_opendata_request_singular_request(x)
         return data_transformed
@@ -39,31 +48,21 @@ class OpenElevationModel:
             dataset: The name of the OpenTopoData daatset
             you are interested in e.g. aster30m, nzdem8m for more information
             regarding available datasets visit - https://www.opentopodata.org/
-        Output: Response Object containing json reults
+        Output: ordered list of elevations, None where the dataset has no elevation
 
         """
         if data == []:
             return []
         else:
-            # Format data for request
-            values = self.format_data(data)
-            # create payload for POST request using formatted values
-            params = {"locations": f"{values}"}
-            url = f"https://api.opentopodata.org/v1/{dataset}?"
-            session = requests.Session()
-            retries = Retry(
-                total=DEFAULT_RETRIES,
-                backoff_factor=DEFAULT_BACKOFF,
-                status_forcelist=frozenset(DEFAULT_FORCELIST),
-                raise_on_redirect=True,
-                raise_on_status=True,
-            )
-            session.mount("https://", HTTPAdapter(max_retries=retries))
-            session.mount("http://", HTTPAdapter(max_retries=retries))
-            response = session.post(url, params)
-            result = response.json()
-            elevation_values_array = [x["elevation"] for x in result["results"]]
-            return elevation_values_array
+            points = np.array(data, dtype=np.float64).reshape(-1, 2)
+            fetch = lambda p: self.client.elevations(p, dataset)
+            if self.elevation_cache is None:
+                elevations = fetch(points)
+            else:
+                elevations = self.elevation_cache.elevations(
+                    points, f"{self.client.url}/{dataset}", fetch
+                )
+            return [None if math.isnan(e) else e for e in elevations.tolist()]
 
     @validate_arguments
     def run(self, data: List[LatLonPoint], dataset=DEFAULT_DATASET) -> List[float]:
@@ -0,0 +1,159 @@
+from typing import List, Callable
+import numpy as np
+
+from giga.schemas.geo import UniqueCoordinate, CoordinateArray, EdgeArray
+from giga.models.nodes.graph.greedy_distance_connector import GreedyDistanceConnector
+from giga.models.nodes.graph.distance_queue import CompetitiveDistanceQueue
+from giga.utils.progress_bar import managed_progress_bar
+from giga.schemas.distance_cache import GreedyConnectCache
+
+
+def DEFAULT_COST_FN(distance: float) -> float:
+    return distance
+
+
+class TechnologySource(GreedyDistanceConnector):
+    """
+    A connectivity technology that competes for unconnected coordinates in the CompetitiveDistanceConnector.
+    Holds the connected coordinates of the technology, its distance cache, maximum connection length
+    and distance model, as a greedy connector for that technology alone would.
+    The cost function maps a connection distance to a cost that is comparable across technologies,
+    it defaults to the distance itself.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        connected: List[UniqueCoordinate],
+        distance_cache: GreedyConnectCache = None,
+        **kwargs
+    ):
+        super().__init__(connected, distance_cache=distance_cache, **kwargs)
+        self.name = name
+        self.cost_fn: Callable[[float], float] = kwargs.get("cost_fn", DEFAULT_COST_FN)
+
+
+class CompetitiveDistanceConnector:
+    """
+    Greedily connects unconnected coordinates with several competing technologies in a single pass.
+    Every technology source proposes candidate connections to its own connected coordinates,
+    all candidates share one merged queue ordered by the cost of each technology,
+    ties go to the technology listed first, then to the shortest distance and earliest candidate.
+    A coordinate is connected by the first technology that reaches it, and when dynamic connect is
+    enabled for that technology the new connection can in turn connect further coordinates with it.
+    Coordinates connected to a metanode become the root of their own cluster.
+    """
+
+    def __init__(self, sources: List[TechnologySource], **kwargs):
+        self.sources = sources
+        self.progress_bar = kwargs.get("progress_bar", False)
+
+    def _queue_distances(self, queue, technology, index, distances):
+        # add candidate pairs (new connection, connected) of a technology to the queue
+        cost_fn = self.sources[technology].cost_fn
+        for d in distances:
+            child = index.get(d.pair_ids[0], None)
+            parent = index.get(d.pair_ids[1], None)
+            if child is None or parent is None:
+                continue
+            queue.add(technology, child, parent, d.distance, cost_fn(d.distance))
+
+    def _unconnected(self, queue, data, offset):
+        return [c for i, c in enumerate(data) if not queue.connected[offset + i]]
+
+    def run(self, data: List[UniqueCoordinate], **kwargs) -> List[EdgeArray]:
+        """
+        Connects a list of unconnected unique coordinates in the input to
+        the connected coordinates of the technology sources until no more connections are possible
+        param: data, a List[UniqueCoordinate] representing a collection of
+               UniqueCoordinates that contain a unique identifier and a location (usually lat/lon)
+        :return a list with an EdgeArray of ordered and connected coordinate pairs for each technology source,
+                in the order of the sources
+        """
+        # nodes are the connected coordinates of all sources followed by the unconnected coordinates
+        connected = []
+        index = {}
+        for source in self.sources:
+            for x in source.connected:
+                if x.coordinate_id not in index:
+                    index[x.coordinate_id] = len(connected)
+                    connected.append(x)
+        unique = {x.coordinate_id: x for x in data}
+        data = [x for cid, x in unique.items() if cid not in index]
+        offset = len(connected)
+        index.update({x.coordinate_id: offset + i for i, x in enumerate(data)})
+        n_nodes = offset + len(data)
+        queue = CompetitiveDistanceQueue(n_nodes, len(self.sources))
+        compiled_caches = [s._compiled_unconnected_cache(index) for s in self.sources]
+        unconnected = np.ones(n_nodes, dtype=bool)
+        unconnected[:offset] = False
+        # create a root tracker per technology, connected nodes are their own root
+        roots = [[-1] * n_nodes for _ in self.sources]
+        for t, source in enumerate(self.sources):
+            for x in source.connected:
+                i = index[x.coordinate_id]
+                queue.connect(t, i)
+                roots[t][i] = i
+        meta_node = index.get("metanode", None)
+        meta_nodes = []
+        edges = [([], [], [], []) for _ in self.sources]
+        for t, source in enumerate(self.sources):
+            self._queue_distances(
+                queue,
+                t,
+                index,
+                source.pairwise_distances(
+                    data, source.connected, cache=source._cache.connected_cache
+                ),
+            )
+        if self.progress_bar:
+            pbar = managed_progress_bar(len(data), description="Competitive Connect Model")
+        while True:
+            # iterate until no more connections are possible
+            candidate = queue.pop()  # fetch the cheapest candidate of all technologies
+            if candidate is None:
+                break
+            t, child, parent, d = candidate
+            queue.connect(t, child)
+            unconnected[child] = False
+            if parent == meta_node:
+                new_connection = data[child - offset]
+                meta_id = new_connection.coordinate_id + "_meta"
+                meta_nodes.append(
+                    UniqueCoordinate(
+                        coordinate_id=meta_id, coordinate=new_connection.coordinate
+                    )
+                )
+                parent = n_nodes + len(meta_nodes) - 1
+                roots[t][child] = parent
+            else:
+                roots[t][child] = roots[t][parent]
+            for column, value in zip(edges[t], (parent, child, d, roots[t][child])):
+                column.append(value)
+            if self.progress_bar:
+                pbar.update(1)
+            technology = self.sources[t]
+            if compiled_caches[t] is not None:
+                nodes, distances = technology._cached_neighbors(
+                    compiled_caches[t], unconnected, data[child - offset].coordinate_id
+                )
+                for node, distance in zip(nodes.tolist(), distances.tolist()):
+                    queue.add(t, node, child, distance, technology.cost_fn(distance))
+            elif technology.dynamic_connect:
+                # other unconnected coordinates can connect to the new connection with the same technology
+                self._queue_distances(
+                    queue,
+                    t,
+                    index,
+                    technology.pairwise_distances(
+                        self._unconnected(queue, data, offset),
+                        [data[child - offset]],
+                        cache=technology._cache.unconnected_cache,
+                    ),
+                )
+
+        if self.progress_bar:
+            pbar.update(pbar.total - pbar.n)
+            pbar.close()
+        nodes = CoordinateArray.from_coordinates(connected + data + meta_nodes)
+        return [EdgeArray(nodes, *e) for e in edges]
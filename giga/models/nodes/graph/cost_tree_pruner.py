@@ -182,7 +182,7 @@ class CostTreePrunerV2:
         step, evaluate, constraint, terminal = self.get_optimization_callbacks()
 
         if evaluate(cost_graph)>self.baseline_cost(cost_graph):
-            return ConnectedCostGraph(nx.DiGraph(), {})
+            return ConnectedCostGraph(nx.DiGraph(), {}, edges=cost_graph.edges)
         
         exit = False
         while not exit:
@@ -0,0 +1,331 @@
+import heapq
+import math
+from typing import List, Tuple
+import numpy as np
+
+
+class IndexedDistanceHeap:
+    """
+    Binary min heap over integer node ids that holds at most one key per node.
+    Keys are (distance, sequence) tuples, a node already in the heap can only have its key decreased.
+    """
+
+    def __init__(self, n_nodes: int):
+        self._heap = []  # node ids in heap order
+        self._pos = [-1] * n_nodes  # position of each node in the heap, -1 if absent
+        self._key = [None] * n_nodes
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, node: int):
+        return self._pos[node] >= 0
+
+    def key(self, node: int):
+        return self._key[node] if self._pos[node] >= 0 else None
+
+    def push_or_decrease(self, node: int, key: Tuple) -> bool:
+        """
+        Inserts the node or decreases its key
+        :return True if the heap was updated, False if the node already has a smaller or equal key
+        """
+        pos = self._pos[node]
+        if pos < 0:
+            self._key[node] = key
+            self._pos[node] = len(self._heap)
+            self._heap.append(node)
+            self._sift_up(len(self._heap) - 1)
+            return True
+        if key < self._key[node]:
+            self._key[node] = key
+            self._sift_up(pos)
+            return True
+        return False
+
+    def peek(self):
+        node = self._heap[0]
+        return self._key[node], node
+
+    def pop(self):
+        key, node = self.peek()
+        self.remove(node)
+        return key, node
+
+    def remove(self, node: int):
+        pos = self._pos[node]
+        if pos < 0:
+            return
+        last = self._heap.pop()
+        self._pos[node] = -1
+        if last != node:
+            self._heap[pos] = last
+            self._pos[last] = pos
+            self._sift_up(pos)
+            self._sift_down(self._pos[last])
+
+    def _sift_up(self, pos: int):
+        heap, keys, positions = self._heap, self._key, self._pos
+        node = heap[pos]
+        key = keys[node]
+        while pos > 0:
+            parent_pos = (pos - 1) >> 1
+            parent = heap[parent_pos]
+            if key < keys[parent]:
+                heap[pos] = parent
+                positions[parent] = pos
+                pos = parent_pos
+            else:
+                break
+        heap[pos] = node
+        positions[node] = pos
+
+    def _sift_down(self, pos: int):
+        heap, keys, positions = self._heap, self._key, self._pos
+        size = len(heap)
+        node = heap[pos]
+        key = keys[node]
+        while True:
+            child_pos = 2 * pos + 1
+            if child_pos >= size:
+                break
+            right_pos = child_pos + 1
+            if right_pos < size and keys[heap[right_pos]] < keys[heap[child_pos]]:
+                child_pos = right_pos
+            child = heap[child_pos]
+            if keys[child] < key:
+                heap[pos] = child
+                positions[child] = pos
+                pos = child_pos
+            else:
+                break
+        heap[pos] = node
+        positions[node] = pos
+
+
+class DistanceQueue:
+    """
+    Priority queue of candidate connections used by the greedy connectors (Prim's algorithm).
+    Works on integer node ids and keeps one best known (distance, parent) per unconnected node,
+    so the queue holds O(V) entries instead of one entry per candidate edge.
+    Ties are broken by the order in which candidates were added, which makes runs deterministic.
+    Candidates whose parent is not connected yet are held separately and only become valid
+    if the parent is connected by the time they reach the top of the queue.
+    """
+
+    def __init__(self, n_nodes: int):
+        self.n_nodes = n_nodes
+        self.connected = [False] * n_nodes
+        self.parent = [-1] * n_nodes
+        self._heap = IndexedDistanceHeap(n_nodes)
+        self._pending = []  # heapq of (distance, sequence, child, parent)
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self._heap) + len(self._pending)
+
+    def empty(self) -> bool:
+        return len(self) == 0
+
+    def best_distance(self, node: int) -> float:
+        key = self._heap.key(node)
+        return math.inf if key is None else key[0]
+
+    def connect(self, node: int):
+        """Marks a node as connected, removing any queued candidate for it"""
+        self.connected[node] = True
+        self._heap.remove(node)
+
+    def add(self, child: int, parent: int, distance: float):
+        """Adds a candidate connection of an unconnected child to a parent node"""
+        sequence = self._sequence
+        self._sequence += 1
+        if self.connected[child]:
+            return
+        if not self.connected[parent]:
+            heapq.heappush(self._pending, (distance, sequence, child, parent))
+        elif self._heap.push_or_decrease(child, (distance, sequence)):
+            self.parent[child] = parent
+
+    def add_many(self, candidates: List[Tuple[int, int, float]]):
+        for child, parent, distance in candidates:
+            self.add(child, parent, distance)
+
+    def add_array(self, children: np.ndarray, parent: int, distances: np.ndarray):
+        """Adds candidate connections of children to a single parent, infinite distances are skipped"""
+        for child, distance in zip(children.tolist(), distances.tolist()):
+            if distance < math.inf:
+                self.add(child, parent, distance)
+
+    def pop(self):
+        """
+        Removes the closest valid candidate from the queue
+        :return a tuple of (child, parent, distance), or None if no candidates are left
+        """
+        while len(self) > 0:
+            use_pending = len(self._pending) > 0 and (
+                len(self._heap) == 0 or self._pending[0][:2] < self._heap.peek()[0]
+            )
+            if use_pending:
+                distance, _, child, parent = heapq.heappop(self._pending)
+                if self.connected[child] or not self.connected[parent]:
+                    continue
+                return child, parent, distance
+            (distance, _), child = self._heap.pop()
+            return child, self.parent[child], distance
+        return None
+
+
+class DenseDistanceQueue:
+    """
+    Array backed variant of the DistanceQueue for dense Prim's algorithm.
+    Keeps the best known distance, parent and insertion sequence of every node in NumPy arrays,
+    candidates from a new connection are merged with a single vectorized update
+    and the closest node is found with an O(V) scan, giving O(V^2) work overall.
+    Ties are broken by insertion order, so it connects nodes in the same order as the DistanceQueue.
+    """
+
+    def __init__(self, n_nodes: int):
+        self.n_nodes = n_nodes
+        self.connected = np.zeros(n_nodes, dtype=bool)
+        self.parent = np.full(n_nodes, -1, dtype=np.int64)
+        self._best = np.full(n_nodes, np.inf)
+        self._sequences = np.full(n_nodes, np.iinfo(np.int64).max, dtype=np.int64)
+        self._pending = []  # heapq of (distance, sequence, child, parent)
+        self._sequence = 0
+
+    def __len__(self):
+        return int(np.count_nonzero(np.isfinite(self._best))) + len(self._pending)
+
+    def empty(self) -> bool:
+        return len(self) == 0
+
+    def best_distance(self, node: int) -> float:
+        return float(self._best[node])
+
+    def connect(self, node: int):
+        self.connected[node] = True
+        self._best[node] = np.inf
+
+    def add(self, child: int, parent: int, distance: float):
+        sequence = self._sequence
+        self._sequence += 1
+        if self.connected[child]:
+            return
+        if not self.connected[parent]:
+            heapq.heappush(self._pending, (distance, sequence, child, parent))
+        elif distance < self._best[child]:
+            self._best[child] = distance
+            self._sequences[child] = sequence
+            self.parent[child] = parent
+
+    def add_many(self, candidates: List[Tuple[int, int, float]]):
+        for child, parent, distance in candidates:
+            self.add(child, parent, distance)
+
+    def add_array(self, children: np.ndarray, parent: int, distances: np.ndarray):
+        """
+        Adds candidate connections of unique children to a single connected parent,
+        sequences follow the order of the children array
+        """
+        sequences = self._sequence + np.arange(len(children), dtype=np.int64)
+        self._sequence += len(children)
+        improved = ~self.connected[children] & (distances < self._best[children])
+        children = children[improved]
+        self._best[children] = distances[improved]
+        self._sequences[children] = sequences[improved]
+        self.parent[children] = parent
+
+    def pop(self):
+        """
+        Removes the closest valid candidate from the queue
+        :return a tuple of (child, parent, distance), or None if no candidates are left
+        """
+        while True:
+            child = int(np.argmin(self._best))
+            distance = self._best[child]
+            if np.isfinite(distance):
+                # among equal distances the earliest candidate wins
+                ties = np.flatnonzero(self._best == distance)
+                if len(ties) > 1:
+                    child = int(ties[np.argmin(self._sequences[ties])])
+                key = (float(distance), int(self._sequences[child]))
+            else:
+                key = None
+            if len(self._pending) > 0 and (key is None or self._pending[0][:2] < key):
+                distance, _, child, parent = heapq.heappop(self._pending)
+                if self.connected[child] or not self.connected[parent]:
+                    continue
+                return child, parent, distance
+            if key is None:
+                return None
+            self._best[child] = np.inf
+            return child, int(self.parent[child]), key[0]
+
+
+class CompetitiveDistanceQueue:
+    """
+    Priority queue of candidate connections for several competing technologies.
+    Each unconnected node holds at most one candidate per technology in a single merged heap,
+    keyed by (cost, technology, distance, sequence), so candidates are compared by a cost that is
+    comparable across technologies, then by technology order, distance and insertion order.
+    A node connected by any technology is removed from the queue,
+    while parents are only valid for candidates of the technology that connected them.
+    """
+
+    def __init__(self, n_nodes: int, n_technologies: int):
+        self.n_nodes = n_nodes
+        self.n_technologies = n_technologies
+        self.connected = [False] * n_nodes
+        self.technology_connected = [[False] * n_nodes for _ in range(n_technologies)]
+        self.parent = [-1] * (n_nodes * n_technologies)
+        self._heap = IndexedDistanceHeap(n_nodes * n_technologies)
+        self._pending = []  # heapq of (key, technology, child, parent)
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self._heap) + len(self._pending)
+
+    def empty(self) -> bool:
+        return len(self) == 0
+
+    def _slot(self, technology: int, node: int) -> int:
+        return technology * self.n_nodes + node
+
+    def connect(self, technology: int, node: int):
+        """Marks a node as connected by a technology, removing its candidates of all technologies"""
+        self.connected[node] = True
+        self.technology_connected[technology][node] = True
+        for t in range(self.n_technologies):
+            self._heap.remove(self._slot(t, node))
+
+    def add(self, technology: int, child: int, parent: int, distance: float, cost: float):
+        """Adds a candidate connection of an unconnected child to a parent node of a technology"""
+        key = (cost, technology, distance, self._sequence)
+        self._sequence += 1
+        if self.connected[child]:
+            return
+        if not self.technology_connected[technology][parent]:
+            heapq.heappush(self._pending, (key, technology, child, parent))
+            return
+        slot = self._slot(technology, child)
+        if self._heap.push_or_decrease(slot, key):
+            self.parent[slot] = parent
+
+    def pop(self):
+        """
+        Removes the cheapest valid candidate from the queue
+        :return a tuple of (technology, child, parent, distance), or None if no candidates are left
+        """
+        while len(self) > 0:
+            use_pending = len(self._pending) > 0 and (
+                len(self._heap) == 0 or self._pending[0][0] < self._heap.peek()[0]
+            )
+            if use_pending:
+                key, technology, child, parent = heapq.heappop(self._pending)
+                if self.connected[child] or not self.technology_connected[technology][parent]:
+                    continue
+                return technology, child, parent, key[2]
+            key, slot = self._heap.pop()
+            technology, child = divmod(slot, self.n_nodes)
+            return technology, child, self.parent[slot], key[2]
+        return None
@@ -1,29 +1,28 @@
 import math
+import heapq
 from typing import List
-from queue import PriorityQueue
 import numpy as np
+from sklearn.neighbors import BallTree
 
-from giga.schemas.geo import UniqueCoordinate, PairwiseDistance
+from giga.schemas.geo import UniqueCoordinate, CoordinateArray, EdgeArray
 from giga.models.nodes.graph.pairwise_distance_model import PairwiseDistanceModel
+from giga.models.nodes.graph.vectorized_distance_model import (
+    VectorizedDistanceModel,
+    RADIUS_EARTH_M,
+    DEFAULT_LEAF_SIZE,
+)
+from giga.models.nodes.graph.distance_queue import DistanceQueue, DenseDistanceQueue
 from giga.utils.progress_bar import managed_progress_bar
 from giga.schemas.distance_cache import GreedyConnectCache
 
 
-EPS = 1e-4  # for tie-breakers in queue with equal distances
-
-
-# helpers below can be pulled into a distance queue class in a future refactor
-def add_distances(q, distances):
-    for d in distances:
-        priority, item = d.distance + np.random.uniform(0.0, EPS), d
-        q.put((priority, item))
-    return q
-
-
-def move_item(source, target, identifier):
-    item = source.pop(identifier)
-    target[identifier] = item
-    return item
+# relative slack on radius queries, exact distances are filtered against the cap afterwards
+RADIUS_TOLERANCE = 1e-6
+# candidate neighbors of the lazy line of sight mode, the defaults of the P2P and school visibility caches
+LAZY_CONNECTED_NEIGHBORS = 20
+LAZY_UNCONNECTED_NEIGHBORS = 5
+# number of candidate edges at the top of the queue whose line of sight is evaluated together
+LAZY_LOOKAHEAD = 256
 
 
 class GreedyDistanceConnector:
@@ -33,6 +32,17 @@ class GreedyDistanceConnector:
     a subset of connected nodes.
     When configured with the dynamic_connect parameter to True
     this runs Prim's algorithm: https://en.wikipedia.org/wiki/Prim%27s_algorithm
+    Candidate connections are tracked in a DistanceQueue over integer node ids,
+    ties between equal distances are broken by the order in which candidates were found.
+    Without a cache for the unconnected coordinates, Prim's algorithm runs in a dense mode:
+    the best candidate of every unconnected node is kept in NumPy arrays and each new connection
+    is compared against all remaining nodes with a single vectorized distance computation.
+    If the maximum connection length is bounded, a spatial index limits each of these updates
+    to the unconnected nodes within that radius of the new connection and candidates are kept
+    in the DistanceQueue, so each step is proportional to the local density of nodes.
+    When configured with a line_of_sight model, the connector runs in a lazy line of sight mode instead of
+    using pre-computed P2P and visibility caches: candidates are taken from the plain distance nearest neighbors
+    and the line of sight of an edge is only evaluated when it reaches the top of the queue.
     """
 
     def __init__(
@@ -52,470 +62,359 @@ class GreedyDistanceConnector:
         # when set True, new dynamic connected coordinates can be used as connections
         self.dynamic_connect = kwargs.get("dynamic_connect", True)
         self.progress_bar = kwargs.get("progress_bar", False)
+        # one of "auto", True or False, auto uses the dense mode when dynamically connecting
+        # without an unconnected cache and the distance model supports vectorized distances
+        self.dense_connect = kwargs.get("dense_connect", "auto")
         self._cache = (
             distance_cache if distance_cache is not None else GreedyConnectCache()
         )
+        # lazy line of sight mode, a model with a has_line_of_sight(starts, ends) method, e.g. OnDemandLineOfSightModel
+        self.line_of_sight = kwargs.get("line_of_sight", None)
+        # candidate connected nodes of each unconnected node in the lazy mode
+        self.n_nearest_neighbors = kwargs.get("n_nearest_neighbors", LAZY_CONNECTED_NEIGHBORS)
+        # a new connection is a candidate of the unconnected nodes that have it among their nearest neighbors,
+        # the count includes the node itself like the school distance caches
+        self.n_nearest_unconnected = kwargs.get("n_nearest_unconnected", LAZY_UNCONNECTED_NEIGHBORS)
+        self.maximum_unconnected_distance_m = kwargs.get("maximum_unconnected_distance_m", math.inf)
+        self.lookahead = kwargs.get("lookahead", LAZY_LOOKAHEAD)
 
-    def _queue_non_cached(self, q, set1, set2):
+    def _use_dense(self):
+        if not self.dynamic_connect or self._cache.unconnected_cache is not None:
+            return False
+        supported = hasattr(self.distance_model, "distance_vector")
+        if self.dense_connect == "auto":
+            return supported
+        assert (
+            not self.dense_connect or supported
+        ), "Dense connect requires a distance model with a distance_vector method"
+        return bool(self.dense_connect)
+
+    def _distances_non_cached(self, set1, set2):
         distances = self.distance_model.run((set1, set2))
-        distances = list(
-            filter(
-                lambda x: x is not None
-                and x.distance < self.maximum_connection_length_m,
-                distances,
-            )
-        )
-        return add_distances(q, distances)
+        return [
+            x
+            for x in distances
+            if x is not None and x.distance < self.maximum_connection_length_m
+        ]
 
-    def _queue_from_cache(self, q, set1, set2, cache):
-        coord_ids1 = set([c.coordinate_id for c in set1])
-        coord_ids2 = set([c.coordinate_id for c in set2])
+    def _distances_from_cache(self, set1, set2, cache):
         if cache.cache_type == "one-to-one":
-            distances = [cache.lookup.get(cid, None) for cid in coord_ids1]
+            distances = [cache.lookup.get(c.coordinate_id, None) for c in set1]
         elif cache.cache_type == "one-to-many":
             # single cache in set 2
             distances = []
-            for cid in coord_ids2:
-                if cid in cache.lookup:
-                    distances += cache.lookup[cid]
+            for c in set2:
+                distances += cache.lookup.get(c.coordinate_id, [])
         else:
             raise Exception("Trying to use a cache of unsupported type")
-        distances = list(
-            filter(
-                lambda x: x is not None
-                and x.distance < self.maximum_connection_length_m
-                and (
-                    x.coordinate1.coordinate_id in coord_ids1
-                    or x.coordinate1.coordinate_id in coord_ids2
-                )
-                and (
-                    (
-                        x.coordinate2.coordinate_id in coord_ids1
-                        or x.coordinate2.coordinate_id in coord_ids2
-                    )
-                ),  # add check here to make sure coordinates in distance are in both sets
-                distances,
-            )
-        )
-        return add_distances(q, distances)
+        # membership of both coordinates in the node set is checked when the candidates are indexed
+        return [
+            x
+            for x in distances
+            if x is not None and x.distance < self.maximum_connection_length_m
+        ]
 
-    def queue_pairwise_distances(self, q, set1, set2, cache=None):
+    def pairwise_distances(self, set1, set2, cache=None):
         if cache:
-            return self._queue_from_cache(q, set1, set2, cache)
+            return self._distances_from_cache(set1, set2, cache)
         else:
-            return self._queue_non_cached(q, set1, set2)
-        
-    def run_meta(self, data: List[UniqueCoordinate], **kwargs) -> List[PairwiseDistance]:
-        """
-        Connects a list of unconnected unique coordinates in the input to
-        a set of connected unique coordinates until no more connections are possible
-        if metanode, means that no fiber coordinates exist, treat differently
-        param: data, a List[UniqueCoordinate] representing a collection of
-               UniqueCoordinates that contain a unique identifier and a location (usually lat/lon)
-        :return list of PairwiseDistance objects which represent an ordered an connected coordinate pairs
-                added to the set of connected coordinates in this model.
-        """
+            return self._distances_non_cached(set1, set2)
 
-        greedy_connected = []
-        queue = (
-            PriorityQueue()
-        )  # priority queue is used to connect closest unconnected coordinates
-        # create two look ups for connected (self.connected)
-        # and unconnected (input data) coordinate sets
-        connected_coordinates = {x.coordinate_id: x for x in self.connected}
-        unconnected_coordinates = {x.coordinate_id: x for x in data}
-        # create a source tracker
-        sources = {x.coordinate_id: x.coordinate_id for x in self.connected}
-        # add pairwise distances between all coordinates and in data to priority queue
-        queue = self.queue_pairwise_distances(
-            queue, data, self.connected, cache=self._cache.connected_cache
-        )
-        if self.progress_bar:
-            pbar = managed_progress_bar(len(data), description="Distance Connect Model")
-        while not queue.empty():
-            # iterate until priority queue is empty
-            d, candidate = queue.get()  # fetch coordinate pair with closest distance
-            id1, id2 = candidate.pair_ids
-            connected1, connected2 = (
-                id1 in connected_coordinates,
-                id2 in connected_coordinates,
-            )
-            if connected1 and connected2:
-                # if both items are connected skip, used to handle identical coordinates
-                # not needed if coordinates in connected and unconnected sets are unique
-                continue
-            elif connected2:
-                # coordinate 1 is not connected
-                # make new connection move from unconnected lookup to connected lookup
-                new_connection = move_item(
-                    unconnected_coordinates, connected_coordinates, id1
-                )
-                # fetch for source use id2 if doesn't exist
-                if id2 == "metanode":
-                    candidate.coordinate1.properties["source"] = id1+"_meta"
-                    sources[id1+"_meta"] = id1+"_meta"
-                    sources[id1] = id1+"_meta"
-                    candidate.coordinate2 = UniqueCoordinate(coordinate_id=id1+"_meta",coordinate=candidate.coordinate1.coordinate)
-                    candidate.pair_ids = (id1,id1+"_meta")
-                else:
-                    candidate.coordinate1.properties["source"] = sources[id2]
-                    sources[id1] = sources[id2]
-                greedy_connected.append(candidate)
-                if self.progress_bar:
-                    pbar.update(1)
-                if self.dynamic_connect:
-                    # if other unconnected coordinates can connect to new connection
-                    queue = self.queue_pairwise_distances(
-                        queue,
-                        list(unconnected_coordinates.values()),
-                        [new_connection],
-                        cache=self._cache.unconnected_cache,
-                    )
-            else:
-                # neither items are connected, skip
+    def _queue_distances(self, queue, index, distances):
+        # add candidate pairs (new connection, connected) to the queue using integer node ids
+        for d in distances:
+            child = index.get(d.pair_ids[0], None)
+            parent = index.get(d.pair_ids[1], None)
+            if child is None or parent is None:
                 continue
+            queue.add(child, parent, d.distance)
 
-        
-        if self.progress_bar:
-            pbar.update(pbar.total - pbar.n)
-            pbar.close()
-        return greedy_connected
+    def _unconnected(self, queue, data, offset):
+        return [c for i, c in enumerate(data) if not queue.connected[offset + i]]
+
+    def _compiled_unconnected_cache(self, index):
+        # one to many caches are expanded through their CSR form mapped onto the node ids
+        cache = self._cache.unconnected_cache
+        if not self.dynamic_connect or cache is None or cache.cache_type != "one-to-many":
+            return None
+        compiled = cache.compile()
+        return compiled, compiled.map_ids(index)
 
-    def run(self, data: List[UniqueCoordinate], **kwargs) -> List[PairwiseDistance]:
+    def _cached_neighbors(self, compiled_cache, unconnected, coordinate_id):
         """
-        Connects a list of unconnected unique coordinates in the input to
-        a set of connected unique coordinates until no more connections are possible
-        if metanode, means that no fiber coordinates exist, treat differently
-        param: data, a List[UniqueCoordinate] representing a collection of
-               UniqueCoordinates that contain a unique identifier and a location (usually lat/lon)
-        :return list of PairwiseDistance objects which represent an ordered an connected coordinate pairs
-                added to the set of connected coordinates in this model.
+        Looks up the cached neighbors of a new connection that can still be connected
+        :param unconnected, a boolean membership array over the node ids
+        :return a tuple of neighbor node ids and distances, in the order of the cache
         """
+        compiled, mapping = compiled_cache
+        neighbors, distances = compiled.row(coordinate_id)
+        nodes = mapping[neighbors]
+        keep = nodes >= 0
+        nodes, distances = nodes[keep], distances[keep]
+        keep = unconnected[nodes] & (distances < self.maximum_connection_length_m)
+        return nodes[keep], distances[keep]
 
-        connected_coordinates = {x.coordinate_id: x for x in self.connected}
-        if "metanode" in connected_coordinates:
-            return self.run_meta(data)
-        
-        greedy_connected = []
-        queue = (
-            PriorityQueue()
-        )  # priority queue is used to connect closest unconnected coordinates
-        # create two look ups for connected (self.connected)
-        # and unconnected (input data) coordinate sets
-        
-        unconnected_coordinates = {x.coordinate_id: x for x in data}
-        # create a source tracker
-        sources = {x.coordinate_id: x.coordinate_id for x in self.connected}
-        # add pairwise distances between all coordinates and in data to priority queue
-        queue = self.queue_pairwise_distances(
-            queue, data, self.connected, cache=self._cache.connected_cache
-        )
-        if self.progress_bar:
-            pbar = managed_progress_bar(len(data), description="Distance Connect Model")
-        while not queue.empty():
-            # iterate until priority queue is empty
-            d, candidate = queue.get()  # fetch coordinate pair with closest distance
-            id1, id2 = candidate.pair_ids
-            connected1, connected2 = (
-                id1 in connected_coordinates,
-                id2 in connected_coordinates,
-            )
-            if connected1 and connected2:
-                # if both items are connected skip, used to handle identical coordinates
-                # not needed if coordinates in connected and unconnected sets are unique
-                continue
-            elif connected2:
-                # coordinate 1 is not connected
-                # make new connection move from unconnected lookup to connected lookup
-                new_connection = move_item(
-                    unconnected_coordinates, connected_coordinates, id1
-                )
-                # fetch for source use id2 if doesn't exist
-                candidate.coordinate1.properties["source"] = sources[id2]
-                sources[id1] = sources[id2]
-                greedy_connected.append(candidate)
-                if self.progress_bar:
-                    pbar.update(1)
-                if self.dynamic_connect:
-                    # if other unconnected coordinates can connect to new connection
-                    queue = self.queue_pairwise_distances(
-                        queue,
-                        list(unconnected_coordinates.values()),
-                        [new_connection],
-                        cache=self._cache.unconnected_cache,
-                    )
-            else:
-                # neither items are connected, skip
-                continue
-
-        if self.progress_bar:
-            pbar.update(pbar.total - pbar.n)
-            pbar.close()
-        return greedy_connected
-    
-class DoubleGreedyDistanceConnector:
+    def _radius_index(self, radians):
+        # spatial index over the unconnected coordinates, only useful when connections are capped
+        if not self.maximum_connection_length_m < math.inf:
+            return None
+        rows = np.flatnonzero(np.isfinite(radians).all(axis=1))
+        if len(rows) == 0:
+            return None
+        tree = BallTree(radians[rows], leaf_size=DEFAULT_LEAF_SIZE, metric="haversine")
+        return tree, rows
 
-    """
-    Uses a greedy approach to iteratively connect the closest unconnected nodes to
-    a subset of connected nodes.
-    When configured with the dynamic_connect parameter to True
-    this runs Prim's algorithm: https://en.wikipedia.org/wiki/Prim%27s_algorithm
-    """
-
-    def __init__(
-        self,
-        connected: List[List[UniqueCoordinate]],
-        distance_cache: List[GreedyConnectCache],
-        maximum_connection_length_m: List[float],
-        distance_threshold: float,
-        **kwargs
-    ):
-        self.tech1_connected = connected[0]
-        self.tech2_connected = connected[1]
-        # used to compute distances between coordinate pairs
-        self.distance_model = kwargs.get("distance_model", PairwiseDistanceModel())
-        # if configured, allows connections that are less than the configured length
-        self.maximum_connection_length_m =  maximum_connection_length_m
-        # if set to False only allows connections between the existing connected set
-        # when set True, new dynamic connected coordinates can be used as connections
-        self.dynamic_connect = kwargs.get("dynamic_connect", True)
-        self.progress_bar = kwargs.get("progress_bar", False)
-        self._tech1_cache = (
-            distance_cache[0] if distance_cache[0] is not None else GreedyConnectCache()
+    def _dense_candidates(self, queue, radians, offset, child, radius_index):
+        if radius_index is None:
+            return np.flatnonzero(~np.asarray(queue.connected[offset:]))
+        tree, rows = radius_index
+        radius = self.maximum_connection_length_m / RADIUS_EARTH_M
+        hits = tree.query_radius(
+            radians[child - offset].reshape(1, 2), r=radius * (1.0 + RADIUS_TOLERANCE)
+        )[0]
+        # keep the data order so candidates are sequenced as in the unpruned update
+        hits = np.sort(rows[hits])
+        connected = np.fromiter(
+            (queue.connected[offset + i] for i in hits), dtype=bool, count=len(hits)
         )
-        self._tech2_cache = (
-            distance_cache[1] if distance_cache[1] is not None else GreedyConnectCache()
+        return hits[~connected]
+
+    def _queue_dense(self, queue, radians, offset, child, radius_index=None):
+        # update the candidates of all unconnected coordinates with the new connection at once
+        unconnected = self._dense_candidates(queue, radians, offset, child, radius_index)
+        if len(unconnected) == 0:
+            return
+        distances = self.distance_model.distance_vector(
+            radians[unconnected], radians[child - offset]
         )
-        self.distance_threshold = distance_threshold
+        distances[~(distances < self.maximum_connection_length_m)] = np.inf
+        queue.add_array(unconnected + offset, child, distances)
 
-    def _queue_non_cached(self, q, index, set1, set2):
-        distances = self.distance_model.run((set1, set2))
-        distances = list(
-            filter(
-                lambda x: x is not None
-                and x.distance < self.maximum_connection_length_m[index],
-                distances,
-            )
+    def _reverse_neighbors(self, data):
+        """
+        Candidates of new connections in the lazy mode: for each unconnected node b, the unconnected nodes a
+        that have b among their nearest neighbors, sorted by distance
+        :return CSR offsets, node rows and distances
+        """
+        n = len(data)
+        model = VectorizedDistanceModel(
+            n_nearest_neighbors=self.n_nearest_unconnected,
+            maximum_distance=self.maximum_unconnected_distance_m,
         )
-        return add_distances(q, distances)
+        idxs, distances = model.neighbors((data, data))
+        counts = np.array([len(i) for i in idxs], dtype=np.intp)
+        sources = np.repeat(np.arange(n), counts)
+        targets = np.concatenate(idxs).astype(np.intp) if n > 0 else np.empty(0, dtype=np.intp)
+        distances = np.concatenate(distances) if n > 0 else np.empty(0)
+        keep = sources != targets
+        sources, targets, distances = sources[keep], targets[keep], distances[keep]
+        order = np.lexsort((sources, distances, targets))
+        offsets = np.zeros(n + 1, dtype=np.intp)
+        offsets[1:] = np.cumsum(np.bincount(targets, minlength=n))
+        return offsets, sources[order], distances[order]
 
-    def _queue_from_cache(self, q, index, set1, set2, cache):
-        coord_ids1 = set([c.coordinate_id for c in set1])
-        coord_ids2 = set([c.coordinate_id for c in set2])
-        if cache.cache_type == "one-to-one":
-            distances = [cache.lookup.get(cid, None) for cid in coord_ids1]
-        elif cache.cache_type == "one-to-many":
-            # single cache in set 2
-            distances = []
-            for cid in coord_ids2:
-                if cid in cache.lookup:
-                    distances += cache.lookup[cid]
-        else:
-            raise Exception("Trying to use a cache of unsupported type")
-        distances = list(
-            filter(
-                lambda x: x is not None
-                and x.distance < self.maximum_connection_length_m[index]
-                and (
-                    x.coordinate1.coordinate_id in coord_ids1
-                    or x.coordinate1.coordinate_id in coord_ids2
-                )
-                and (
-                    (
-                        x.coordinate2.coordinate_id in coord_ids1
-                        or x.coordinate2.coordinate_id in coord_ids2
-                    )
-                ),  # add check here to make sure coordinates in distance are in both sets
-                distances,
-            )
+    def _evaluate_top(self, heap, nodes, connected, known):
+        # evaluate the line of sight of the next candidate edges at once, they are likely to be used next
+        popped, unknown = [], []
+        while len(heap) > 0 and len(unknown) < self.lookahead:
+            edge = heapq.heappop(heap)
+            child, parent = edge[2], edge[3]
+            if connected[child]:
+                continue
+            popped.append(edge)
+            if (child, parent) not in known:
+                unknown.append((child, parent))
+        unknown = list(dict.fromkeys(unknown))
+        results = self.line_of_sight.has_line_of_sight(
+            [nodes[c] for c, _ in unknown], [nodes[p] for _, p in unknown]
         )
-        return add_distances(q, distances)
+        known.update(zip(unknown, results.tolist()))
+        for edge in popped:
+            heapq.heappush(heap, edge)
 
-    def queue_pairwise_distances(self, q, index, set1, set2, cache=None):
-        if cache:
-            return self._queue_from_cache(q, index, set1, set2, cache)
-        else:
-            return self._queue_non_cached(q, index, set1, set2)
-        
-    def run_meta(self, data: List[UniqueCoordinate], **kwargs) -> List[PairwiseDistance]:
+    def run_lazy(self, data: List[UniqueCoordinate]) -> EdgeArray:
         """
-        Connects a list of unconnected unique coordinates in the input to
-        a set of connected unique coordinates until no more connections are possible
-        if metanode, means that no fiber coordinates exist, treat differently
-        param: data, a List[UniqueCoordinate] representing a collection of
-               UniqueCoordinates that contain a unique identifier and a location (usually lat/lon)
-        :return list of PairwiseDistance objects which represent an ordered an connected coordinate pairs
-                added to the set of connected coordinates in this model.
+        Connects the unconnected coordinates in data with lazy line of sight evaluation.
+        Each unconnected coordinate is a candidate of its nearest connected coordinates, and with dynamic_connect
+        of the new connections it has among its nearest unconnected neighbors. Candidate edges are kept in a heap
+        by distance, the line of sight of an edge is evaluated when it reaches the top of the heap and edges
+        without it are dropped, so edges that are never used are never evaluated.
+        Lines of sight are evaluated from the child of an edge to its parent, like in the P2P and visibility caches.
+        :return EdgeArray of ordered and connected coordinate pairs
         """
-
-        greedy_connected = [[],[]]
-        queues = [(PriorityQueue()),(PriorityQueue())]
-        # priority queue is used to connect closest unconnected coordinates
-        # create two look ups for connected (self.connected)
-        # and unconnected (input data) coordinate sets
-        connected_coordinates = [{x.coordinate_id: x for x in self.tech1_connected},{x.coordinate_id: x for x in self.tech2_connected}]
-        unconnected_coordinates = {x.coordinate_id: x for x in data}
-        # create a source tracker
-        sources = [{x.coordinate_id: x.coordinate_id for x in self.tech1_connected},{x.coordinate_id: x.coordinate_id for x in self.tech2_connected}]
-        # add pairwise distances between all coordinates and in data to priority queue
-        queues[0] = self.queue_pairwise_distances(
-            queues[0], 0,data, self.tech1_connected, cache=self._tech1_cache.connected_cache
-        )
-        queues[1] = self.queue_pairwise_distances(
-            queues[1], 1,data, self.tech2_connected, cache=self._tech2_cache.connected_cache
+        connected_ids = set(x.coordinate_id for x in self.connected)
+        unique = {x.coordinate_id: x for x in data}
+        data = [x for cid, x in unique.items() if cid not in connected_ids]
+        offset = len(self.connected)
+        nodes = list(self.connected) + data
+        n_nodes = len(nodes)
+        connected = np.zeros(n_nodes, dtype=bool)
+        connected[:offset] = True
+        roots = list(range(offset)) + [-1] * len(data)
+        heap, known = [], {}
+        sequence = 0
+        model = VectorizedDistanceModel(
+            n_nearest_neighbors=self.n_nearest_neighbors,
+            maximum_distance=self.maximum_connection_length_m,
         )
+        idxs, distances = model.neighbors((data, self.connected))
+        for i, (parents, ds) in enumerate(zip(idxs, distances)):
+            for parent, d in zip(parents.tolist(), ds.tolist()):
+                if d < self.maximum_connection_length_m:
+                    heap.append((d, sequence, offset + i, parent))
+                    sequence += 1
+        heapq.heapify(heap)
+        if self.dynamic_connect:
+            reverse_offsets, reverse_nodes, reverse_distances = self._reverse_neighbors(data)
+        source, target, distance, root = [], [], [], []
         if self.progress_bar:
-            pbar = managed_progress_bar(len(data), description="Distance Connect Model")
-        while not queues[0].empty() and not queues[1].empty():
-            # iterate until priority queue is empty
-            if not queues[0].empty():
-                d1, candidate1 = queues[0].get()
-                if d1>self.distance_threshold:
-                    if not queues[1].empty():
-                        d,candidate = queues[1].get()
-                        queues[0].put((d1,candidate1))
-                        queue_index = 1
-                    else:
-                        candidate = candidate1
-                        queue_index = 0
-                else:
-                    candidate = candidate1
-                    queue_index = 0 
-            else:
-                d,candidate = queues[1].get()
-            id1, id2 = candidate.pair_ids
-            connected1, connected2 = (
-                id1 in connected_coordinates[0] or id1 in connected_coordinates[1],
-                id2 in connected_coordinates[0] or id2 in connected_coordinates[1],
-            )
-            if connected1 and connected2:
-                # if both items are connected skip, used to handle identical coordinates
-                # not needed if coordinates in connected and unconnected sets are unique
+            pbar = managed_progress_bar(len(data), description="Lazy Line of Sight Connect Model")
+        while len(heap) > 0:
+            d, _, child, parent = heap[0]
+            if connected[child]:
+                heapq.heappop(heap)
                 continue
-            elif connected2:
-                # coordinate 1 is not connected
-                # make new connection move from unconnected lookup to connected lookup
-                new_connection = move_item(
-                    unconnected_coordinates, connected_coordinates[queue_index], id1
-                )
-                # fetch for source use id2 if doesn't exist
-                if id2 == "metanode":
-                    candidate.coordinate1.properties["source"] = id1+"_meta"
-                    sources[queue_index][id1+"_meta"] = id1+"_meta"
-                    sources[queue_index][id1] = id1+"_meta"
-                    candidate.coordinate2 = UniqueCoordinate(coordinate_id=id1+"_meta",coordinate=candidate.coordinate1.coordinate)
-                    candidate.pair_ids = (id1,id1+"_meta")
-                else:
-                    candidate.coordinate1.properties["source"] = sources[queue_index][id2]
-                    sources[queue_index][id1] = sources[queue_index][id2]
-                greedy_connected[queue_index].append(candidate)
-                if self.progress_bar:
-                    pbar.update(1)
-                if self.dynamic_connect:
-                    # if other unconnected coordinates can connect to new connection
-                    queues[queue_index] = self.queue_pairwise_distances(
-                        queues[queue_index],
-                        queue_index,
-                        list(unconnected_coordinates.values()),
-                        [new_connection],
-                        cache=self._tech1_cache.unconnected_cache if queue_index==0 else self._tech2_cache.unconnected_cache,
-                    )
-            else:
-                # neither items are connected, skip
+            if (child, parent) not in known:
+                self._evaluate_top(heap, nodes, connected, known)
                 continue
-
-        
+            heapq.heappop(heap)
+            if not known[(child, parent)]:
+                continue
+            connected[child] = True
+            roots[child] = roots[parent]
+            source.append(parent)
+            target.append(child)
+            distance.append(d)
+            root.append(roots[child])
+            if self.progress_bar:
+                pbar.update(1)
+            if self.dynamic_connect:
+                i = child - offset
+                start, end = reverse_offsets[i], reverse_offsets[i + 1]
+                for j, dj in zip(
+                    reverse_nodes[start:end].tolist(), reverse_distances[start:end].tolist()
+                ):
+                    if not connected[offset + j] and dj < self.maximum_connection_length_m:
+                        heapq.heappush(heap, (dj, sequence, offset + j, child))
+                        sequence += 1
         if self.progress_bar:
             pbar.update(pbar.total - pbar.n)
             pbar.close()
-        return greedy_connected
+        return EdgeArray(CoordinateArray.from_coordinates(nodes), source, target, distance, root)
 
-    def run(self, data: List[UniqueCoordinate], **kwargs) -> List[PairwiseDistance]:
+    def run_meta(self, data: List[UniqueCoordinate], **kwargs) -> EdgeArray:
         """
         Connects a list of unconnected unique coordinates in the input to
         a set of connected unique coordinates until no more connections are possible
         if metanode, means that no fiber coordinates exist, treat differently
         param: data, a List[UniqueCoordinate] representing a collection of
                UniqueCoordinates that contain a unique identifier and a location (usually lat/lon)
-        :return list of PairwiseDistance objects which represent an ordered an connected coordinate pairs
+        :return EdgeArray of ordered and connected coordinate pairs
                 added to the set of connected coordinates in this model.
         """
+        return self.run(data, **kwargs)
 
-        connected_coordinates = [{x.coordinate_id: x for x in self.tech1_connected},{x.coordinate_id: x for x in self.tech2_connected}]
-        if "metanode" in connected_coordinates[0]: #For now meta only in fiber...
-            return self.run_meta(data)
-        
-        greedy_connected = [[],[]]
-        queues = [(PriorityQueue()),(PriorityQueue())]
-          # priority queue is used to connect closest unconnected coordinates
-        # create two look ups for connected (self.connected)
-        # and unconnected (input data) coordinate sets
-        
-        unconnected_coordinates = {x.coordinate_id: x for x in data}
-        # create a source tracker
-        sources = [{x.coordinate_id: x.coordinate_id for x in self.tech1_connected},{x.coordinate_id: x.coordinate_id for x in self.tech2_connected}]
+    def run(self, data: List[UniqueCoordinate], **kwargs) -> EdgeArray:
+        """
+        Connects a list of unconnected unique coordinates in the input to
+        a set of connected unique coordinates until no more connections are possible
+        if metanode, means that no fiber coordinates exist, treat differently
+        param: data, a List[UniqueCoordinate] representing a collection of
+               UniqueCoordinates that contain a unique identifier and a location (usually lat/lon)
+        :return EdgeArray of ordered and connected coordinate pairs
+                added to the set of connected coordinates in this model.
+        """
+        if self.line_of_sight is not None:
+            return self.run_lazy(data)
+        # nodes are the connected coordinates followed by the unconnected coordinates in data
+        connected_ids = set(x.coordinate_id for x in self.connected)
+        unique = {x.coordinate_id: x for x in data}
+        data = [x for cid, x in unique.items() if cid not in connected_ids]
+        offset = len(self.connected)
+        index = {x.coordinate_id: i for i, x in enumerate(self.connected)}
+        index.update({x.coordinate_id: offset + i for i, x in enumerate(data)})
+        n_nodes = offset + len(data)
+        dense = self._use_dense()
+        if dense:
+            radians = CoordinateArray.from_coordinates(data).radians
+            radius_index = self._radius_index(radians)
+            # with a radius index only a few candidates change per step, which suits the heap
+            if radius_index is None:
+                queue = DenseDistanceQueue(n_nodes)
+            else:
+                queue = DistanceQueue(n_nodes)
+        else:
+            queue = DistanceQueue(n_nodes)
+        compiled_cache = None if dense else self._compiled_unconnected_cache(index)
+        unconnected = np.ones(n_nodes, dtype=bool)
+        unconnected[:offset] = False
+        # create a root tracker, connected nodes are their own root
+        roots = list(range(offset)) + [-1] * len(data)
+        for i in range(offset):
+            queue.connect(i)
+        meta_node = index.get("metanode", None)
+        meta_nodes = []
+        source, target, distance, root = [], [], [], []
         # add pairwise distances between all coordinates and in data to priority queue
-        queues[0] = self.queue_pairwise_distances(
-            queues[0], 0,data, self.tech1_connected, cache=self._tech1_cache.connected_cache
-        )
-        queues[1] = self.queue_pairwise_distances(
-            queues[1], 1,data, self.tech2_connected, cache=self._tech2_cache.connected_cache
+        self._queue_distances(
+            queue,
+            index,
+            self.pairwise_distances(
+                data, self.connected, cache=self._cache.connected_cache
+            ),
         )
         if self.progress_bar:
             pbar = managed_progress_bar(len(data), description="Distance Connect Model")
-        while not queues[0].empty() or not queues[1].empty():
-            # iterate until priority queue is empty
-            if not queues[0].empty():
-                d1, candidate1 = queues[0].get()
-                if d1>self.distance_threshold:
-                    if not queues[1].empty():
-                        d,candidate = queues[1].get()
-                        queues[0].put((d1,candidate1))
-                        queue_index = 1
-                    else:
-                        candidate = candidate1
-                        queue_index = 0
-                else:
-                    candidate = candidate1
-                    queue_index = 0 
-            else:
-                d,candidate = queues[1].get()
-            
-            id1, id2 = candidate.pair_ids
-            connected1, connected2 = (
-                id1 in connected_coordinates[0] or id1 in connected_coordinates[1],
-                id2 in connected_coordinates[0] or id2 in connected_coordinates[1],
-            )
-            if connected1 and connected2:
-                # if both items are connected skip, used to handle identical coordinates
-                # not needed if coordinates in connected and unconnected sets are unique
-                continue
-            elif connected2:
-                # coordinate 1 is not connected
-                # make new connection move from unconnected lookup to connected lookup
-                new_connection = move_item(
-                    unconnected_coordinates, connected_coordinates[queue_index], id1
-                )
-                # fetch for source use id2 if doesn't exist
-                candidate.coordinate1.properties["source"] = sources[queue_index][id2]
-                sources[queue_index][id1] = sources[queue_index][id2]
-                greedy_connected[queue_index].append(candidate)
-                if self.progress_bar:
-                    pbar.update(1)
-                if self.dynamic_connect:
-                    # if other unconnected coordinates can connect to new connection
-                    queues[queue_index] = self.queue_pairwise_distances(
-                        queues[queue_index],
-                        queue_index,
-                        list(unconnected_coordinates.values()),
-                        [new_connection],
-                        cache=self._tech1_cache.unconnected_cache if queue_index==0 else self._tech2_cache.unconnected_cache,
+        while True:
+            # iterate until no more connections are possible
+            candidate = queue.pop()  # fetch coordinate pair with closest distance
+            if candidate is None:
+                break
+            child, parent, d = candidate
+            queue.connect(child)
+            unconnected[child] = False
+            if parent == meta_node:
+                # schools connected to the metanode become the root of their own cluster
+                new_connection = data[child - offset]
+                meta_id = new_connection.coordinate_id + "_meta"
+                meta_nodes.append(
+                    UniqueCoordinate(
+                        coordinate_id=meta_id, coordinate=new_connection.coordinate
                     )
+                )
+                parent = n_nodes + len(meta_nodes) - 1
+                roots[child] = parent
             else:
-                # neither items are connected, skip
-                continue
+                roots[child] = roots[parent]
+            source.append(parent)
+            target.append(child)
+            distance.append(d)
+            root.append(roots[child])
+            if self.progress_bar:
+                pbar.update(1)
+            if dense:
+                self._queue_dense(queue, radians, offset, child, radius_index)
+            elif compiled_cache is not None:
+                nodes, distances = self._cached_neighbors(
+                    compiled_cache, unconnected, data[child - offset].coordinate_id
+                )
+                queue.add_array(nodes, child, distances)
+            elif self.dynamic_connect:
+                # if other unconnected coordinates can connect to new connection
+                self._queue_distances(
+                    queue,
+                    index,
+                    self.pairwise_distances(
+                        self._unconnected(queue, data, offset),
+                        [data[child - offset]],
+                        cache=self._cache.unconnected_cache,
+                    ),
+                )
 
         if self.progress_bar:
             pbar.update(pbar.total - pbar.n)
             pbar.close()
-        return greedy_connected
+        nodes = CoordinateArray.from_coordinates(
+            list(self.connected) + data + meta_nodes
+        )
+        return EdgeArray(nodes, source, target, distance, root)
@@ -1,8 +1,14 @@
 from typing import List, Tuple
-from haversine import haversine
+import numpy as np
+from haversine import haversine, haversine_vector, Unit
 from pydantic import validate_arguments
+from sklearn.neighbors import BallTree
 
-from giga.schemas.geo import UniqueCoordinate, PairwiseDistance
+from giga.schemas.geo import (
+    PairwiseDistance,
+    CoordinateArray,
+    CoordinateSet,
+)
 from giga.utils.progress_bar import progress_bar
 
 
@@ -10,21 +16,42 @@ def DEFAULT_DISTANCE_FN(x, y) -> float:
     return haversine(x, y, unit="m")
 
 
+def nearest_targets(coordinates: np.ndarray, targets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the nearest target of every coordinate with a haversine BallTree over the targets,
+    when several targets share a location the first one is returned, as a scan in target order would
+    :param coordinates, an (n x 2) array of lat/lon values, targets an (m x 2) array of lat/lon values
+    :return a tuple of arrays with the index of the nearest target and its distance in meters,
+            distances are computed with the same haversine formula as DEFAULT_DISTANCE_FN
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    targets = np.asarray(targets, dtype=np.float64).reshape(-1, 2)
+    if len(coordinates) == 0 or len(targets) == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0)
+    _, first = np.unique(targets, axis=0, return_index=True)
+    first = np.sort(first)
+    tree = BallTree(np.radians(targets[first]), metric="haversine")
+    _, idxs = tree.query(np.radians(coordinates), k=1)
+    nearest = first[idxs[:, 0]]
+    distances = haversine_vector(coordinates, targets[nearest], unit=Unit.METERS)
+    return nearest, np.asarray(distances, dtype=np.float64)
+
+
 class PairwiseDistanceModel:
     """
     Computes pairwise distances between two coordinate sets.
     Allows a custom distance function to be passed into the model, defaulted to haversine
+    Coordinate sets can be passed as lists of UniqueCoordinate objects or as a columnar CoordinateArray.
     """
 
     def __init__(self, **kwargs):
         self.distance_fn = kwargs.get("distance_fn", DEFAULT_DISTANCE_FN)
         self.progress_bar = kwargs.get("progress_bar", False)
 
-    @validate_arguments
-    def run_matrix(
-        self, data: List[UniqueCoordinate], **kwargs
-    ) -> List[PairwiseDistance]:
+    @validate_arguments(config=dict(arbitrary_types_allowed=True))
+    def run_matrix(self, data: CoordinateSet, **kwargs) -> List[PairwiseDistance]:
         # TODO: this could be moved into a separate model in a future refactor
+        data = CoordinateArray.from_coordinates(data).to_coordinates()
         pairs = []
         iterable = progress_bar(data) if self.progress_bar else data
         for i, c1 in enumerate(iterable):
@@ -40,16 +67,17 @@ class PairwiseDistanceModel:
                 )
         return pairs
 
-    @validate_arguments
+    @validate_arguments(config=dict(arbitrary_types_allowed=True))
     def run(
-        self, data: Tuple[List[UniqueCoordinate], List[UniqueCoordinate]], **kwargs
+        self, data: Tuple[CoordinateSet, CoordinateSet], **kwargs
     ) -> List[PairwiseDistance]:
         """
         Runs the model that computes the pairwise distances between the coordinate sets passed into the method
         :param data, a tuple with two coordinate sets in it
         :return a list of pairwise distance objects
         """
-        set1, set2 = data
+        set1, set2 = map(CoordinateArray.from_coordinates, data)
+        set2 = set2.to_coordinates()
         pairs = []
         iterable = progress_bar(set1) if self.progress_bar else set1
         for i, c1 in enumerate(iterable):
@@ -1,120 +1,477 @@
 from typing import List, Tuple
+import os
+import multiprocessing
+from multiprocessing import shared_memory
 from pydantic import validate_arguments
 from sklearn.metrics.pairwise import haversine_distances
-from math import radians
+from sklearn.neighbors import BallTree
 import math
 import numpy as np
 
-from giga.schemas.geo import UniqueCoordinate, PairwiseDistance
+from giga.schemas.geo import (
+    PairwiseDistance,
+    CoordinateArray,
+    CoordinateSet,
+)
 from giga.utils.progress_bar import progress_bar as pb
 
 
 RADIUS_EARTH_M = 6371000.0
 DEFAULT_N_CHUNKS = 500
+# number of pairwise entries (len(set1) x len(set2)) above which the index is used
+DEFAULT_TREE_THRESHOLD = 10_000_000
+DEFAULT_LEAF_SIZE = 40
+BACKENDS = ("auto", "matrix", "tree")
+# fraction of the available memory a single distance matrix chunk may use in auto mode
+DEFAULT_MEMORY_FRACTION = 0.25
+# used when the available memory cannot be determined
+DEFAULT_MAX_BYTES = 1 << 30
+# per entry the kernel holds the distance matrix plus an index array of the same shape
+BYTES_PER_ENTRY = np.dtype(np.float64).itemsize + np.dtype(np.intp).itemsize
+# minimum number of chunks handed to each worker when running in parallel
+CHUNKS_PER_WORKER = 4
+
+
+def available_memory_bytes() -> int:
+    """Best effort estimate of the memory available to this process"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return DEFAULT_MAX_BYTES
+
+
+def closest_neighbors(distances, n_nearest_neighbors):
+    """
+    Reduces a distance matrix to the n nearest neighbors of each row with a partition
+    :return a tuple of (n x k) arrays of neighbor indices and distances, neighbors are
+      sorted by distance, the indices are None if every column is returned
+    """
+    n_targets = distances.shape[1]
+    if n_nearest_neighbors >= n_targets:
+        return None, distances
+    k = int(n_nearest_neighbors)
+    idxs = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    closest = np.take_along_axis(distances, idxs, axis=1)
+    # order the k neighbors by distance, ties broken by target index
+    order = np.lexsort((idxs, closest), axis=1)
+    return (
+        np.take_along_axis(idxs, order, axis=1),
+        np.take_along_axis(closest, order, axis=1),
+    )
+
+
+def distance_kernel(radians1, radians2, n_nearest_neighbors):
+    # haversine distances in meters between two sets of radian coordinates, reduced to
+    # the nearest neighbors
+    distances = haversine_distances(radians1, radians2)
+    distances *= RADIUS_EARTH_M
+    return closest_neighbors(distances, n_nearest_neighbors)
+
+
+def query_tree(tree, vecs, n_nearest_neighbors, maximum_distance, n_targets):
+    """
+    Queries a spatial index for the nearest neighbors or all neighbors within the
+    maximum distance
+    :return a tuple of lists of neighbor indices and distances in meters, one entry per
+      row in vecs
+    """
+    if n_nearest_neighbors < n_targets:
+        distances, idxs = tree.query(vecs, k=int(n_nearest_neighbors))
+        distances = distances * RADIUS_EARTH_M
+        keep = distances <= maximum_distance
+        return (
+            [row[k] for row, k in zip(idxs, keep)],
+            [row[k] for row, k in zip(distances, keep)],
+        )
+    idxs, distances = tree.query_radius(
+        vecs,
+        r=maximum_distance / RADIUS_EARTH_M,
+        return_distance=True,
+        sort_results=True,
+    )
+    return list(idxs), [d * RADIUS_EARTH_M for d in distances]
+
+
+# state of a chunk worker process, target coordinates are attached from shared memory
+_WORKER_STATE = {}
+
+
+def _init_chunk_worker(
+    shm_name, shape, n_nearest_neighbors, maximum_distance=math.inf, leaf_size=None
+):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _WORKER_STATE["shm"] = shm  # keep a reference so the buffer stays mapped
+    _WORKER_STATE["targets"] = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    _WORKER_STATE["n_nearest_neighbors"] = n_nearest_neighbors
+    _WORKER_STATE["maximum_distance"] = maximum_distance
+    # tree workers build their own spatial index over the shared targets once
+    _WORKER_STATE["tree"] = (
+        None
+        if leaf_size is None
+        else BallTree(_WORKER_STATE["targets"], leaf_size=leaf_size, metric="haversine")
+    )
+
+
+def _run_chunk_worker(radians):
+    return distance_kernel(
+        radians, _WORKER_STATE["targets"], _WORKER_STATE["n_nearest_neighbors"]
+    )
+
+
+def _run_tree_worker(radians):
+    return query_tree(
+        _WORKER_STATE["tree"],
+        radians,
+        _WORKER_STATE["n_nearest_neighbors"],
+        _WORKER_STATE["maximum_distance"],
+        len(_WORKER_STATE["targets"]),
+    )
 
 
 class VectorizedDistanceModel:
     """
     This model uses sklearn's haversine_distances function to compute pairwise distances
-    between two sets of coordinates. It is significantly more performant than the PairwiseDistanceModel
-    but requires that the coordinates be converted to radians first.
+    between two sets of coordinates. It is significantly more performant than the
+    PairwiseDistanceModel but requires that the coordinates be converted to radians
+    first. For large inputs that are bounded by n_nearest_neighbors or maximum_distance,
+    a BallTree spatial index with a haversine metric is used to answer nearest neighbor
+    and radius queries directly, without building the full distance matrix. Distance
+    matrices are computed in chunks of the first set sized to a memory budget
+    (max_bytes), which defaults to a fraction of the memory available. Coordinate sets
+    can be passed as lists of UniqueCoordinate objects or as a columnar CoordinateArray.
     """
 
     def __init__(self, **kwargs):
         self.progress_bar = kwargs.get("progress_bar", False)
         self.n_nearest_neighbors = kwargs.get("n_nearest_neighbors", math.inf)
         self.maximum_distance = kwargs.get("maximum_distance", math.inf)
+        # one of "auto", "matrix" or "tree", auto selects the backend by input size
+        self.backend = kwargs.get("backend", "auto")
+        self.tree_threshold = kwargs.get("tree_threshold", DEFAULT_TREE_THRESHOLD)
+        self.leaf_size = kwargs.get("leaf_size", DEFAULT_LEAF_SIZE)
+        # memory budget of a single distance matrix chunk in bytes, "auto" sizes it from
+        # the available memory and None falls back to a fixed number of chunks
+        self.max_bytes = kwargs.get("max_bytes", "auto")
+        # number of processes used to compute distance matrix chunks or spatial index
+        # queries in parallel
+        self.n_workers = kwargs.get("n_workers", 1)
+        self._resolved_max_bytes = None
+        assert self.backend in BACKENDS, f"Unsupported distance backend {self.backend}"
 
-    def _to_radian_vector(self, coordinates: List[UniqueCoordinate]):
+    def _to_radian_vector(self, coordinates: CoordinateSet):
         # convert to an (n x 2) array of radians
-        return np.array(
-            [[radians(c.coordinate[0]), radians(c.coordinate[1])] for c in coordinates]
+        return CoordinateArray.from_coordinates(coordinates).radians
+
+    def _expand_neighbors(self, idxs, closest):
+        # kernels return no indices when every target is a neighbor, expand them
+        if idxs is None:
+            idxs = np.broadcast_to(np.arange(closest.shape[1]), closest.shape)
+        return idxs, closest
+
+    def _max_bytes(self):
+        if self.max_bytes == "auto":
+            # the available memory is read once per model, not on every run
+            if self._resolved_max_bytes is None:
+                self._resolved_max_bytes = int(
+                    available_memory_bytes() * DEFAULT_MEMORY_FRACTION
+                )
+            return self._resolved_max_bytes
+        return self.max_bytes
+
+    def _chunk_size(self, n_sources, n_targets, **kwargs):
+        # number of rows of the first set processed per distance matrix
+        max_bytes = self._max_bytes()
+        if "n_chunks" in kwargs or max_bytes is None:
+            n_chunks = kwargs.get("n_chunks", DEFAULT_N_CHUNKS)
+            return max(1, math.ceil(n_sources / n_chunks))
+        # the budget is shared by all the workers holding a chunk at the same time
+        n_workers = kwargs.get("n_workers", self.n_workers)
+        rows = max_bytes // (max(n_targets, 1) * BYTES_PER_ENTRY * max(n_workers, 1))
+        if n_workers > 1:
+            # split the work into enough chunks to keep every worker busy
+            rows = min(rows, math.ceil(n_sources / (n_workers * CHUNKS_PER_WORKER)))
+        return int(min(max(rows, 1), max(n_sources, 1)))
+
+    def _is_bounded(self, n_targets):
+        # the spatial index only helps if not every target is returned for each source
+        return self.n_nearest_neighbors < n_targets or self.maximum_distance < math.inf
+
+    def _use_tree(self, n_sources, n_targets):
+        if self.backend == "tree":
+            return self._is_bounded(n_targets)
+        elif self.backend == "matrix":
+            return False
+        return (
+            self._is_bounded(n_targets) and n_sources * n_targets >= self.tree_threshold
         )
 
-    def _get_closest(self, ordered_distances, coordinates):
-        # return the n nearest neighbors and their distances
-        if self.n_nearest_neighbors >= len(coordinates):
-            return coordinates, ordered_distances
-        idxs = np.argsort(ordered_distances)[: self.n_nearest_neighbors]
-        return np.array(coordinates)[idxs], ordered_distances[idxs]
+    def _query_tree(self, tree, vecs, n_targets):
+        """
+        Queries the spatial index for the nearest neighbors or all neighbors within the
+        maximum distance
+        :return a tuple of lists of neighbor indices and distances in meters, one entry
+          per row in vecs
+        """
+        return query_tree(
+            tree, vecs, self.n_nearest_neighbors, self.maximum_distance, n_targets
+        )
 
-    @validate_arguments
+    def _query_tree_chunks(self, chunks, set2, n_workers):
+        """
+        Queries a spatial index over the second set for each chunk of the first set,
+        in a process pool if more than one worker is used
+        :return a generator of (indices, distances) tuples in chunk order
+        """
+        if n_workers > 1 and len(chunks) > 1:
+            return self._map_chunks_parallel(
+                chunks, set2, min(n_workers, len(chunks)), tree=True
+            )
+        tree = BallTree(set2.radians, leaf_size=self.leaf_size, metric="haversine")
+        return (self._query_tree(tree, c.radians, len(set2)) for c in chunks)
+
+    def distance_vector(self, radians: np.ndarray, target: np.ndarray) -> np.ndarray:
+        """
+        Computes the distances from every row of an (n x 2) radian array to a single
+        target in radians, used by dense connectors that update all candidates of a new
+        connection at once
+        :return an array of n distances in meters, distances over the maximum distance
+          are set to inf
+        """
+        distances = haversine_distances(radians, np.reshape(target, (1, 2)))[:, 0]
+        distances *= RADIUS_EARTH_M
+        distances[distances > self.maximum_distance] = np.inf
+        return distances
+
+    def _to_pairs(self, set1, set2, idxs, distances, progress_bar=False):
+        # materialize neighbor indices into pairwise distance objects
+        pairs = []
+        rows = range(len(set1))
+        iterable = pb(rows) if progress_bar else rows
+        for i in iterable:
+            c1 = set1.coordinate(i)
+            for j, d in zip(idxs[i], distances[i]):
+                if d > self.maximum_distance:
+                    continue
+                c2 = set2.coordinate(j)
+                pairs.append(
+                    PairwiseDistance(
+                        pair_ids=(c1.coordinate_id, c2.coordinate_id),
+                        coordinate1=c1,
+                        coordinate2=c2,
+                        distance=d,
+                    )
+                )
+        return pairs
+
+    def _run_tree(
+        self, data: Tuple[CoordinateSet, CoordinateSet], **kwargs
+    ) -> List[PairwiseDistance]:
+        """
+        This method computes the distances between two sets of coordinates using a
+        BallTree built over the second set, with a haversine metric. Only the n nearest
+        neighbors and/or neighbors under the maximum distance are returned.
+
+        :param data, a tuple of two coordinate sets
+        :return a list of PairwiseDistance objects representing the distances between
+          the two coordinate datasets
+        """
+        set1, set2 = map(CoordinateArray.from_coordinates, data)
+        if len(set1) == 0 or len(set2) == 0:
+            return []
+        n_workers = kwargs.get("n_workers", self.n_workers)
+        n_chunks = kwargs.get("n_chunks", DEFAULT_N_CHUNKS)
+        if n_workers > 1:
+            n_chunks = max(n_chunks, n_workers * CHUNKS_PER_WORKER)
+        n_chunks = min(n_chunks, len(set1))
+        progress_bar = kwargs.get("progress_bar", self.progress_bar)
+        chunk_size = math.ceil(len(set1) / n_chunks)
+        chunks = [
+            set1[start : start + chunk_size]
+            for start in range(0, len(set1), chunk_size)
+        ]
+        results = self._query_tree_chunks(chunks, set2, n_workers)
+        iterable = pb(chunks) if progress_bar else chunks
+        pairs = []
+        for chunk, (idxs, distances) in zip(iterable, results):
+            pairs.extend(self._to_pairs(chunk, set2, idxs, distances))
+        return pairs
+
+    @validate_arguments(config=dict(arbitrary_types_allowed=True))
     def _run_single_matrix(
-        self, data: Tuple[List[UniqueCoordinate], List[UniqueCoordinate]], **kwargs
+        self, data: Tuple[CoordinateSet, CoordinateSet], **kwargs
     ) -> List[PairwiseDistance]:
         """
-        This method computes pairwise distances between two sets of coordinates
-        using sklearn's haversine_distances function. It returns a list of PairwiseDistance objects.
+        This method computes pairwise distances between two sets of coordinates using
+        sklearn's haversine_distances function. It returns a list of PairwiseDistance
+        objects.
 
-        :param data, a tuple of two lists of UniqueCoordinate objects
-        :return a list of PairwiseDistance objects representing the distances between the two coordinate datasets
+        :param data, a tuple of two coordinate sets
+        :return a list of PairwiseDistance objects representing the distances between
+          the two coordinate datasets
         """
         progress_bar = kwargs.get("progress_bar", self.progress_bar)
-        set1, set2 = data
+        set1, set2 = map(CoordinateArray.from_coordinates, data)
         # return empty list if either set is empty
         if len(set1) == 0 or len(set2) == 0:
             return []
-        # convert to vectors
-        vecs1, vecs2 = self._to_radian_vector(set1), self._to_radian_vector(set2)
-        distances = haversine_distances(vecs1, vecs2) * RADIUS_EARTH_M
-        # return distances
-        pairs = []
-        iterable = pb(set1) if progress_bar else set1
-        for i, c1 in enumerate(iterable):
-            closest_coords, closest_dist = self._get_closest(distances[i], set2)
-            for j, c2 in enumerate(closest_coords):
-                if closest_dist[j] > self.maximum_distance:
-                    # check the maximum distance threshold, skip if exceeded
-                    continue
-                else:
-                    pairs.append(
-                        PairwiseDistance(
-                            pair_ids=(c1.coordinate_id, c2.coordinate_id),
-                            coordinate1=c1,
-                            coordinate2=c2,
-                            distance=closest_dist[j],
-                        )
-                    )
-        return pairs
+        idxs, closest = self._expand_neighbors(
+            *distance_kernel(set1.radians, set2.radians, self.n_nearest_neighbors)
+        )
+        return self._to_pairs(set1, set2, idxs, closest, progress_bar=progress_bar)
 
-    @validate_arguments
+    @validate_arguments(config=dict(arbitrary_types_allowed=True))
     def run_chunks(
-        self, data: Tuple[List[UniqueCoordinate], List[UniqueCoordinate]], **kwargs
+        self, data: Tuple[CoordinateSet, CoordinateSet], **kwargs
     ) -> List[PairwiseDistance]:
         """
-        This method computes pairwise distances between two sets of coordinates
-        by slicing up the first set into smaller chunks. It returns a list of PairwiseDistance objects.
+        This method computes pairwise distances between two sets of coordinates by
+        slicing up the first set into smaller chunks. It returns a list of
+        PairwiseDistance objects. Chunks are sized so that a single distance matrix fits
+        in the max_bytes memory budget, passing n_chunks explicitly splits the first set
+        into a fixed number of chunks instead. If the spatial index backend is selected,
+        the index is built once and queried chunk by chunk.
 
-        :param data, a tuple of two lists of UniqueCoordinate objects
-        :return a list of PairwiseDistance objects representing the distances between the two coordinate datasets
+        :param data, a tuple of two coordinate sets
+        :return a list of PairwiseDistance objects representing the distances between
+          the two coordinate datasets
         """
-        set1, set2 = data
-        n_chunks = kwargs.get("n_chunks", DEFAULT_N_CHUNKS)
-        chunk_size = math.ceil(len(set1) / n_chunks)
+        set1, set2 = map(CoordinateArray.from_coordinates, data)
+        if self._use_tree(len(set1), len(set2)):
+            return self._run_tree((set1, set2), **kwargs)
+        chunk_size = self._chunk_size(len(set1), len(set2), **kwargs)
+        n_chunks = math.ceil(len(set1) / chunk_size)
+        n_workers = min(kwargs.get("n_workers", self.n_workers), n_chunks)
+        progress_bar = kwargs.get("progress_bar", self.progress_bar)
+        if len(set2) == 0:
+            return []
+        chunks = [set1[i * chunk_size : (i + 1) * chunk_size] for i in range(n_chunks)]
+        if n_workers > 1:
+            results = self._map_chunks_parallel(chunks, set2, n_workers)
+        else:
+            results = (
+                distance_kernel(c.radians, set2.radians, self.n_nearest_neighbors)
+                for c in chunks
+            )
+        iterable = pb(range(n_chunks)) if progress_bar else range(n_chunks)
+        # results are consumed in chunk order so the output matches a serial run
         pairs = []
-        iterable = pb(range(n_chunks)) if self.progress_bar else range(n_chunks)
-        for i in iterable:
-            start = i * chunk_size
-            end = start + chunk_size
-            if len(set1[start:end]) == 0:
-                # skip empty chunks (usually the last chunk if len(set1) % n_chunks != 0)
-                continue
-            pairs.extend(self.run((set1[start:end], set2), progress_bar=False))
+        for i, result in zip(iterable, results):
+            idxs, closest = self._expand_neighbors(*result)
+            pairs.extend(self._to_pairs(chunks[i], set2, idxs, closest))
         return pairs
 
-    @validate_arguments
+    def _map_chunks_parallel(self, chunks, set2, n_workers, tree=False):
+        """
+        Computes the nearest neighbors of each chunk in a process pool, the target
+        coordinates are placed in shared memory once instead of being sent with every
+        chunk
+        :param tree, whether the workers query a spatial index over the targets instead
+          of computing distance matrices
+        :return a generator of (indices, distances) tuples in chunk order
+        """
+        targets = np.ascontiguousarray(set2.radians, dtype=np.float64)
+        shm = shared_memory.SharedMemory(create=True, size=max(targets.nbytes, 1))
+        try:
+            np.ndarray(targets.shape, dtype=np.float64, buffer=shm.buf)[:] = targets
+            with multiprocessing.Pool(
+                n_workers,
+                initializer=_init_chunk_worker,
+                initargs=(
+                    shm.name,
+                    targets.shape,
+                    self.n_nearest_neighbors,
+                    self.maximum_distance,
+                    self.leaf_size if tree else None,
+                ),
+            ) as pool:
+                worker = _run_tree_worker if tree else _run_chunk_worker
+                yield from pool.imap(worker, (c.radians for c in chunks))
+        finally:
+            shm.close()
+            shm.unlink()
+
+    @validate_arguments(config=dict(arbitrary_types_allowed=True))
     def run(
-        self, data: Tuple[List[UniqueCoordinate], List[UniqueCoordinate]], **kwargs
+        self, data: Tuple[CoordinateSet, CoordinateSet], **kwargs
     ) -> List[PairwiseDistance]:
         """
-        This method computes pairwise distances between two sets of coordinates
-        and wraps the run chunks method if the first set of coordinates is too large
-        to be processed in a single matrix.
-        It will break the first set of coordinates into smaller chunks and process them
-        by default, but this behavior can be disabled by setting the n_chunks parameter to 1.
+        This method computes pairwise distances between two sets of coordinates and
+        wraps the run chunks method if the first set of coordinates is too large to be
+        processed in a single matrix. It will break the first set of coordinates into
+        chunks that fit the memory budget by default, but this behavior can be disabled
+        by setting the n_chunks parameter to 1. Large inputs bounded by
+        n_nearest_neighbors or maximum_distance are answered with a spatial index, this
+        can be controlled with the backend parameter ("auto", "matrix" or "tree").
         """
         set1, set2 = data
-        if len(set1) > DEFAULT_N_CHUNKS:
+        if self._use_tree(len(set1), len(set2)):
+            return self._run_tree(data, **kwargs)
+        elif self._chunk_size(len(set1), len(set2), **kwargs) < len(set1):
+            # also covers parallel runs, which always split the first set
             return self.run_chunks(data, **kwargs)
         else:
             return self._run_single_matrix(data, **kwargs)
+
+    def neighbors(
+        self, data: Tuple[CoordinateSet, CoordinateSet], **kwargs
+    ) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """
+        Computes the nearest neighbors of every coordinate of the first set in the
+        second set like run does, without materializing PairwiseDistance objects, so
+        that the neighbors can be shared by several caches
+
+        :param data, a tuple of two coordinate sets
+        :return a tuple of two lists with, for each coordinate of the first set, an
+          array of neighbor rows in the second set and an array of distances in meters
+          sorted by distance, neighbors over the maximum distance are left out
+        """
+        set1, set2 = map(CoordinateArray.from_coordinates, data)
+        if len(set1) == 0 or len(set2) == 0:
+            empty = (np.empty(0, dtype=np.intp), np.empty(0))
+            return [empty[0]] * len(set1), [empty[1]] * len(set1)
+        if self._use_tree(len(set1), len(set2)):
+            n_workers = kwargs.get("n_workers", self.n_workers)
+            if n_workers <= 1:
+                tree = BallTree(
+                    set2.radians, leaf_size=self.leaf_size, metric="haversine"
+                )
+                return self._query_tree(tree, set1.radians, len(set2))
+            chunk_size = math.ceil(len(set1) / (n_workers * CHUNKS_PER_WORKER))
+            chunks = [
+                set1[start : start + chunk_size]
+                for start in range(0, len(set1), chunk_size)
+            ]
+            idxs, distances = [], []
+            for chunk_idxs, chunk_distances in self._query_tree_chunks(
+                chunks, set2, n_workers
+            ):
+                idxs.extend(chunk_idxs)
+                distances.extend(chunk_distances)
+            return idxs, distances
+        chunk_size = self._chunk_size(
+            len(set1), len(set2), **{**kwargs, "n_workers": 1}
+        )
+        idxs, distances = [], []
+        for start in range(0, len(set1), chunk_size):
+            chunk_idxs, closest = self._expand_neighbors(
+                *distance_kernel(
+                    set1.radians[start : start + chunk_size],
+                    set2.radians,
+                    self.n_nearest_neighbors,
+                )
+            )
+            # every target is returned unordered when the neighbors are not bounded
+            order = np.argsort(closest, axis=1, kind="stable")
+            chunk_idxs = np.take_along_axis(chunk_idxs, order, axis=1)
+            closest = np.take_along_axis(closest, order, axis=1)
+            keep = closest <= self.maximum_distance
+            idxs.extend(row[k] for row, k in zip(chunk_idxs, keep))
+            distances.extend(row[k] for row, k in zip(closest, keep))
+        return idxs, distances
@@ -0,0 +1,158 @@
+import os
+import math
+import hashlib
+from pydantic import BaseModel
+from typing import Dict, Any, List, Optional
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from giga.data.store.stores import COUNTRY_DATA_STORE as data_store
+from giga.utils.globals import CACHE_STORE_DIR
+from giga.utils.logging import LOGGER
+
+
+# bump to invalidate every stored cache when the builders change the way caches are computed
+CACHE_BUILDER_VERSION = 1
+CACHE_MANIFEST_FILE = "manifest.json"
+# the manifest of a published cache is stored next to it, e.g. fiber_cache.manifest.json
+CACHE_MANIFEST_SUFFIX = ".manifest.json"
+# number of fingerprint characters used in the name of a cache store directory
+FINGERPRINT_PREFIX_LENGTH = 16
+HASH_CHUNK_BYTES = 1 << 20
+
+# file hashes keyed by path and invalidated by the version of the file in the data store,
+# its size and modification time or the etag, size and modification time of a blob
+_HASHES = {}
+
+
+def file_sha256(path: str) -> Optional[str]:
+    """SHA-256 digest of the contents of a file in the data store, None if the file does not exist"""
+    key = data_store.file_version(path)
+    if key is None:
+        return None
+    if path in _HASHES and _HASHES[path][0] == key:
+        return _HASHES[path][1]
+    digest = hashlib.sha256()
+    with data_store.open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    digest = digest.hexdigest()
+    _HASHES[path] = (key, digest)
+    return digest
+
+
+def _canonical_parameter(value):
+    # non finite numbers are stored as strings so that the manifest stays valid JSON
+    if isinstance(value, float) and not math.isfinite(value):
+        return str(value)
+    return value
+
+
+def cache_manifest_path(file: str) -> str:
+    """Path of the manifest of a published cache file"""
+    return os.path.splitext(file)[0] + CACHE_MANIFEST_SUFFIX
+
+
+class CacheManifest(BaseModel):
+    """
+    Identifies a distance cache by the contents of the input files and the builder parameters that produced it.
+    The fingerprint of the manifest addresses the cache in the cache store of a workspace.
+    """
+
+    cache: str
+    inputs: Dict[str, Optional[str]]
+    parameters: Dict[str, Any] = {}
+    version: int = CACHE_BUILDER_VERSION
+    created: str = None
+
+    @staticmethod
+    def from_workspace(workspace: str, cache: str, input_files: List[str], **parameters) -> "CacheManifest":
+        """
+        Creates the manifest of a cache built from input files in a workspace
+        :param cache, the name of the cache, e.g. fiber_cache
+        :param input_files, the names of the input files in the workspace
+        :param parameters, the builder parameters that affect the contents of the cache
+        """
+        return CacheManifest(
+            cache=cache,
+            inputs={f: file_sha256(os.path.join(workspace, f)) for f in input_files},
+            parameters={k: _canonical_parameter(v) for k, v in parameters.items()},
+        )
+
+    @property
+    def fingerprint(self) -> str:
+        key = json.dumps(
+            {
+                "cache": self.cache,
+                "inputs": self.inputs,
+                "parameters": self.parameters,
+                "version": self.version,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def matches_inputs(self, workspace: str) -> bool:
+        """True if the input files in the workspace still have the contents the cache was built from"""
+        return self.version == CACHE_BUILDER_VERSION and all(
+            file_sha256(os.path.join(workspace, f)) == h for f, h in self.inputs.items()
+        )
+
+    def store_directory(self, workspace: str) -> str:
+        return os.path.join(
+            workspace,
+            CACHE_STORE_DIR,
+            f"{self.cache}-{self.fingerprint[:FINGERPRINT_PREFIX_LENGTH]}",
+        )
+
+    def save(self, file: str):
+        with data_store.open(file, "w") as f:
+            json.dump({**self.dict(), "fingerprint": self.fingerprint}, f)
+
+    @staticmethod
+    def load(file: str) -> Optional["CacheManifest"]:
+        if not data_store.file_exists(file):
+            return None
+        with data_store.open(file, "r") as f:
+            d = json.load(f)
+        d.pop("fingerprint", None)
+        return CacheManifest(**d)
+
+
+def published_manifest(workspace: str, file: str) -> Optional[CacheManifest]:
+    """Manifest of the cache published under a file name in the workspace, None for caches without one"""
+    return CacheManifest.load(cache_manifest_path(os.path.join(workspace, file)))
+
+
+def check_published_cache(workspace: str, file: str) -> bool:
+    """
+    Checks that a published cache was built from the current input files of the workspace,
+    caches without a manifest cannot be checked and are accepted
+    """
+    manifest = published_manifest(workspace, file)
+    if manifest is None or manifest.matches_inputs(workspace):
+        return True
+    LOGGER.warning(
+        f"Refusing to load {file} in {workspace}, it was built from different input files or builder version"
+    )
+    return False
+
+
+def clear_published_manifest(workspace: str, file: str):
+    """Removes the manifest of a published cache whose contents no longer match it"""
+    path = cache_manifest_path(os.path.join(workspace, file))
+    if data_store.file_exists(path):
+        data_store.remove(path)
+
+
+def is_published(workspace: str, file: str, manifest: CacheManifest) -> bool:
+    """True if the cache published under the file name was built with the same fingerprint"""
+    published = published_manifest(workspace, file)
+    return (
+        published is not None
+        and published.fingerprint == manifest.fingerprint
+        and data_store.file_exists(os.path.join(workspace, file))
+    )
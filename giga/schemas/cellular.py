@@ -7,7 +7,7 @@ from giga.data.transforms.giga_format import (
     cell_towers_to_standard_format,
     str_to_list_cb,
 )
-from giga.schemas.geo import UniqueCoordinate
+from giga.schemas.geo import UniqueCoordinate, CoordinateArray
 from giga.data.store.stores import COUNTRY_DATA_STORE
 
 
@@ -75,6 +75,12 @@ class CellTowerTable(BaseModel):
         """Transforms the cell tower table into a table of simplified coordinate"""
         return [s.to_coordinates() for s in self.towers]
 
+    def to_coordinate_array(self) -> CoordinateArray:
+        """Transforms the cell tower table into a columnar coordinate array"""
+        return CoordinateArray(
+            [t.tower_id for t in self.towers], [[t.lat, t.lon] for t in self.towers]
+        )
+
     def to_data_frame(self):
         """Transforms the cell tower table into a pandas data frame"""
         df = pd.DataFrame([cc.dict() for cc in self.to_coordinates()])
@@ -64,8 +64,8 @@ class FiberDistanceCacheConf(BaseModel):
     cache_type: Literal["fiber-distance"]
     data: LocalConnectCachePipeline
 
-    def load(self):
-        return self.data.load()  # loads data from the configured pipeline
+    def load(self, school_ids: List[str] = None):
+        return self.data.load(school_ids=school_ids)  # loads data from the configured pipeline
     
     def redo_meta(connected,schools):
         return None
@@ -83,9 +83,9 @@ class CellularDistanceCacheConf(BaseModel):
     cell_cache_file: str
     data: LocalConnectCachePipeline
 
-    def load(self):
+    def load(self, school_ids: List[str] = None):
         return self.data.load(
-            connected_file=self.cell_cache_file, unconnected_file=None
+            school_ids=school_ids, connected_file=self.cell_cache_file, unconnected_file=None
         )  # loads data from the configured pipeline
 
 
@@ -99,14 +99,16 @@ class P2PDistanceCacheConf(BaseModel):
     school_visibility_cache_file: str
     data: LocalConnectCachePipeline
 
-    def load(self, hot_load: bool = False):
+    def load(self, hot_load: bool = False, school_ids: List[str] = None):
+        files = dict(connected_file=self.p2p_cache_file, unconnected_file=self.school_visibility_cache_file)
         cache: GreedyConnectCache = self.data.load(
-            connected_file=self.p2p_cache_file, unconnected_file=self.school_visibility_cache_file
+            school_ids=school_ids, **files
         )  # loads data from the configured pipeline
-        if len(cache) != 0 or not hot_load:
+        # the full cache decides on hot loading, a selection of schools can have no entries
+        if not hot_load or len(cache) != 0 or (school_ids is not None and len(self.data.load(**files)) != 0):
             return cache
         self.hot_load()
-        return self.load(False)
+        return self.load(False, school_ids=school_ids)
 
     def hot_load(self):
         """
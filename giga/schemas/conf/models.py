@@ -111,6 +111,20 @@ class CellularTechnologyCostConf(BaseModel):
     electricity_config: ElectricityCostConf = None
 
 
+class P2PLineOfSightConf(BaseModel):
+    """Evaluates the line of sight of P2P links when they are needed instead of using the P2P and visibility caches"""
+
+    n_nearest_neighbors: int = 20  # candidate towers and schools of a school
+    n_nearest_schools: int = 5  # schools that can connect through a school, including itself
+    maximum_school_distance: float = 65_000  # meters
+    n_elevation_profile_samples: int = 4
+    los_buffer_meters: float = 5
+    receiver_height_meters: float = 5
+    earth_curvature: bool = False
+    fresnel_frequency_ghz: float = None
+    dem_directory: str = None
+
+
 class P2PInternetCapex(GeneralizedInternetCapex):
     tower_fixed_costs: float = 0.0  # USD
 
@@ -122,6 +136,7 @@ class P2PTechnologyCostConf(BaseModel):
     # max range, signal strength, etc. see CellularConstarint
     technology: str = "P2P"
     electricity_config: ElectricityCostConf = None
+    line_of_sight: P2PLineOfSightConf = None
 
 
 TechnologyConfiguration = Union[
@@ -1,7 +1,11 @@
 import os
+import io
 import math
-from pydantic import BaseModel
+from collections.abc import MutableMapping
+from datetime import datetime
+from pydantic import BaseModel, PrivateAttr
 from typing import List, Dict
+import numpy as np
 import pandas as pd
 
 try:
@@ -10,8 +14,19 @@ except ImportError:
     import json
 
 from giga.schemas.geo import PairwiseDistance, UniqueCoordinate
-from giga.data.store.stores import COUNTRY_DATA_STORE as data_store
-from giga.models.nodes.graph.pairwise_distance_model import DEFAULT_DISTANCE_FN
+from giga.data.store.stores import COUNTRY_DATA_STORE as data_store, LOCAL_FS_STORE
+from giga.models.nodes.graph.pairwise_distance_model import nearest_targets
+from giga.utils.logging import LOGGER
+from giga.schemas.cache_manifest import (
+    CacheManifest,
+    CACHE_MANIFEST_FILE,
+    HASH_CHUNK_BYTES,
+    cache_manifest_path,
+    check_published_cache,
+    is_published,
+)
+from giga.schemas.json_stream import write_json_object, iter_json_object
+
 
 def encode_coord(coord):
     # turn tuple to list
@@ -23,6 +38,363 @@ def decode_coord(coord):
     return UniqueCoordinate(**json.loads(coord))
 
 
+# binary caches are stored in a directory next to the JSON file, with this extension
+BINARY_CACHE_EXTENSION = ".npcache"
+BINARY_CACHE_FORMAT = "giga-distance-cache"
+BINARY_CACHE_VERSION = 1
+BINARY_CACHE_MANIFEST = "manifest.json"
+BINARY_CACHE_ARRAYS = ["ids", "coordinates", "offsets", "neighbors", "distances"]
+BINARY_DISTANCE_DTYPE = np.float32
+CACHE_OUTPUT_FORMATS = ["json", "binary", "both"]
+
+
+def binary_cache_path(file: str) -> str:
+    """Path of the binary cache directory that corresponds to a JSON cache file"""
+    return os.path.splitext(file)[0] + BINARY_CACHE_EXTENSION
+
+
+def _save_array(path, array):
+    with data_store.open(path, "wb") as f:
+        np.save(f, array, allow_pickle=False)
+
+
+def _load_array(path, mmap=True):
+    # only files on the local file system can be memory-mapped
+    if mmap and data_store is LOCAL_FS_STORE:
+        return np.load(path, mmap_mode="r", allow_pickle=False)
+    with data_store.open(path, "rb") as f:
+        return np.load(io.BytesIO(f.read()), allow_pickle=False)
+
+
+class NeighborLookupArray:
+    """
+    Compressed sparse row (CSR) form of a distance lookup. Node ids are interned into
+    integers, the neighbors of node i are neighbors[offsets[i]:offsets[i + 1]] with
+    their distances in the same slice of distances, in the order of the lookup they were
+    compiled from. Node locations are kept as an (n x 2) array of [lat, lon] values, nan
+    if unknown. Arrays can be saved to and memory-mapped from a versioned binary cache
+    directory.
+    """
+
+    def __init__(self, ids, coordinates, offsets, neighbors, distances):
+        self.ids = list(ids)
+        self.coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.neighbors = np.asarray(neighbors, dtype=np.int32)
+        self.distances = np.asarray(distances)
+        self.index = {cid: i for i, cid in enumerate(self.ids)}
+
+    @staticmethod
+    def from_lookup(lookup: Dict, one_to_one: bool = False) -> "NeighborLookupArray":
+        """
+        Compiles a distance cache lookup, keys of one to one lookups are the first
+        coordinate of their distance, keys of one to many lookups the second coordinate
+        of each distance
+        """
+        index, coordinates = {}, []
+
+        def intern(c):
+            i = index.get(c.coordinate_id, None)
+            if i is None:
+                i = index[c.coordinate_id] = len(coordinates)
+                coordinates.append(
+                    c.coordinate if c.coordinate is not None else (np.nan, np.nan)
+                )
+            return i
+
+        rows = {}
+        for key, distances in lookup.items():
+            if one_to_one:
+                distances = [] if distances is None else [distances]
+            for d in distances:
+                key_coordinate, neighbor = (
+                    (d.coordinate1, d.coordinate2)
+                    if one_to_one
+                    else (d.coordinate2, d.coordinate1)
+                )
+                rows.setdefault(intern(key_coordinate), []).append(
+                    (intern(neighbor), d.distance)
+                )
+        counts = np.zeros(len(index) + 1, dtype=np.int64)
+        for i, row in rows.items():
+            counts[i + 1] = len(row)
+        neighbors, distances = [], []
+        for i in range(len(index)):
+            for j, d in rows.get(i, []):
+                neighbors.append(j)
+                distances.append(d)
+        return NeighborLookupArray(
+            list(index),
+            np.reshape(coordinates, (-1, 2)),
+            np.cumsum(counts),
+            neighbors,
+            np.asarray(distances, dtype=np.float64),
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.neighbors)
+
+    def keys(self) -> List[str]:
+        """Ids of the nodes that have at least one neighbor"""
+        return [self.ids[i] for i in np.flatnonzero(np.diff(self.offsets) > 0)]
+
+    def row(self, coordinate_id: str):
+        """
+        :return a tuple of the interned neighbor ids and distances of a node, empty if
+          it has no neighbors
+        """
+        i = self.index.get(coordinate_id, None)
+        if i is None:
+            return self.neighbors[:0], self.distances[:0]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.neighbors[start:end], self.distances[start:end]
+
+    def coordinate(self, i: int) -> UniqueCoordinate:
+        lat, lon = self.coordinates[i]
+        return UniqueCoordinate(
+            coordinate_id=self.ids[i],
+            coordinate=None if math.isnan(lat) else [float(lat), float(lon)],
+        )
+
+    def map_ids(self, index: Dict[str, int]) -> np.ndarray:
+        """
+        Maps interned node ids to the integers of an external index, -1 for ids missing
+        from it
+        """
+        return np.fromiter(
+            (index.get(cid, -1) for cid in self.ids),
+            dtype=np.int64,
+            count=len(self.ids),
+        )
+
+    def subset(self, keys: List[str]) -> "NeighborLookupArray":
+        """
+        Returns a new array with only the rows of the given keys and the nodes they
+        reference, with memory-mapped arrays only the pages of the selected rows are
+        read
+        """
+        rows = sorted(
+            set(i for i in (self.index.get(k, None) for k in keys) if i is not None)
+        )
+        rows = np.asarray(rows, dtype=np.int64)
+        starts, ends = self.offsets[rows], self.offsets[rows + 1]
+        edges = (
+            np.concatenate([np.arange(a, b) for a, b in zip(starts, ends)])
+            if len(rows) > 0
+            else np.empty(0, dtype=np.int64)
+        )
+        neighbors = np.asarray(self.neighbors[edges], dtype=np.int64)
+        nodes = np.union1d(rows, neighbors)
+        counts = np.zeros(len(nodes) + 1, dtype=np.int64)
+        counts[np.searchsorted(nodes, rows) + 1] = ends - starts
+        return NeighborLookupArray(
+            [self.ids[i] for i in nodes],
+            self.coordinates[nodes],
+            np.cumsum(counts),
+            np.searchsorted(nodes, neighbors),
+            np.array(self.distances[edges]),
+        )
+
+    def save(self, directory: str, **metadata):
+        """
+        Writes the arrays to a binary cache directory, distances are stored as float32.
+        The manifest is written last, so a directory without one is an incomplete cache.
+        """
+        if data_store is LOCAL_FS_STORE:
+            os.makedirs(directory, exist_ok=True)
+        arrays = {
+            "ids": np.asarray(self.ids, dtype=str),
+            "coordinates": self.coordinates,
+            "offsets": self.offsets,
+            "neighbors": self.neighbors,
+            "distances": self.distances.astype(BINARY_DISTANCE_DTYPE),
+        }
+        for name, array in arrays.items():
+            _save_array(os.path.join(directory, f"{name}.npy"), array)
+        manifest = {
+            "format": BINARY_CACHE_FORMAT,
+            "version": BINARY_CACHE_VERSION,
+            "n_nodes": len(self.ids),
+            "n_edges": self.n_edges,
+            "arrays": BINARY_CACHE_ARRAYS,
+            **metadata,
+        }
+        with data_store.open(os.path.join(directory, BINARY_CACHE_MANIFEST), "w") as f:
+            json.dump(manifest, f)
+
+    @staticmethod
+    def read_manifest(directory: str) -> Dict:
+        with data_store.open(os.path.join(directory, BINARY_CACHE_MANIFEST), "r") as f:
+            manifest = json.load(f)
+        if manifest.get("format") != BINARY_CACHE_FORMAT:
+            raise ValueError(f"{directory} is not a binary distance cache")
+        if manifest.get("version") != BINARY_CACHE_VERSION:
+            raise ValueError(
+                "Unsupported binary distance cache version "
+                f"{manifest.get('version')} in {directory}, "
+                f"expected version {BINARY_CACHE_VERSION}"
+            )
+        return manifest
+
+    @staticmethod
+    def load(directory: str, mmap: bool = True):
+        """
+        Loads the arrays of a binary cache directory, memory-mapping them when possible
+        :return a tuple of the NeighborLookupArray and the manifest of the cache
+        """
+        manifest = NeighborLookupArray.read_manifest(directory)
+        arrays = {
+            name: _load_array(os.path.join(directory, f"{name}.npy"), mmap=mmap)
+            for name in BINARY_CACHE_ARRAYS
+        }
+        arrays["ids"] = arrays["ids"].tolist()
+        return NeighborLookupArray(**arrays), manifest
+
+
+class DistanceLookupView(MutableMapping):
+    """
+    Dictionary view of a NeighborLookupArray that builds PairwiseDistance objects on
+    access, used as the lookup of caches loaded from the binary format. Values that are
+    set or deleted are kept on top of the arrays, which are never modified.
+    """
+
+    def __init__(
+        self,
+        array: NeighborLookupArray,
+        one_to_one: bool,
+        distance_type: str = "euclidean",
+    ):
+        self.array = array
+        self.one_to_one = one_to_one
+        self.distance_type = distance_type
+        self._keys = array.keys()
+        self._key_set = set(self._keys)
+        self._updates = {}
+        self._deleted = set()
+
+    def _build(self, key):
+        array = self.array
+        i = array.index[key]
+        neighbors, distances = array.row(key)
+        coordinate = array.coordinate(i)
+        values = []
+        for j, d in zip(neighbors.tolist(), distances.tolist()):
+            neighbor = array.coordinate(j)
+            first, second = (
+                (coordinate, neighbor) if self.one_to_one else (neighbor, coordinate)
+            )
+            values.append(
+                PairwiseDistance(
+                    pair_ids=(first.coordinate_id, second.coordinate_id),
+                    distance=d,
+                    distance_type=self.distance_type,
+                    coordinate1=first,
+                    coordinate2=second,
+                )
+            )
+        return values[0] if self.one_to_one else values
+
+    def __getitem__(self, key):
+        if key in self._updates:
+            return self._updates[key]
+        if key in self._deleted or key not in self._key_set:
+            raise KeyError(key)
+        return self._build(key)
+
+    def __setitem__(self, key, value):
+        self._updates[key] = value
+        self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._updates.pop(key, None)
+        self._deleted.add(key)
+
+    def __contains__(self, key):
+        return key in self._updates or (
+            key in self._key_set and key not in self._deleted
+        )
+
+    def __iter__(self):
+        for key in self._keys:
+            if key not in self._deleted:
+                yield key
+        for key in self._updates:
+            if key not in self._key_set:
+                yield key
+
+    def __len__(self):
+        extra = sum(1 for key in self._updates if key not in self._key_set)
+        removed = sum(1 for key in self._deleted if key in self._key_set)
+        return len(self._keys) - removed + extra
+
+    @property
+    def unchanged(self) -> bool:
+        return len(self._updates) == 0 and len(self._deleted) == 0
+
+    def subset(self, keys: List[str]) -> "DistanceLookupView":
+        assert self.unchanged, "Only unmodified lookup views can be subset"
+        return DistanceLookupView(
+            self.array.subset(keys), self.one_to_one, distance_type=self.distance_type
+        )
+
+
+def _write_json(cache, file, export_value, compression=None):
+    # entries are exported one at a time, caches loaded from the binary format build
+    # them lazily
+    with data_store.open(file, "w", compression=compression) as f:
+        write_json_object(
+            f,
+            "lookup",
+            ((k, export_value(v)) for k, v in cache.lookup.items()),
+            **cache.dict(exclude={"lookup"}),
+        )
+
+
+def _read_json(file, parse_value, keys=None):
+    # parses the lookup entry by entry so that the decoded JSON is never held in memory
+    # as a whole, entries outside of keys are not parsed into distances
+    fields = {}
+    keys = None if keys is None else set(keys)
+    with data_store.open(file, "r") as f:
+        lookup = {
+            k: parse_value(v) for k, v in iter_json_object(f, "lookup", fields, keys)
+        }
+    return lookup, fields
+
+
+def _compiled_view(lookup):
+    # reuse the arrays of an unmodified binary lookup when saving it again
+    if isinstance(lookup, DistanceLookupView) and lookup.unchanged:
+        return lookup.array
+    return None
+
+
+def _subset_lookup(lookup, keys):
+    if _compiled_view(lookup) is not None:
+        return lookup.subset(keys)
+    return {k: lookup[k] for k in keys if k in lookup}
+
+
+def _distance_type(distances) -> str:
+    for d in distances:
+        return d.distance_type
+    return "euclidean"
+
+
+def _check_cache_type(directory, manifest, cache_type):
+    if manifest.get("cache_type") != cache_type:
+        raise ValueError(
+            f"Binary distance cache {directory} has type {manifest.get('cache_type')}, "
+            f"expected {cache_type}"
+        )
+
+
 class SingleLookupDistanceCache(BaseModel):
     """Cache for existing distance data with one to one mapping"""
 
@@ -58,14 +430,50 @@ class SingleLookupDistanceCache(BaseModel):
         return SingleLookupDistanceCache(lookup=lookup)
 
     @staticmethod
-    def from_json(file):
-        with data_store.open(file, "r") as f:
-            d = json.load(f)
-        return SingleLookupDistanceCache(**d)
+    def from_json(file, keys: List[str] = None):
+        """
+        Loads a cache from a JSON file, if keys are given only their entries are loaded
+        """
+        lookup, fields = _read_json(file, lambda v: PairwiseDistance(**v), keys)
+        return SingleLookupDistanceCache.construct(
+            lookup=lookup, cache_type=fields.get("cache_type", "one-to-one")
+        )
+
+    def to_json(self, file, compression=None):
+        _write_json(self, file, lambda v: v.dict(), compression=compression)
+
+    @staticmethod
+    def from_binary(directory, mmap=True):
+        """
+        Loads a cache from the binary format, the arrays are memory-mapped when possible
+        and PairwiseDistance objects are only built for the keys that are accessed
+        """
+        array, manifest = NeighborLookupArray.load(directory, mmap=mmap)
+        _check_cache_type(directory, manifest, "one-to-one")
+        lookup = DistanceLookupView(
+            array,
+            one_to_one=True,
+            distance_type=manifest.get("distance_type", "euclidean"),
+        )
+        return SingleLookupDistanceCache.construct(
+            lookup=lookup, cache_type="one-to-one"
+        )
+
+    def to_binary(self, directory):
+        array = _compiled_view(self.lookup)
+        if array is None:
+            array = NeighborLookupArray.from_lookup(self.lookup, one_to_one=True)
+        array.save(
+            directory,
+            cache_type=self.cache_type,
+            distance_type=_distance_type(self.lookup.values()),
+        )
 
-    def to_json(self, file):
-        with data_store.open(file, "w") as f:
-            json.dump(self.dict(), f)
+    def subset(self, keys: List[str]) -> "SingleLookupDistanceCache":
+        """Returns a cache with only the entries of the given keys"""
+        return SingleLookupDistanceCache.construct(
+            lookup=_subset_lookup(self.lookup, keys), cache_type=self.cache_type
+        )
 
     def __len__(self):
         return len(self.lookup)
@@ -77,6 +485,16 @@ class MultiLookupDistanceCache(BaseModel):
     lookup: Dict[str, List[PairwiseDistance]]
     n_neighbors: int
     cache_type: str = "one-to-many"
+    _compiled: NeighborLookupArray = PrivateAttr(default=None)
+
+    def compile(self) -> NeighborLookupArray:
+        """
+        Compiles the lookup into a NeighborLookupArray once, later calls return the same
+        array
+        """
+        if self._compiled is None:
+            self._compiled = NeighborLookupArray.from_lookup(self.lookup)
+        return self._compiled
 
     @staticmethod
     def from_distances(distances, n_neighbors=10):
@@ -104,19 +522,233 @@ class MultiLookupDistanceCache(BaseModel):
         return MultiLookupDistanceCache(lookup=lookup, n_neighbors=n_neighbors)
 
     @staticmethod
-    def from_json(file):
-        with data_store.open(file, "r") as f:
-            d = json.load(f)
-        return MultiLookupDistanceCache(**d)
+    def from_json(file, keys: List[str] = None):
+        """
+        Loads a cache from a JSON file, if keys are given only their entries are loaded
+        """
+        lookup, fields = _read_json(
+            file, lambda v: [PairwiseDistance(**x) for x in v], keys
+        )
+        return MultiLookupDistanceCache.construct(
+            lookup=lookup,
+            n_neighbors=int(fields["n_neighbors"]),
+            cache_type=fields.get("cache_type", "one-to-many"),
+        )
 
-    def to_json(self, file):
-        with data_store.open(file, "w") as f:
-            json.dump(self.dict(), f)
+    def to_json(self, file, compression=None):
+        _write_json(
+            self, file, lambda v: [x.dict() for x in v], compression=compression
+        )
+
+    @staticmethod
+    def from_binary(directory, mmap=True):
+        """
+        Loads a cache from the binary format, the arrays are memory-mapped when possible
+        and used directly as the compiled form of the cache
+        """
+        array, manifest = NeighborLookupArray.load(directory, mmap=mmap)
+        _check_cache_type(directory, manifest, "one-to-many")
+        lookup = DistanceLookupView(
+            array,
+            one_to_one=False,
+            distance_type=manifest.get("distance_type", "euclidean"),
+        )
+        cache = MultiLookupDistanceCache.construct(
+            lookup=lookup, n_neighbors=manifest["n_neighbors"], cache_type="one-to-many"
+        )
+        cache._compiled = array
+        return cache
+
+    def to_binary(self, directory):
+        array = _compiled_view(self.lookup)
+        if array is None:
+            array = self.compile()
+        array.save(
+            directory,
+            cache_type=self.cache_type,
+            n_neighbors=self.n_neighbors,
+            distance_type=_distance_type(
+                v for values in self.lookup.values() for v in values
+            ),
+        )
+
+    def subset(self, keys: List[str]) -> "MultiLookupDistanceCache":
+        """Returns a cache with only the neighbors of the given keys"""
+        lookup = _subset_lookup(self.lookup, keys)
+        cache = MultiLookupDistanceCache.construct(
+            lookup=lookup, n_neighbors=self.n_neighbors, cache_type=self.cache_type
+        )
+        if isinstance(lookup, DistanceLookupView):
+            cache._compiled = lookup.array
+        return cache
 
     def __len__(self):
         return len(self.lookup)
 
 
+def is_empty_cache(file) -> bool:
+    """
+    True if the lookup of a JSON cache has no entries, only the first entry is decoded
+    """
+    with data_store.open(file, "r") as f:
+        return next(iter_json_object(f, "lookup", {}), None) is None
+
+
+def write_cache(cache, file, output_format="both", compression=None):
+    """
+    Writes a distance cache to a JSON file and/or the binary cache directory next to it
+    :param output_format, one of "json", "binary" or "both"
+    :param compression, the compression of the JSON file, "gzip" or "zstd", the binary
+      cache is never compressed so that it can be memory-mapped
+    """
+    assert (
+        output_format in CACHE_OUTPUT_FORMATS
+    ), f"Unsupported cache format {output_format}"
+    directory = binary_cache_path(file)
+    if output_format in ("json", "both"):
+        cache.to_json(file, compression=compression)
+    if output_format in ("binary", "both"):
+        cache.to_binary(directory)
+    else:
+        # binary caches take precedence when loading, invalidate a stale one
+        manifest = os.path.join(directory, BINARY_CACHE_MANIFEST)
+        if data_store.file_exists(manifest):
+            data_store.remove(manifest)
+
+
+def copy_file(source: str, target: str, compression=None):
+    """
+    Copies a file in the data store in chunks, compressed files are decompressed while
+    they are read
+    :param compression, the compression of the copy, "gzip" or "zstd"
+    """
+    with data_store.open(source, "rb") as src, data_store.open(
+        target, "wb", compression=compression
+    ) as dst:
+        for chunk in iter(lambda: src.read(HASH_CHUNK_BYTES), b""):
+            dst.write(chunk)
+
+
+def _copy_cache(source: str, target: str, compression=None):
+    # copies the JSON file and the binary cache directory of a cache, the binary
+    # manifest last
+    if data_store.file_exists(source):
+        copy_file(source, target, compression=compression)
+    source_dir, target_dir = binary_cache_path(source), binary_cache_path(target)
+    if data_store.file_exists(os.path.join(source_dir, BINARY_CACHE_MANIFEST)):
+        if data_store is LOCAL_FS_STORE:
+            os.makedirs(target_dir, exist_ok=True)
+        files = [
+            f for f in data_store.list_files(source_dir) if f != BINARY_CACHE_MANIFEST
+        ]
+        for f in files + [BINARY_CACHE_MANIFEST]:
+            copy_file(os.path.join(source_dir, f), os.path.join(target_dir, f))
+    else:
+        # a stale binary cache takes precedence when loading, invalidate it
+        manifest = os.path.join(target_dir, BINARY_CACHE_MANIFEST)
+        if data_store.file_exists(manifest):
+            data_store.remove(manifest)
+
+
+def reuse_cache(
+    workspace: str, file: str, manifest: CacheManifest, compression=None
+) -> bool:
+    """
+    Publishes a stored cache with the fingerprint of the manifest under the file name in
+    the workspace
+    :param compression, the compression of the published JSON file, "gzip" or "zstd"
+    :return True if a matching cache was found and nothing has to be built
+    """
+    if is_published(workspace, file, manifest):
+        LOGGER.info(f"{file} in {workspace} is up to date, skipping")
+        return True
+    directory = manifest.store_directory(workspace)
+    stored = CacheManifest.load(os.path.join(directory, CACHE_MANIFEST_FILE))
+    if stored is None or stored.fingerprint != manifest.fingerprint:
+        return False
+    LOGGER.info(f"Reusing {file} from {directory}")
+    path = os.path.join(workspace, file)
+    _copy_cache(
+        os.path.join(directory, os.path.basename(file)), path, compression=compression
+    )
+    stored.save(cache_manifest_path(path))
+    return True
+
+
+def store_cache(
+    cache,
+    workspace: str,
+    file: str,
+    manifest: CacheManifest,
+    output_format: str = "both",
+    compression=None,
+):
+    """
+    Writes a cache to the cache store directory of its fingerprint and publishes it
+    under the file name in the workspace. The manifests are written last, so a directory
+    without one holds an incomplete cache.
+    """
+    directory = manifest.store_directory(workspace)
+    if data_store is LOCAL_FS_STORE:
+        os.makedirs(directory, exist_ok=True)
+    manifest = manifest.copy(update={"created": datetime.now().isoformat()})
+    write_cache(
+        cache,
+        os.path.join(directory, os.path.basename(file)),
+        output_format,
+        compression=compression,
+    )
+    manifest.save(os.path.join(directory, CACHE_MANIFEST_FILE))
+    path = os.path.join(workspace, file)
+    write_cache(cache, path, output_format, compression=compression)
+    manifest.save(cache_manifest_path(path))
+
+
+def _load_cache(workspace, file, cache_class, binary=True, mmap=True, keys=None):
+    if file is None:
+        return None
+    if not check_published_cache(workspace, file):
+        return None
+    path = os.path.join(workspace, file)
+    directory = binary_cache_path(path)
+    if binary and data_store.file_exists(
+        os.path.join(directory, BINARY_CACHE_MANIFEST)
+    ):
+        cache = cache_class.from_binary(directory, mmap=mmap)
+        return cache if keys is None else cache.subset(keys)
+    # check to see if the file exists
+    if data_store.file_exists(path):
+        return cache_class.from_json(path, keys=keys)
+    return None
+
+
+def _unconnected_schools(schools):
+    # unconnected school entities and an (n x 2) array of their lat/lon values
+    schools = [s for s in schools if not s.connected]
+    coordinates = np.array([[s.lat, s.lon] for s in schools], dtype=np.float64).reshape(
+        -1, 2
+    )
+    return schools, coordinates
+
+
+def _coordinates(coordinates: List[UniqueCoordinate]) -> np.ndarray:
+    return np.array([c.coordinate for c in coordinates], dtype=np.float64).reshape(
+        -1, 2
+    )
+
+
+def _connected_pair(
+    school, connected: UniqueCoordinate, distance: float
+) -> PairwiseDistance:
+    return PairwiseDistance(
+        pair_ids=(school.giga_id, connected.coordinate_id),
+        distance=distance,
+        distance_type="euclidean",
+        coordinate1=school.to_coordinates(),
+        coordinate2=connected,
+    )
+
+
 class GreedyConnectCache(BaseModel):
     """Cache that can be used by the greedy connection model"""
 
@@ -128,85 +760,101 @@ class GreedyConnectCache(BaseModel):
         workspace,
         unconnected_file="school_cache.json",
         connected_file="fiber_cache.json",
+        binary=True,
+        mmap=True,
+        school_ids: List[str] = None,
     ):
-        connected_cache, unconnected_cache = None, None
-        if connected_file is not None:
-            # check to see if the file exists
-            if data_store.file_exists(os.path.join(workspace, connected_file)):
-                connected_cache = SingleLookupDistanceCache.from_json(
-                    os.path.join(workspace, connected_file)
-                )
-        if unconnected_file is not None:
-            # check to see if the file exists
-            if data_store.file_exists(os.path.join(workspace, unconnected_file)):
-                unconnected_cache = MultiLookupDistanceCache.from_json(
-                    os.path.join(workspace, unconnected_file)
-                )
+        """
+        Loads the caches of a workspace, if binary is set a binary cache directory next
+        to a JSON file (e.g. school_cache.npcache for school_cache.json) is
+        memory-mapped instead of parsing the JSON. If school ids are given only their
+        entries are kept, JSON caches skip the other entries while they are read
+        """
+        connected_cache = _load_cache(
+            workspace,
+            connected_file,
+            SingleLookupDistanceCache,
+            binary,
+            mmap,
+            school_ids,
+        )
+        unconnected_cache = _load_cache(
+            workspace,
+            unconnected_file,
+            MultiLookupDistanceCache,
+            binary,
+            mmap,
+            school_ids,
+        )
         return GreedyConnectCache(
             connected_cache=connected_cache, unconnected_cache=unconnected_cache
         )
 
-    def redo_meta(self,connected,schools):
-        meta = connected[0]
+    def redo_meta(self, connected, schools):
+        """
+        Rebuilds the connected cache for fiber connections through the metanode and
+        optionally schools: each unconnected school connects to the metanode at its
+        fiber node distance, or to the nearest of the other connected coordinates if
+        that is closer
+        :param connected, the metanode followed by the connected schools
+        :param schools, the school entities of the data space
+        """
+        schools, coordinates = _unconnected_schools(schools)
+        nearest = np.zeros(len(schools), dtype=np.intp)
+        distances = np.array([s.fiber_node_distance for s in schools], dtype=np.float64)
+        if len(connected) > 1:
+            rows = np.flatnonzero(np.isfinite(coordinates).all(axis=1))
+            idxs, d = nearest_targets(coordinates[rows], _coordinates(connected[1:]))
+            closer = d < distances[rows]
+            nearest[rows[closer]] = idxs[closer] + 1
+            distances[rows[closer]] = d[closer]
+        previous = self.connected_cache.lookup
         lookup = {}
-        for s in schools:
-            if not s.connected:
-                lookup[s.giga_id] = PairwiseDistance(
-                    pair_ids = (s.giga_id,meta.coordinate_id),
-                    distance = s.fiber_node_distance,
-                    distance_type = "euclidean",
-                    coordinate1 = s.to_coordinates(),
-                    coordinate2 = meta,
-                )
-        if len(connected)==1:
-            self.connected_cache.lookup = lookup
-            return
-
-        for s in schools:
-            if not s.connected:
-                for i in range(1,len(connected)):
-                    d = DEFAULT_DISTANCE_FN(s.to_coordinates().coordinate,connected[i].coordinate)
-                    if s.giga_id not in lookup:
-                        lookup[s.giga_id] = PairwiseDistance(
-                            pair_ids = (s.giga_id,connected[i].coordinate_id),
-                            distance = d,
-                            distance_type = "euclidean",
-                            coordinate1 = s.to_coordinates(),
-                            coordinate2 = connected[i],
-                        )
-                    elif d < lookup[s.giga_id].distance:
-                        lookup[s.giga_id] = PairwiseDistance(
-                            pair_ids = (s.giga_id,connected[i].coordinate_id),
-                            distance = d,
-                            distance_type = "euclidean",
-                            coordinate1 = s.to_coordinates(),
-                            coordinate2 = connected[i],
-                        )
+        for s, i, d in zip(schools, nearest.tolist(), distances.tolist()):
+            entry = previous.get(s.giga_id, None)
+            # only materialize the pairs of schools whose nearest connection changed
+            if (
+                entry is None
+                or entry.pair_ids[1] != connected[i].coordinate_id
+                or entry.distance != d
+            ):
+                entry = _connected_pair(s, connected[i], d)
+            lookup[s.giga_id] = entry
         self.connected_cache.lookup = lookup
-    
-    def redo_schools(self,connected,k,schools):
-        #lookup = {}
-        for s in schools:
-            if not s.connected:
-                for i in range(k,len(connected)):
-                    d = DEFAULT_DISTANCE_FN(s.to_coordinates().coordinate,connected[i].coordinate)
-                    if s.giga_id not in self.connected_cache.lookup:
-                        self.connected_cache.lookup[s.giga_id] = PairwiseDistance(
-                            pair_ids = (s.giga_id,connected[i].coordinate_id),
-                            distance = d,
-                            distance_type = "euclidean",
-                            coordinate1 = s.to_coordinates(),
-                            coordinate2 = connected[i],
-                        )
-                    elif d < self.connected_cache.lookup[s.giga_id].distance:
-                        self.connected_cache.lookup[s.giga_id] = PairwiseDistance(
-                            pair_ids = (s.giga_id,connected[i].coordinate_id),
-                            distance = d,
-                            distance_type = "euclidean",
-                            coordinate1 = s.to_coordinates(),
-                            coordinate2 = connected[i],
-                        )
-        #self.connected_cache.lookup = lookup
+
+    def redo_schools(self, connected, k, schools):
+        """
+        Updates the connected cache with connected schools as additional connection
+        points, an unconnected school is connected to its nearest connected school if
+        that is closer than its cached connection
+        :param connected, the connected coordinates followed by the connected schools
+        :param k, the number of connected coordinates before the connected schools
+        """
+        schools, coordinates = _unconnected_schools(schools)
+        rows = np.flatnonzero(np.isfinite(coordinates).all(axis=1))
+        idxs, distances = nearest_targets(
+            coordinates[rows], _coordinates(connected[k:])
+        )
+        lookup = self.connected_cache.lookup
+        for r, i, d in zip(rows.tolist(), idxs.tolist(), distances.tolist()):
+            s = schools[r]
+            entry = lookup.get(s.giga_id, None)
+            if entry is None or d < entry.distance:
+                lookup[s.giga_id] = _connected_pair(s, connected[k + i], d)
+
+    def subset(self, school_ids: List[str]) -> "GreedyConnectCache":
+        """
+        Returns a cache with only the entries of the given school ids and their cached
+        neighbors, used by data spaces filtered to a selection of schools
+        """
+        return GreedyConnectCache(
+            connected_cache=None
+            if self.connected_cache is None
+            else self.connected_cache.subset(school_ids),
+            unconnected_cache=None
+            if self.unconnected_cache is None
+            else self.unconnected_cache.subset(school_ids),
+        )
 
     def __len__(self):
         return len(self.connected_cache or []) + len(self.unconnected_cache or [])
@@ -1,4 +1,4 @@
-from typing import Tuple, List, Dict, Optional
+from typing import Tuple, List, Dict, Optional, Union
 from pydantic import BaseModel, Field
 import pandas as pd
 import numpy as np
@@ -16,6 +16,137 @@ class UniqueCoordinate(BaseModel):
     properties: Dict = {}
 
 
+class CoordinateArray:
+    """
+    Columnar table of uniquely identifiable lat/lon coordinates.
+    Holds an id array and an (n x 2) float64 array of [lat, lon] values,
+    the radian representation used by the distance models is computed once on first access.
+    Indexing with an integer returns a UniqueCoordinate, slicing returns a new CoordinateArray.
+    """
+
+    def __init__(self, coordinate_ids, coordinates, properties=None, source=None):
+        self.coordinate_ids = np.asarray(coordinate_ids, dtype=object).reshape(-1)
+        self.coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        assert len(self.coordinate_ids) == len(
+            self.coordinates
+        ), "Coordinate ids and coordinates must have the same length"
+        # optional columnar properties, a mapping of property name to a per-coordinate array
+        self.properties = properties or {}
+        # optional UniqueCoordinate objects this array was built from, returned when indexing
+        self._source = source
+        self._radians = None
+        self._index = None
+
+    @staticmethod
+    def from_coordinates(coordinates: List[UniqueCoordinate]) -> "CoordinateArray":
+        if isinstance(coordinates, CoordinateArray):
+            return coordinates
+        coordinates = list(coordinates)
+        return CoordinateArray(
+            [c.coordinate_id for c in coordinates],
+            # coordinates without a location (e.g. the fiber metanode) are stored as nan
+            [
+                c.coordinate if c.coordinate is not None else (np.nan, np.nan)
+                for c in coordinates
+            ],
+            source=coordinates,
+        )
+
+    @staticmethod
+    def from_frame(
+        frame: pd.DataFrame,
+        id_column: str = "coordinate_id",
+        lat_column: str = "lat",
+        lon_column: str = "lon",
+        property_columns: List[str] = [],
+    ) -> "CoordinateArray":
+        return CoordinateArray(
+            frame[id_column].astype(str).to_numpy(dtype=object),
+            frame[[lat_column, lon_column]].to_numpy(dtype=np.float64),
+            properties={c: frame[c].to_numpy() for c in property_columns},
+        )
+
+    @staticmethod
+    def concat(arrays: List["CoordinateArray"]) -> "CoordinateArray":
+        arrays = [a for a in arrays if len(a) > 0]
+        if len(arrays) == 0:
+            return CoordinateArray([], np.empty((0, 2)))
+        if len(arrays) == 1:
+            return arrays[0]
+        names = set.intersection(*[set(a.properties) for a in arrays])
+        source = None
+        if all(a._source is not None for a in arrays):
+            source = [c for a in arrays for c in a._source]
+        return CoordinateArray(
+            np.concatenate([a.coordinate_ids for a in arrays]),
+            np.concatenate([a.coordinates for a in arrays]),
+            properties={
+                n: np.concatenate([a.properties[n] for a in arrays]) for n in names
+            },
+            source=source,
+        )
+
+    @property
+    def radians(self) -> np.ndarray:
+        """(n x 2) array of [lat, lon] in radians"""
+        if self._radians is None:
+            self._radians = np.radians(self.coordinates)
+        return self._radians
+
+    @property
+    def index(self) -> Dict[str, int]:
+        """Lookup from coordinate id to row"""
+        if self._index is None:
+            self._index = {cid: i for i, cid in enumerate(self.coordinate_ids)}
+        return self._index
+
+    def coordinate(self, i: int) -> UniqueCoordinate:
+        """Materializes the coordinate at row i"""
+        if self._source is not None:
+            return self._source[i]
+        return UniqueCoordinate(
+            coordinate_id=self.coordinate_ids[i],
+            coordinate=self.coordinates[i].tolist(),
+            properties={k: _to_builtin(v[i]) for k, v in self.properties.items()},
+        )
+
+    def to_coordinates(self) -> List[UniqueCoordinate]:
+        return [self.coordinate(i) for i in range(len(self))]
+
+    def take(self, rows) -> "CoordinateArray":
+        """Returns a new coordinate array with the selected rows"""
+        rows = np.arange(len(self))[rows]
+        source = None
+        if self._source is not None:
+            source = [self._source[i] for i in rows]
+        return CoordinateArray(
+            self.coordinate_ids[rows],
+            self.coordinates[rows],
+            properties={k: v[rows] for k, v in self.properties.items()},
+            source=source,
+        )
+
+    def __len__(self):
+        return len(self.coordinate_ids)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.coordinate(i)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.coordinate(key)
+        return self.take(key)
+
+
+def _to_builtin(value):
+    # numpy scalars are converted so that materialized coordinates stay json serializable
+    return value.item() if isinstance(value, np.generic) else value
+
+
+CoordinateSet = Union[CoordinateArray, List[UniqueCoordinate]]
+
+
 class UniqueCoordinateTable(BaseModel):
     """A table of uniquely identifiable lat/lon coordinates"""
 
@@ -38,6 +169,16 @@ class UniqueCoordinateTable(BaseModel):
         )
         return UniqueCoordinateTable(coordinates=coords)
 
+    @staticmethod
+    def array_from_csv(file_name) -> CoordinateArray:
+        """Reads a coordinate csv directly into a CoordinateArray, without creating per-row objects"""
+        try:
+            with COUNTRY_DATA_STORE.open(file_name, 'r') as file:
+                frame = pd.read_csv(file)
+        except pd.errors.EmptyDataError:
+            return CoordinateArray([], np.empty((0, 2)))
+        return CoordinateArray.from_frame(frame)
+
     def to_csv(self, file_name: str):
         tabular = list(
             map(
@@ -56,6 +197,10 @@ class UniqueCoordinateTable(BaseModel):
         """Transforms the coordinate table into a numpy vector of coordinates"""
         return np.array([[c.coordinate[0], c.coordinate[1]] for c in self.coordinates])
 
+    def to_coordinate_array(self) -> CoordinateArray:
+        """Transforms the coordinate table into a columnar CoordinateArray"""
+        return CoordinateArray.from_coordinates(self.coordinates)
+
     def to_data_frame(self):
         """Transforms the coordinate table into a pandas data frame"""
         df = pd.DataFrame([fc.dict() for fc in self.coordinates])
@@ -137,6 +282,187 @@ class PairwiseDistanceTable(BaseModel):
         return grouped
 
 
+class EdgeArray:
+    """
+    Struct-of-arrays table of directed edges between the rows of a CoordinateArray.
+    Edge i connects the newly connected node target[i] to the already connected node source[i],
+    distance[i] is the edge length in meters and root[i] is the node at the root of the cluster
+    the edge belongs to (-1 if unknown).
+    Iterating or indexing with an integer materializes PairwiseDistance objects lazily,
+    with pair_ids ordered as (target, source) and the root id in coordinate1.properties["source"].
+    """
+
+    def __init__(self, nodes: CoordinateArray, source, target, distance, root=None):
+        self.nodes = nodes
+        self.source = np.asarray(source, dtype=np.int32).reshape(-1)
+        self.target = np.asarray(target, dtype=np.int32).reshape(-1)
+        self.distance = np.asarray(distance, dtype=np.float32).reshape(-1)
+        if root is None:
+            root = np.full(len(self.source), -1, dtype=np.int32)
+        self.root = np.asarray(root, dtype=np.int32).reshape(-1)
+        assert (
+            len(self.source) == len(self.target) == len(self.distance) == len(self.root)
+        ), "Edge arrays must have the same length"
+        self._node_roots = None
+
+    @staticmethod
+    def empty(nodes: CoordinateArray = None) -> "EdgeArray":
+        if nodes is None:
+            nodes = CoordinateArray([], np.empty((0, 2)))
+        return EdgeArray(nodes, [], [], [])
+
+    @staticmethod
+    def from_connections(nodes: CoordinateArray, connections: List[Tuple]) -> "EdgeArray":
+        """
+        Creates an edge array from a list of (target_id, source_id, distance, root_id) tuples
+        referencing coordinate ids in the nodes array
+        """
+        if len(connections) == 0:
+            return EdgeArray.empty(nodes)
+        index = nodes.index
+        target, source, distance, root = zip(*connections)
+        return EdgeArray(
+            nodes,
+            [index[i] for i in source],
+            [index[i] for i in target],
+            distance,
+            [index[i] for i in root],
+        )
+
+    @staticmethod
+    def from_pairwise_distances(distances: List[PairwiseDistance]) -> "EdgeArray":
+        """
+        Creates an edge array from pairwise distances ordered as (new connection, connected),
+        the cluster root is read from coordinate1.properties["source"] when present
+        """
+        coordinates = {}
+        for d in distances:
+            coordinates.setdefault(d.coordinate1.coordinate_id, d.coordinate1)
+            coordinates.setdefault(d.coordinate2.coordinate_id, d.coordinate2)
+        for d in distances:
+            root = d.coordinate1.properties.get("source", None)
+            if root is not None and root not in coordinates:
+                coordinates[root] = UniqueCoordinate(coordinate_id=root)
+        nodes = CoordinateArray.from_coordinates(list(coordinates.values()))
+        index = nodes.index
+        return EdgeArray(
+            nodes,
+            [index[d.pair_ids[1]] for d in distances],
+            [index[d.pair_ids[0]] for d in distances],
+            [d.distance for d in distances],
+            [
+                index.get(d.coordinate1.properties.get("source", None), -1)
+                for d in distances
+            ],
+        )
+
+    @staticmethod
+    def from_distances(distances: Union["EdgeArray", List[PairwiseDistance]]) -> "EdgeArray":
+        """Returns the input if it is already an edge array, otherwise converts it"""
+        if isinstance(distances, EdgeArray):
+            return distances
+        return EdgeArray.from_pairwise_distances(list(distances))
+
+    @staticmethod
+    def concat(arrays: List["EdgeArray"]) -> "EdgeArray":
+        arrays = [a for a in arrays if len(a) > 0]
+        if len(arrays) == 0:
+            return EdgeArray.empty()
+        if len(arrays) == 1:
+            return arrays[0]
+        nodes = arrays[0].nodes
+        if all(a.nodes is nodes for a in arrays):
+            # subsets of the same edge table share their nodes, no re-indexing needed
+            offsets = [0] * len(arrays)
+        else:
+            nodes = CoordinateArray.concat([a.nodes for a in arrays])
+            offsets = np.cumsum([0] + [len(a.nodes) for a in arrays[:-1]])
+        return EdgeArray(
+            nodes,
+            np.concatenate([a.source + o for a, o in zip(arrays, offsets)]),
+            np.concatenate([a.target + o for a, o in zip(arrays, offsets)]),
+            np.concatenate([a.distance for a in arrays]),
+            np.concatenate(
+                [np.where(a.root >= 0, a.root + o, -1) for a, o in zip(arrays, offsets)]
+            ),
+        )
+
+    @property
+    def source_ids(self) -> np.ndarray:
+        return self.nodes.coordinate_ids[self.source]
+
+    @property
+    def target_ids(self) -> np.ndarray:
+        return self.nodes.coordinate_ids[self.target]
+
+    @property
+    def root_ids(self) -> np.ndarray:
+        """Root node id of each edge, edges with an unknown root use their target id"""
+        return self.nodes.coordinate_ids[np.where(self.root >= 0, self.root, self.target)]
+
+    @property
+    def node_roots(self) -> np.ndarray:
+        """Root of every node in the nodes array that is the target of an edge, -1 otherwise"""
+        if self._node_roots is None:
+            self._node_roots = np.full(len(self.nodes), -1, dtype=np.int32)
+            self._node_roots[self.target] = self.root
+        return self._node_roots
+
+    def take(self, rows) -> "EdgeArray":
+        """Returns a new edge array with the selected edges, sharing the same nodes"""
+        return EdgeArray(
+            self.nodes,
+            self.source[rows],
+            self.target[rows],
+            self.distance[rows],
+            self.root[rows],
+        )
+
+    def group_by_root(self) -> Dict[str, "EdgeArray"]:
+        """Group edges by the root node of their cluster, in order of first appearance"""
+        root_ids = self.root_ids
+        grouped = {}
+        for i, rid in enumerate(root_ids):
+            grouped.setdefault(rid, []).append(i)
+        return {rid: self.take(np.array(rows)) for rid, rows in grouped.items()}
+
+    def _node_coordinate(self, i: int) -> UniqueCoordinate:
+        c = self.nodes.coordinate(i)
+        root = self.node_roots[i]
+        if root < 0:
+            return c
+        return UniqueCoordinate(
+            coordinate_id=c.coordinate_id,
+            coordinate=c.coordinate,
+            properties={**c.properties, "source": self.nodes.coordinate_ids[root]},
+        )
+
+    def pairwise_distance(self, i: int) -> PairwiseDistance:
+        """Materializes edge i as a PairwiseDistance"""
+        s, t = self.source[i], self.target[i]
+        return PairwiseDistance(
+            pair_ids=(self.nodes.coordinate_ids[t], self.nodes.coordinate_ids[s]),
+            distance=float(self.distance[i]),
+            coordinate1=self._node_coordinate(t),
+            coordinate2=self._node_coordinate(s),
+        )
+
+    def to_pairwise_distances(self) -> List[PairwiseDistance]:
+        return [self.pairwise_distance(i) for i in range(len(self))]
+
+    def __len__(self):
+        return len(self.source)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.pairwise_distance(i)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.pairwise_distance(key)
+        return self.take(key)
+
+
 class RawElevationPoint(BaseModel):
     """Response structure from opentopodata API"""
 
@@ -0,0 +1,135 @@
+import json as std_json
+from typing import IO, Any, Collection, Dict, Iterable, Iterator, Tuple
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+
+# number of entries serialized together before they are written to the file
+JSON_STREAM_CHUNK_ENTRIES = 1000
+# number of characters read from the file each time the read buffer runs out
+JSON_READ_CHUNK_CHARS = 1 << 20
+
+_WHITESPACE = " \t\n\r"
+
+
+def write_json_object(f: IO, stream_key: str, items: Iterable[Tuple[str, Any]], **fields):
+    """
+    Writes a JSON object whose stream_key member is an object written entry by entry,
+    so that only a chunk of entries is serialized in memory at any time.
+    The output is identical to json.dump({stream_key: dict(items), **fields}, f)
+    :param items, the (key, value) entries of the streamed member, values must be JSON serializable
+    :param fields, the other members of the object, written after the streamed member
+    """
+    f.write("{" + json.dumps(stream_key) + ":{")
+    chunk = []
+    first = True
+    for key, value in items:
+        chunk.append(json.dumps(key) + ":" + json.dumps(value))
+        if len(chunk) == JSON_STREAM_CHUNK_ENTRIES:
+            f.write(("" if first else ",") + ",".join(chunk))
+            first = False
+            chunk = []
+    if chunk:
+        f.write(("" if first else ",") + ",".join(chunk))
+    f.write("}")
+    for key, value in fields.items():
+        f.write("," + json.dumps(key) + ":" + json.dumps(value))
+    f.write("}")
+
+
+class JSONStreamReader:
+    """
+    Reads the members of a JSON object from a text file one value at a time,
+    the file is read in chunks so that only a single value and the read buffer are held in memory
+    """
+
+    def __init__(self, f: IO, chunk_size: int = JSON_READ_CHUNK_CHARS):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+        self.decoder = std_json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode("utf-8")
+        if not chunk:
+            self.eof = True
+            return False
+        # drop the consumed part of the buffer before extending it
+        self.buffer = self.buffer[self.position :] + chunk
+        self.position = 0
+        return True
+
+    def _next_char(self) -> str:
+        # skips whitespace and returns the next character without consuming it, empty at the end of the file
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in _WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer) or not self._fill():
+                return self.buffer[self.position : self.position + 1]
+
+    def _expect(self, chars: str) -> str:
+        c = self._next_char()
+        if c == "" or c not in chars:
+            raise ValueError(f"Malformed JSON stream, expected one of '{chars}' but found '{c}'")
+        self.position += 1
+        return c
+
+    def value(self) -> Any:
+        """Decodes the next JSON value in the stream"""
+        self._next_char()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # a value that ends with the buffer might continue in the file, e.g. a number
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except std_json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def members(self) -> Iterator[str]:
+        """
+        Iterates over the keys of the JSON object starting at the current position,
+        the value of each key must be consumed with value() or members() before the next key is read
+        """
+        self._expect("{")
+        if self._next_char() == "}":
+            self.position += 1
+            return
+        while True:
+            key = self.value()
+            self._expect(":")
+            yield key
+            if self._expect(",}") == "}":
+                return
+
+
+def iter_json_object(
+    f: IO, stream_key: str, fields: Dict[str, Any], keys: Collection[str] = None
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Iterates over the (key, value) entries of the stream_key member of the JSON object in a file,
+    decoding one entry at a time. The other members of the object are decoded into fields.
+    :param fields, a dictionary that receives the other members of the object
+    :param keys, if given only the entries of these keys are returned, the others are read past and dropped
+    """
+    reader = JSONStreamReader(f)
+    for key in reader.members():
+        if key == stream_key:
+            for entry in reader.members():
+                value = reader.value()
+                if keys is None or entry in keys:
+                    yield entry, value
+        else:
+            fields[key] = reader.value()
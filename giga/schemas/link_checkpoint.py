@@ -0,0 +1,188 @@
+import io
+import os
+from typing import List, Dict, Iterator, Optional
+import numpy as np
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from giga.data.store.stores import COUNTRY_DATA_STORE as data_store, LOCAL_FS_STORE
+from giga.utils.logging import LOGGER
+
+
+# checkpoints are directories next to the cache they are built for, e.g. p2p_cache.checkpoint
+CHECKPOINT_EXTENSION = ".checkpoint"
+CHECKPOINT_FORMAT = "giga-link-checkpoint"
+CHECKPOINT_VERSION = 1
+CHECKPOINT_MANIFEST = "manifest.json"
+SEGMENT_PREFIX = "segment-"
+SEGMENT_EXTENSION = ".npz"
+
+
+def checkpoint_path(workspace: str, cache: str) -> str:
+    """Path of the checkpoint of a cache in a workspace, e.g. p2p_cache"""
+    return os.path.join(workspace, f"{cache}{CHECKPOINT_EXTENSION}")
+
+
+def segment_name(number: int) -> str:
+    return f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_EXTENSION}"
+
+
+class LinkSegment:
+    """
+    Line of sight results of the candidate links of consecutive schools.
+    School i has counts[i] candidate links, the links of all schools follow each other in targets, kept and
+    the rows of elevations, which are only present when the profiles of the links are stored.
+    """
+
+    def __init__(self, schools, counts, targets, kept, elevations=None):
+        self.schools = list(schools)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.targets = list(targets)
+        self.kept = np.asarray(kept, dtype=bool)
+        self.elevations = None if elevations is None else np.asarray(elevations)
+
+    @property
+    def offsets(self) -> np.ndarray:
+        offsets = np.zeros(len(self.counts) + 1, dtype=np.int64)
+        np.cumsum(self.counts, out=offsets[1:])
+        return offsets
+
+    def save(self, file: str):
+        arrays = {
+            "schools": np.asarray(self.schools, dtype=str),
+            "counts": self.counts,
+            "targets": np.asarray(self.targets, dtype=str),
+            "kept": self.kept,
+        }
+        if self.elevations is not None:
+            arrays["elevations"] = self.elevations
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        if data_store is LOCAL_FS_STORE:
+            # segments appear complete or not at all
+            with open(f"{file}.tmp", "wb") as f:
+                f.write(buffer.getvalue())
+            os.replace(f"{file}.tmp", file)
+        else:
+            with data_store.open(file, "wb") as f:
+                f.write(buffer.getvalue())
+
+    @staticmethod
+    def load(file: str) -> "LinkSegment":
+        with data_store.open(file, "rb") as f:
+            arrays = np.load(io.BytesIO(f.read()), allow_pickle=False)
+            return LinkSegment(
+                arrays["schools"].tolist(),
+                arrays["counts"],
+                arrays["targets"].tolist(),
+                arrays["kept"],
+                arrays["elevations"] if "elevations" in arrays.files else None,
+            )
+
+
+class LinkCheckpoint:
+    """
+    Append-only checkpoint of the line of sight results of a cache builder, as numbered segment files in a
+    directory of the workspace. Each segment holds the results of a batch of schools and is never rewritten,
+    so the cost of a checkpoint does not grow with the number of schools that were already evaluated.
+    The manifest of the checkpoint records the fingerprint of the cache it is built for, a checkpoint of
+    other inputs or parameters is discarded instead of resumed.
+    """
+
+    def __init__(self, directory: str, fingerprint: str, store_profiles: bool = False):
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.store_profiles = store_profiles
+        self._segments: List[str] = []
+
+    @property
+    def n_segments(self) -> int:
+        return len(self._segments)
+
+    def _manifest(self) -> Optional[Dict]:
+        file = os.path.join(self.directory, CHECKPOINT_MANIFEST)
+        if not data_store.file_exists(file):
+            return None
+        with data_store.open(file, "r") as f:
+            return json.load(f)
+
+    def _write_manifest(self):
+        if data_store is LOCAL_FS_STORE:
+            os.makedirs(self.directory, exist_ok=True)
+        with data_store.open(os.path.join(self.directory, CHECKPOINT_MANIFEST), "w") as f:
+            json.dump(
+                {
+                    "format": CHECKPOINT_FORMAT,
+                    "version": CHECKPOINT_VERSION,
+                    "fingerprint": self.fingerprint,
+                    "store_profiles": self.store_profiles,
+                },
+                f,
+            )
+
+    def _segment_files(self) -> List[str]:
+        if not data_store.is_dir(self.directory):
+            return []
+        names = [os.path.basename(f) for f in data_store.list_files(self.directory)]
+        return sorted(
+            n for n in names if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_EXTENSION)
+        )
+
+    def clear(self):
+        """Removes the checkpoint directory and its segments"""
+        if not data_store.is_dir(self.directory):
+            return
+        for name in data_store.list_files(self.directory):
+            data_store.remove(os.path.join(self.directory, os.path.basename(name)))
+        data_store.rmdir(self.directory)
+        self._segments = []
+
+    def open(self, resume: bool = True) -> bool:
+        """
+        Prepares the checkpoint for a run, keeping the segments of a previous run of the same cache if resume is set
+        :return True if segments of a previous run are resumed
+        """
+        manifest = self._manifest()
+        compatible = (
+            manifest is not None
+            and manifest.get("format") == CHECKPOINT_FORMAT
+            and manifest.get("version") == CHECKPOINT_VERSION
+            and manifest.get("fingerprint") == self.fingerprint
+            # the profiles of the resumed segments are needed to store the profiles of the cache
+            and (manifest.get("store_profiles", False) or not self.store_profiles)
+        )
+        if resume and compatible:
+            self._segments = self._segment_files()
+            return len(self._segments) > 0
+        if manifest is not None or data_store.is_dir(self.directory):
+            if resume:
+                LOGGER.info(f"Discarding the checkpoint in {self.directory}, it was made for other inputs or parameters")
+            self.clear()
+        self._write_manifest()
+        return False
+
+    def segments(self) -> Iterator[LinkSegment]:
+        """
+        The segments of the checkpoint in the order they were appended.
+        Unreadable segments, e.g. of a run interrupted while writing one, are removed and skipped.
+        """
+        for name in list(self._segments):
+            file = os.path.join(self.directory, name)
+            try:
+                segment = LinkSegment.load(file)
+            except Exception as e:
+                LOGGER.warning(f"Removing unreadable checkpoint segment {file}: {e}")
+                data_store.remove(file)
+                self._segments.remove(name)
+                continue
+            yield segment
+
+    def append(self, segment: LinkSegment):
+        """Writes a segment after the existing ones"""
+        last = int(self._segments[-1][len(SEGMENT_PREFIX) : -len(SEGMENT_EXTENSION)]) if self._segments else 0
+        name = segment_name(last + 1)
+        segment.save(os.path.join(self.directory, name))
+        self._segments.append(name)
@@ -5,7 +5,7 @@ import math
 import numpy as np
 import pandas as pd
 
-from giga.schemas.geo import PairwiseDistance
+from giga.schemas.geo import PairwiseDistance, EdgeArray
 from giga.schemas.tech import ConnectivityTechnology
 from giga.viz.notebooks.helpers import output_to_table
 
@@ -176,19 +176,28 @@ class SchoolConnectionCosts(BaseModel):
 
 class FiberModelResults(BaseModel):
 
-    distances: List[PairwiseDistance]
-    complete_network_distances: List[PairwiseDistance] = []
+    distances: Union[EdgeArray, List[PairwiseDistance]]
+    complete_network_distances: Union[EdgeArray, List[PairwiseDistance]] = []
+
+    class Config:
+        arbitrary_types_allowed = True
 
 
 class CellularModelResults(BaseModel):
 
-    distances: List[PairwiseDistance]
+    distances: Union[EdgeArray, List[PairwiseDistance]]
+
+    class Config:
+        arbitrary_types_allowed = True
 
 
 class P2PModelResults(BaseModel):
 
-    distances: List[PairwiseDistance]
-    complete_network_distances: List[PairwiseDistance] = []
+    distances: Union[EdgeArray, List[PairwiseDistance]]
+    complete_network_distances: Union[EdgeArray, List[PairwiseDistance]] = []
+
+    class Config:
+        arbitrary_types_allowed = True
 
 class GenericModelResults(BaseModel):
 
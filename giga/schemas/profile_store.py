@@ -0,0 +1,223 @@
+import os
+from typing import List, Dict, Tuple
+import numpy as np
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from giga.schemas.geo import PairwiseDistance, UniqueCoordinate
+from giga.schemas.distance_cache import _save_array, _load_array
+from giga.data.store.stores import COUNTRY_DATA_STORE as data_store, LOCAL_FS_STORE
+
+
+# profile stores are directories next to the cache they were built for, e.g. p2p_cache.profiles
+PROFILE_STORE_EXTENSION = ".profiles"
+PROFILE_STORE_FORMAT = "giga-elevation-profiles"
+PROFILE_STORE_VERSION = 1
+PROFILE_STORE_MANIFEST = "manifest.json"
+PROFILE_STORE_ARRAYS = ["ids", "coordinates", "properties", "starts", "ends", "distances", "elevations"]
+# float16 halves the size of the store, at a resolution of 0.5 to 4 meters above 1000 meters of elevation
+PROFILE_DTYPES = ["float32", "float16"]
+DEFAULT_PROFILE_DTYPE = "float32"
+# builder parameters that only affect the line of sight evaluation of the profiles, not the profiles themselves
+LOS_PARAMETERS = ["los_buffer_meters", "receiver_height_meters", "earth_curvature", "fresnel_frequency_ghz"]
+
+
+def profile_options(args) -> Dict:
+    """The profile type of args when it is not the default one, as a cache parameter"""
+    dtype = getattr(args, "profile_dtype", DEFAULT_PROFILE_DTYPE)
+    return {"profile_dtype": dtype} if dtype != DEFAULT_PROFILE_DTYPE else {}
+
+
+def profile_store_path(workspace: str, cache: str) -> str:
+    """Path of the profile store of a cache in a workspace, e.g. p2p_cache"""
+    return os.path.join(workspace, f"{cache}{PROFILE_STORE_EXTENSION}")
+
+
+def clear_profile_store(workspace: str, cache: str) -> bool:
+    """
+    Removes the profile store of a cache, e.g. after the cache was patched without sampling all its profiles
+    :return True if a store was removed
+    """
+    directory = profile_store_path(workspace, cache)
+    if not data_store.is_dir(directory):
+        return False
+    for name in data_store.list_files(directory):
+        data_store.remove(os.path.join(directory, os.path.basename(name)))
+    data_store.rmdir(directory)
+    return True
+
+
+class ElevationProfileStore:
+    """
+    Raw elevation profiles of the candidate pairs of a line of sight cache, before any receiver, tower
+    or buffer height is added, so that the cache can be rebuilt for new line of sight settings without
+    sampling the profiles again.
+    Pair i goes from node starts[i], the school the profile starts at and the second coordinate of the pair,
+    to node ends[i], the first coordinate of the pair. The samples of profile i are elevations[i], NaN where
+    no elevation was available, evenly spaced in lat/lon between the coordinates of its nodes.
+    """
+
+    def __init__(self, ids, coordinates, properties, starts, ends, distances, elevations):
+        self.ids = list(ids)
+        self.coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        self.properties = list(properties)
+        self.starts = np.asarray(starts, dtype=np.int32)
+        self.ends = np.asarray(ends, dtype=np.int32)
+        self.distances = np.asarray(distances, dtype=np.float64)
+        self.elevations = np.asarray(elevations)
+        self.index = {cid: i for i, cid in enumerate(self.ids)}
+
+    @staticmethod
+    def from_profiles(
+        profiles: List[Tuple[List[PairwiseDistance], np.ndarray]], dtype: str = DEFAULT_PROFILE_DTYPE
+    ) -> "ElevationProfileStore":
+        """
+        Collects the profiles of batches of pairs
+        :param profiles, batches of pairs with an (n, samples) array of the elevations of their profiles
+        :param dtype, the type the elevations are stored as, float32 or float16
+        """
+        index, coordinates, properties = {}, [], []
+
+        def intern(c: UniqueCoordinate) -> int:
+            i = index.get(c.coordinate_id, None)
+            if i is None:
+                i = index[c.coordinate_id] = len(coordinates)
+                coordinates.append(c.coordinate if c.coordinate is not None else (np.nan, np.nan))
+                properties.append(json.dumps(c.properties))
+            return i
+
+        starts, ends, distances = [], [], []
+        for pairs, _ in profiles:
+            for p in pairs:
+                starts.append(intern(p.coordinate2))
+                ends.append(intern(p.coordinate1))
+                distances.append(p.distance)
+        elevations = [e for pairs, e in profiles if len(pairs) > 0]
+        return ElevationProfileStore(
+            list(index),
+            np.reshape(coordinates, (-1, 2)),
+            properties,
+            starts,
+            ends,
+            distances,
+            np.concatenate(elevations).astype(dtype) if len(elevations) > 0 else np.empty((0, 0), dtype=dtype),
+        )
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def samples(self) -> int:
+        return self.elevations.shape[1] if self.elevations.ndim == 2 else 0
+
+    def coordinate(self, i: int) -> UniqueCoordinate:
+        lat, lon = self.coordinates[i]
+        return UniqueCoordinate(
+            coordinate_id=self.ids[i],
+            coordinate=None if np.isnan(lat) else [float(lat), float(lon)],
+            properties=json.loads(self.properties[i]),
+        )
+
+    def pairs(self, rows: np.ndarray, distance_type: str = "euclidean") -> List[PairwiseDistance]:
+        """Rebuilds the pairs of the given profiles, in the order of the rows"""
+        nodes: Dict[int, UniqueCoordinate] = {}
+        node = lambda i: nodes[i] if i in nodes else nodes.setdefault(i, self.coordinate(i))
+        return [
+            PairwiseDistance(
+                pair_ids=(self.ids[j], self.ids[i]),
+                distance=float(self.distances[r]),
+                coordinate1=node(j),
+                coordinate2=node(i),
+                distance_type=distance_type,
+            )
+            for r, i, j in zip(
+                np.asarray(rows).tolist(), self.starts[rows].tolist(), self.ends[rows].tolist()
+            )
+        ]
+
+    def save(self, directory: str, **metadata):
+        """
+        Writes the arrays to a profile store directory.
+        The manifest is written last, so a directory without one is an incomplete store.
+        """
+        if data_store is LOCAL_FS_STORE:
+            os.makedirs(directory, exist_ok=True)
+        arrays = {
+            "ids": np.asarray(self.ids, dtype=str),
+            "coordinates": self.coordinates,
+            "properties": np.asarray(self.properties, dtype=str),
+            "starts": self.starts,
+            "ends": self.ends,
+            "distances": self.distances,
+            "elevations": self.elevations,
+        }
+        for name, array in arrays.items():
+            _save_array(os.path.join(directory, f"{name}.npy"), array)
+        manifest = {
+            "format": PROFILE_STORE_FORMAT,
+            "version": PROFILE_STORE_VERSION,
+            "n_nodes": len(self.ids),
+            "n_profiles": len(self),
+            "samples": self.samples,
+            "dtype": str(self.elevations.dtype),
+            "arrays": PROFILE_STORE_ARRAYS,
+            **metadata,
+        }
+        with data_store.open(os.path.join(directory, PROFILE_STORE_MANIFEST), "w") as f:
+            json.dump(manifest, f)
+
+    @staticmethod
+    def read_manifest(directory: str) -> Dict:
+        with data_store.open(os.path.join(directory, PROFILE_STORE_MANIFEST), "r") as f:
+            manifest = json.load(f)
+        if manifest.get("format") != PROFILE_STORE_FORMAT:
+            raise ValueError(f"{directory} is not an elevation profile store")
+        if manifest.get("version") != PROFILE_STORE_VERSION:
+            raise ValueError(
+                f"Unsupported elevation profile store version {manifest.get('version')} in {directory}, "
+                f"expected version {PROFILE_STORE_VERSION}"
+            )
+        return manifest
+
+    @staticmethod
+    def load(directory: str, mmap: bool = True):
+        """
+        Loads the arrays of a profile store directory, memory-mapping them when possible
+        :return a tuple of the ElevationProfileStore and the manifest of the store
+        """
+        manifest = ElevationProfileStore.read_manifest(directory)
+        arrays = {
+            name: _load_array(os.path.join(directory, f"{name}.npy"), mmap=mmap)
+            for name in PROFILE_STORE_ARRAYS
+        }
+        arrays["ids"] = arrays["ids"].tolist()
+        arrays["properties"] = arrays["properties"].tolist()
+        return ElevationProfileStore(**arrays), manifest
+
+
+def save_profile_store(
+    profiles: List[Tuple[List[PairwiseDistance], np.ndarray]],
+    workspace: str,
+    manifest,
+    dtype: str = DEFAULT_PROFILE_DTYPE,
+) -> str:
+    """
+    Writes the profiles of the candidate pairs of a cache to its profile store, with the inputs of the
+    cache and the parameters that produced the profiles
+    :param manifest, the CacheManifest of the cache
+    :return the directory of the store
+    """
+    store = ElevationProfileStore.from_profiles(profiles, dtype)
+    directory = profile_store_path(workspace, manifest.cache)
+    distance_types = [pairs[0].distance_type for pairs, _ in profiles if len(pairs) > 0]
+    store.save(
+        directory,
+        cache=manifest.cache,
+        inputs=manifest.inputs,
+        parameters={k: v for k, v in manifest.parameters.items() if k not in LOS_PARAMETERS},
+        distance_type=distance_types[0] if len(distance_types) > 0 else "euclidean",
+    )
+    return directory
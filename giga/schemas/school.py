@@ -5,7 +5,7 @@ import pandas as pd
 import numpy as np
 import math
 
-from giga.schemas.geo import UniqueCoordinate
+from giga.schemas.geo import UniqueCoordinate, CoordinateArray
 from giga.data.store.stores import COUNTRY_DATA_STORE
 
 DEFAULT_POWER_REQUIRED_PER_SCHOOL = 11_000  # Watts
@@ -227,6 +227,18 @@ class GigaSchoolTable(BaseModel):
         """Transforms the school table into a table of simplified coordinate"""
         return [s.to_coordinates() for s in self.schools]
 
+    def to_coordinate_array(self) -> CoordinateArray:
+        """Transforms the school table into a columnar coordinate array"""
+        return CoordinateArray(
+            [s.giga_id for s in self.schools],
+            [[s.lat, s.lon] for s in self.schools],
+            properties={
+                "has_electricity": np.array(
+                    [s.has_electricity for s in self.schools], dtype=bool
+                )
+            },
+        )
+
     def update_bw_demand_all(self, demand):
         for s in self.schools:
             s.bandwidth_demand = demand
@@ -31,6 +31,9 @@ MASTER_DEFAULT_NAME = "_school_geolocation_coverage_master.csv"
 #backup dir
 BACKUP_DIR = "backup"
 
+#content addressed cache store dir
+CACHE_STORE_DIR = "cache_store"
+
 #file names of extra file
 SCHOOLS_FILE = "schools.csv"
 CELL_FILE = "cellular.csv"
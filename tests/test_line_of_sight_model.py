@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from giga.schemas.geo import ElevationPoint
+from giga.models.nodes.elevation.line_of_sight_model import LineofSightModel
+
+
+SAMPLES = 6
+START = (1.0, 35.0)
+END = (1.05, 35.08)
+# school receiver height and default buffer of the cache builders
+RECEIVER_HEIGHT = 5.0
+BUFFER = 5.0
+
+
+def sample_points(n_samples=SAMPLES):
+    lats = np.linspace(START[0], END[0], n_samples)
+    lons = np.linspace(START[1], END[1], n_samples)
+    return lats, lons
+
+
+def scalar_result(lats, lons, elevations, start_height, end_height, buffer):
+    elevations = [None if np.isnan(e) else float(e) for e in elevations]
+    elevations[0] = (elevations[0] or 0.0) + start_height
+    elevations[-1] = (elevations[-1] or 0.0) + end_height
+    points = [
+        ElevationPoint(coordinates=[lat, lon], elevation=e)
+        for lat, lon, e in zip(lats, lons, elevations)
+    ]
+    return LineofSightModel().determine_obstructions(points, buffer)
+
+
+def batch_result(lats, lons, elevations, start_height, end_height, buffer):
+    return LineofSightModel().obstructions(
+        lats[None, :],
+        lons[None, :],
+        np.asarray(elevations, dtype=np.float64)[None, :],
+        start_heights=start_height,
+        end_heights=end_height,
+        elevation_buffer_meters=buffer,
+    )[0]
+
+
+PROFILES = {
+    "flat": [100.0] * SAMPLES,
+    "flat_missing": [np.nan] * SAMPLES,
+    "flat_partly_missing": [100.0, np.nan, 100.0, np.nan, 100.0, 100.0],
+    "uphill": list(np.linspace(100.0, 300.0, SAMPLES)),
+    "downhill": list(np.linspace(300.0, 100.0, SAMPLES)),
+    "ridge": [100.0, 120.0, 400.0, 420.0, 130.0, 100.0],
+    "valley": [300.0, 150.0, 90.0, 80.0, 140.0, 310.0],
+    "crossing": [100.0, 99.0, 101.0, 100.0, 102.0, 100.0],
+}
+
+
+@pytest.mark.parametrize("name", sorted(PROFILES))
+@pytest.mark.parametrize(
+    "start_height,end_height,buffer",
+    [
+        (RECEIVER_HEIGHT, RECEIVER_HEIGHT, BUFFER),
+        (RECEIVER_HEIGHT, 30.0, BUFFER),
+        (0.0, 0.0, 0.0),
+        (2.0, 40.0, 0.0),
+    ],
+)
+def test_batch_matches_determine_obstructions(name, start_height, end_height, buffer):
+    lats, lons = sample_points()
+    elevations = PROFILES[name]
+    assert batch_result(
+        lats, lons, elevations, start_height, end_height, buffer
+    ) == scalar_result(lats, lons, elevations, start_height, end_height, buffer)
+
+
+def test_batch_matches_determine_obstructions_on_random_profiles():
+    rng = np.random.default_rng(0)
+    lats, lons = sample_points()
+    for _ in range(200):
+        elevations = rng.uniform(0.0, 200.0, SAMPLES)
+        start_height, end_height = rng.uniform(0.0, 50.0, 2)
+        buffer = rng.uniform(0.0, 10.0)
+        assert batch_result(
+            lats, lons, elevations, start_height, end_height, buffer
+        ) == scalar_result(lats, lons, elevations, start_height, end_height, buffer)